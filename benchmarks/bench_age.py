@@ -0,0 +1,53 @@
+"""
+Benchmark for the mutual age-compatibility index in filter/age.py.
+
+Puts every generated user into a single location bucket, builds an AgeIndex,
+counts candidates for every user and expands a sample of candidate lists.
+A naive pair loop over a small sample is timed for comparison and used to
+check the index's answers.
+
+Run from the repo root with: python -m benchmarks.bench_age [num_users]
+"""
+import random
+import sys
+import time
+
+from filter.age import AgeIndex, age_compatible
+from generate_users import generate_users
+
+NUM_USERS = 100_000
+SAMPLE = 200
+
+
+def main(num_users=NUM_USERS):
+    t0 = time.perf_counter()
+    users = generate_users(num_users, seed=7)
+    print(f"generated {num_users} users in {time.perf_counter() - t0:.2f}s")
+
+    t0 = time.perf_counter()
+    index = AgeIndex(users)
+    build = time.perf_counter() - t0
+    print(f"index build: {build:.3f}s ({num_users / build:,.0f} users/s)")
+
+    t0 = time.perf_counter()
+    total = sum(index.counts().values())
+    elapsed = time.perf_counter() - t0
+    print(f"candidate counts for all users: {elapsed:.3f}s, {total // 2:,} compatible pairs")
+
+    sample = random.Random(7).sample(users, min(SAMPLE, num_users))
+    t0 = time.perf_counter()
+    expanded = sum(len(list(index.candidates(u))) for u in sample)
+    elapsed = time.perf_counter() - t0
+    print(f"expand {len(sample)} candidate lists: {elapsed:.3f}s ({expanded:,} ids)")
+
+    # naive reference: one user against the whole bucket, then extrapolate
+    t0 = time.perf_counter()
+    for u in sample:
+        naive = {v['uuid'] for v in users if v is not u and age_compatible(u, v)}
+        assert naive == set(index.candidates(u)) and len(naive) == index.count(u)
+    per_user = (time.perf_counter() - t0) / len(sample)
+    print(f"naive pair loop: {per_user * 1000:.1f}ms/user, ~{per_user * num_users:.0f}s for the whole bucket")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NUM_USERS)
@@ -0,0 +1,55 @@
+"""
+Benchmark for multiprocess batch matching in batch_match.py.
+
+Generates users, runs `match_batch` with 1, 2, 4, ... workers (up to the CPU
+count), checks that every run returns the same matches and reports throughput
+and speedup over the single-process run. Also compares the size of one
+serialized shard with pickling the same user dicts.
+
+Run from the repo root with: python -m benchmarks.bench_batch [num_users]
+"""
+import os
+import pickle
+import sys
+import time
+
+from batch_match import build_shard, match_batch
+from filter.location_index import LocationIndex
+from generate_users import generate_users
+
+NUM_USERS = 20_000
+
+
+def main(num_users=NUM_USERS):
+    t0 = time.perf_counter()
+    users = generate_users(num_users, seed=7)
+    print(f"generated {num_users} users in {time.perf_counter() - t0:.2f}s")
+
+    index = LocationIndex(users)
+    loc = index.locations()[0]
+    groups = [(loc, index.members(loc))]
+    data, masks, _, _, _ = build_shard(groups, [0])
+    pickled = len(pickle.dumps(groups[0][1]))
+    print(f"shard of {len(groups[0][1])} users: {len(data) + len(masks):,} bytes serialized vs {pickled:,} bytes pickled")
+
+    cpus = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cpus:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpus:
+        counts.append(cpus)
+    baseline = None
+    reference = None
+    for workers in counts:
+        t0 = time.perf_counter()
+        matches = match_batch(users, workers=workers)
+        elapsed = time.perf_counter() - t0
+        if reference is None:
+            reference, baseline = matches, elapsed
+        assert matches == reference, "results differ between worker counts"
+        print(f"workers={workers:<3} {elapsed:7.2f}s  {num_users / elapsed:>10,.0f} users/s  speedup {baseline / elapsed:.2f}x")
+    print(f"{len(reference)} users with candidates")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,78 @@
+"""
+Benchmark for the TF-IDF text index in filter/nlp_filtering.py.
+
+Generates profiles (bio, interests and free-text answers only), builds a
+TextIndex, then measures top-k query latency, bio-edit update latency and the
+cost of an IDF refresh. A brute-force all-profiles cosine for a few queries
+checks the results. The generator draws text from a few dozen templates, so the
+vocabulary is tiny and every posting list is dense: this is the worst case
+for the inverted index. Real bios spread over far more terms.
+
+Run from the repo root with: python -m benchmarks.bench_nlp [num_users]
+"""
+import math
+import random
+import sys
+import time
+
+from filter.nlp_filtering import TextIndex
+from generate_users import build_questions, generate_users
+
+NUM_USERS = 100_000
+QUERIES = 500
+
+
+def _pct(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def main(num_users=NUM_USERS):
+    random.seed(5)
+    questions = [q for q in build_questions() if q['type'] == 'free-text']
+    users = generate_users(num_users, questions, seed=5)
+
+    t0 = time.perf_counter()
+    index = TextIndex(users)
+    print(f"build {num_users} profiles: {time.perf_counter() - t0:.2f}s, {len(index._vocab)} terms")
+
+    rng = random.Random(5)
+    sample = rng.sample(users, QUERIES)
+
+    # brute-force cosine against every profile for a few queries, as a reference
+    docs = index._docs
+    for user in sample[:3]:
+        uid = user['uuid']
+        t0 = time.perf_counter()
+        query = {t: tf * index._weight(t) for t, tf in docs[uid].items()
+                 if len(index._postings[t]) <= index.max_df_ratio * len(index)}
+        qnorm = math.sqrt(sum(w * w for w in query.values()))
+        brute = sorted((sum(w * doc.get(t, 0) * index._weight(t) for t, w in query.items()) / (qnorm * index._norms[other])
+                        for other, doc in docs.items() if other != uid), reverse=True)[:10]
+        brute_time = time.perf_counter() - t0
+        got = [score for _, score in index.similar(uid, 10)]
+        assert all(math.isclose(a, b, rel_tol=1e-9) for a, b in zip(got, brute)), (got, brute)
+    print(f"brute-force all-profiles cosine: {brute_time * 1000:.0f}ms per query")
+    latencies = []
+    for user in sample:
+        t0 = time.perf_counter()
+        index.similar(user['uuid'], 10)
+        latencies.append(time.perf_counter() - t0)
+    print(f"top-10 query: p50={_pct(latencies, 50) * 1000:.2f}ms p99={_pct(latencies, 99) * 1000:.2f}ms")
+
+    bios = ["Chef and marathon runner looking for brunch dates.", "Quiet bookworm, loves jazz and long walks."]
+    latencies = []
+    for i, user in enumerate(sample):
+        edited = dict(user, bio=bios[i % 2])
+        t0 = time.perf_counter()
+        index.update(edited)
+        latencies.append(time.perf_counter() - t0)
+    print(f"bio update: p50={_pct(latencies, 50) * 1e6:.0f}us p99={_pct(latencies, 99) * 1e6:.0f}us")
+
+    t0 = time.perf_counter()
+    index.refresh()
+    print(f"full IDF/norm refresh: {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NUM_USERS)
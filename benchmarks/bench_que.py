@@ -0,0 +1,49 @@
+"""
+Synthetic load test for the asyncio MatchQueue in room/que.py.
+
+Generates users with generate_users.py, pushes them through one MatchQueue as
+fast as backpressure allows (optionally rate-limited), and reports enqueue
+throughput, match/timeout counts and p50/p99 enqueue-to-match latency.
+
+Run from the repo root with: python -m benchmarks.bench_que [num_users] [rate_per_s]
+"""
+import asyncio
+import sys
+import time
+
+from generate_users import generate_users
+from room.que import MatchQueue
+
+NUM_USERS = 50_000
+
+
+async def run(num_users=NUM_USERS, rate=None, maxsize=5_000, max_wait=1.0):
+    users = generate_users(num_users, seed=11)
+    futures = []
+    async with MatchQueue(maxsize, max_wait=max_wait) as queue:
+        t0 = time.perf_counter()
+        for i, user in enumerate(users):
+            futures.append(await queue.enqueue(user))
+            if rate is not None:
+                # sleep whenever we get ahead of the target rate
+                ahead = (i + 1) / rate - (time.perf_counter() - t0)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        enqueue_elapsed = time.perf_counter() - t0
+        results = await asyncio.gather(*futures)
+        total_elapsed = time.perf_counter() - t0
+        stats = queue.stats()
+
+    matched = sum(1 for r in results if r is not None)
+    print(f"enqueued {num_users} users in {enqueue_elapsed:.2f}s ({num_users / enqueue_elapsed:,.0f}/s)")
+    print(f"all futures resolved after {total_elapsed:.2f}s: {matched} matched, {stats['timed_out']} timed out")
+    p50, p99 = stats['p50'], stats['p99']
+    if p50 is not None:
+        print(f"enqueue-to-match latency p50={p50 * 1000:.2f}ms p99={p99 * 1000:.2f}ms")
+    return stats
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_USERS
+    r = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    asyncio.run(run(n, r))
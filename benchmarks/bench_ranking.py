@@ -0,0 +1,50 @@
+"""
+Benchmark for activity/freshness ranking in filter/ranking.py.
+
+Builds one large bucket of generated users, then compares `top_k` and paging
+through `iter_ranked` with fully sorting the bucket by score, and checks that
+both orders agree.
+
+Run from the repo root with: python -m benchmarks.bench_ranking [bucket_size] [k]
+"""
+import itertools
+import sys
+import time
+
+from filter.ranking import ActivityRanker
+from generate_users import REFERENCE_TIME, generate_users
+
+BUCKET_SIZE = 50_000
+K = 20
+REPEAT = 5
+
+
+def best_of(fn, repeat=REPEAT):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main(bucket_size=BUCKET_SIZE, k=K):
+    users = generate_users(bucket_size, seed=5, now=REFERENCE_TIME)
+    t0 = time.perf_counter()
+    ranker = ActivityRanker(users, now=REFERENCE_TIME)
+    print(f"scored {bucket_size} users in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    ids = [user['uuid'] for user in users]
+    sort_s, ordered = best_of(lambda: sorted(((uid, ranker.score(uid)) for uid in ids), key=lambda item: -item[1]))
+    top_s, top = best_of(lambda: ranker.top_k(k))
+    pages_s, paged = best_of(lambda: list(itertools.islice(ranker.iter_ranked(), 5 * k)))
+    assert [s for _, s in top] == [s for _, s in ordered[:k]]
+    assert [s for _, s in paged] == [s for _, s in ordered[:5 * k]]
+    print(f"full sort          {sort_s * 1000:8.2f} ms")
+    print(f"top_k({k})          {top_s * 1000:8.2f} ms  ({sort_s / top_s:.1f}x)")
+    print(f"first {5 * k} via pages {pages_s * 1000:8.2f} ms  ({sort_s / pages_s:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,72 @@
+"""
+Benchmark for the per-user recommendation cache in recommend.py.
+
+Generates users, picks the most recently active ones (latest `last_login`)
+as the requesters and replays a skewed request stream against a
+`Recommender`, with a share of requests replaced by profile updates (new
+`updated_at`, sometimes a ban). Reports hit rate, invalidations and hit/miss
+latency for a few cache sizes, next to the cost of computing every request
+from scratch.
+
+Run from the repo root with: python -m benchmarks.bench_recommend [num_users] [num_requests]
+"""
+import random
+import sys
+import time
+
+from generate_users import generate_users
+from recommend import Recommender
+
+NUM_USERS = 20_000
+NUM_REQUESTS = 20_000
+ACTIVE_SHARE = 0.1
+UPDATE_SHARE = 0.02
+
+
+def workload(users, num_requests, seed=3):
+    """(kind, payload) events: ('get', uid) for active users (Zipf-skewed), ('update', user) now and then."""
+    rng = random.Random(seed)
+    active = sorted(users, key=lambda u: u['last_login'], reverse=True)[:max(1, int(len(users) * ACTIVE_SHARE))]
+    weights = [1.0 / (rank + 1) for rank in range(len(active))]
+    events = []
+    for i, user in enumerate(rng.choices(active, weights, k=num_requests)):
+        if rng.random() < UPDATE_SHARE:
+            changed = dict(rng.choice(users), updated_at=f"bench-{i}")
+            if rng.random() < 0.1:
+                changed['is_banned'] = True
+            events.append(('update', changed))
+        else:
+            events.append(('get', user['uuid']))
+    return events
+
+
+def replay(rec, events):
+    t0 = time.perf_counter()
+    for kind, payload in events:
+        if kind == 'get':
+            rec.recommend(payload)
+        else:
+            rec.update(payload)
+    return time.perf_counter() - t0
+
+
+def main(num_users=NUM_USERS, num_requests=NUM_REQUESTS):
+    users = generate_users(num_users, seed=21)
+    events = workload(users, num_requests)
+    gets = sum(1 for kind, _ in events if kind == 'get')
+    print(f"{num_users} users, {gets} requests from the {ACTIVE_SHARE:.0%} most active, {len(events) - gets} updates")
+
+    uncached = Recommender(users, maxsize=0)
+    elapsed = replay(uncached, events)
+    print(f"no cache       {elapsed:6.2f}s  {gets / elapsed:>9,.0f} req/s  miss p50 {uncached.stats()['miss_p50'] * 1e3:.3f} ms")
+    for maxsize in (100, 1_000, 10_000):
+        rec = Recommender(users, maxsize=maxsize)
+        elapsed = replay(rec, events)
+        s = rec.stats()
+        print(f"maxsize={maxsize:<6} {elapsed:6.2f}s  {gets / elapsed:>9,.0f} req/s  hit rate {s['hit_rate']:.1%}  "
+              f"evicted {s['evicted']}  invalidated {s['invalidated']}  "
+              f"hit p50 {s['hit_p50'] * 1e6:.1f} us  miss p50 {s['miss_p50'] * 1e3:.3f} ms  miss p99 {s['miss_p99'] * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,82 @@
+"""
+Throughput benchmark for room/room.py.
+
+Creates rooms for generated user pairs, has one member leave and closes the
+rest, measuring rooms/sec created and torn down:
+ - in-process RoomRegistry driven by a thread pool
+ - ShardedRoomService with shards in worker processes (pipelined batches)
+Also times a timer-wheel expiry sweep over idle rooms.
+
+Run from the repo root with: python -m benchmarks.bench_room [num_rooms]
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from room.room import RoomRegistry, ShardedRoomService
+
+NUM_ROOMS = 100_000
+THREADS = 8
+BATCH = 2_000
+
+
+def _pairs(num_rooms):
+    return [(f"user-{2 * i}", f"user-{2 * i + 1}") for i in range(num_rooms)]
+
+
+def bench_registry(num_rooms=NUM_ROOMS, threads=THREADS):
+    registry = RoomRegistry(64)
+    pairs = _pairs(num_rooms)
+
+    def lifecycle(chunk):
+        for a, b in chunk:
+            room_id = registry.create([a, b])
+            registry.leave(room_id, a)
+            registry.close(room_id)
+
+    chunks = [pairs[i::threads] for i in range(threads)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lifecycle, chunks))
+    elapsed = time.perf_counter() - t0
+    print(f"in-process ({threads} threads): {num_rooms / elapsed:,.0f} rooms/s created+closed")
+    assert len(registry) == 0
+
+
+def bench_expiry(num_rooms=NUM_ROOMS):
+    clock = [0.0]
+    registry = RoomRegistry(64, idle_timeout=60, clock=lambda: clock[0])
+    for i, (a, b) in enumerate(_pairs(num_rooms)):
+        clock[0] = i * 0.0001
+        registry.create([a, b])
+    clock[0] += 30
+    t0 = time.perf_counter()
+    early = registry.expire()
+    sweep_early = time.perf_counter() - t0
+    clock[0] += 120
+    t0 = time.perf_counter()
+    expired = registry.expire()
+    sweep = time.perf_counter() - t0
+    print(f"expiry: nothing due in {sweep_early * 1000:.2f}ms ({len(early)} rooms), "
+          f"{len(expired):,} rooms expired in {sweep:.3f}s")
+
+
+def bench_service(num_rooms=NUM_ROOMS, workers=None):
+    pairs = _pairs(num_rooms)
+    with ShardedRoomService(workers) as service:
+        t0 = time.perf_counter()
+        for i in range(0, num_rooms, BATCH):
+            chunk = pairs[i:i + BATCH]
+            ids = service.call_many([('create', ([a, b],), {}) for a, b in chunk])
+            service.call_many([('leave', (room_id, a), {}) for room_id, (a, _) in zip(ids, chunk)])
+            service.call_many([('close', (room_id,), {}) for room_id in ids])
+        elapsed = time.perf_counter() - t0
+        print(f"multiprocess ({service.num_workers} workers): {num_rooms / elapsed:,.0f} rooms/s created+closed")
+        assert service.stats()['rooms'] == 0
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ROOMS
+    bench_registry(n)
+    bench_expiry(n)
+    bench_service(n)
@@ -0,0 +1,213 @@
+"""
+Benchmark harness for the user pipeline across dataset sizes.
+
+For each size, users are generated with `generate_users.stream_users` (seeded)
+into a scratch directory as JSON and NDJSON, then every stage is run a few
+times:
+ - parse_json_file     whole-file JSON parse (cold start)
+ - snapshot_load       warm start from the `snapshot.py` cache of the same file
+ - iter_users_ndjson   streaming NDJSON read
+ - filter_by_location  grouping + write
+ - is_profile_valid    validity grouping + write
+ - pipeline            validity -> location -> gender -> age in one pass
+ - delta_apply_100     GroupingState.apply with batches of 100 updated users
+For every stage the harness records run-time percentiles (p50/p95/p99),
+throughput at the median and peak traced memory, and writes them to a results
+file. If a baseline file exists, any stage whose p50 got slower than the
+baseline by more than `--tolerance` fails the run (exit status 1).
+
+Baselines are machine-specific, so none is checked in; create one with
+--update-baseline on the machine that runs the comparison.
+
+Run from the repo root with:
+    python -m benchmarks.harness [--sizes 1000,10000,100000] [--repeat 5]
+        [--results benchmarks/results.json] [--baseline benchmarks/baseline.json]
+        [--tolerance 0.25] [--update-baseline]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from filter.deltas import GroupingState
+from filter.is_profile_valid import is_profile_valid
+from filter.location import filter_by_location
+from filter.pipeline import Pipeline
+from generate_users import build_questions, stream_users, write_users
+from instrumentation import percentile
+from json_parser import iter_ndjson, parse_json_file
+from snapshot import read_snapshot, write_snapshot
+
+DEFAULT_SIZES = (1_000, 10_000)
+DEFAULT_QUESTIONS = 20
+DELTA_BATCH = 100
+# regressions smaller than this are treated as timer noise
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def _time_runs(fn: Callable[[], Any], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def _peak_bytes(fn: Callable[[], Any]) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _stages(json_path: Path, ndjson_path: Path, users: List[Dict[str, Any]], out_dir: Path) -> Dict[str, Callable[[], Any]]:
+    def delta_batches():
+        state = GroupingState(users)
+        batches = []
+        for start in range(0, min(len(users), 20 * DELTA_BATCH), DELTA_BATCH):
+            batch = [dict(u, updated_at=f"bench-{start}", is_verified=not u.get('is_verified'))
+                     for u in users[start:start + DELTA_BATCH]]
+            batches.append(batch)
+        return state, batches
+
+    return {
+        'parse_json_file': lambda: parse_json_file(str(json_path)),
+        'snapshot_load': lambda: read_snapshot(json_path),
+        'iter_users_ndjson': lambda: sum(1 for _ in iter_ndjson(str(ndjson_path))),
+        'filter_by_location': lambda: filter_by_location(users, keys_out=out_dir / 'location_keys.json',
+                                                         result_out=out_dir / 'filtered_by_location.json'),
+        'is_profile_valid': lambda: is_profile_valid(None, users),
+        'pipeline': lambda: Pipeline().run(users),
+        'delta_apply_100': delta_batches,
+    }
+
+
+def run_size(size: int, repeat: int, questions: int, memory: bool, scratch: Path) -> List[Dict[str, Any]]:
+    qs = build_questions(questions) if questions else []
+    json_path, ndjson_path = scratch / f'users_{size}.json', scratch / f'users_{size}.ndjson'
+    t0 = time.perf_counter()
+    write_users(stream_users(size, qs, seed=size), json_path)
+    write_users(stream_users(size, qs, seed=size), ndjson_path, 'ndjson')
+    print(f"[{size}] generated in {time.perf_counter() - t0:.2f}s ({json_path.stat().st_size / 1e6:.1f} MB JSON)")
+    users = parse_json_file(str(json_path))
+    write_snapshot(users, json_path)
+    out_dir = scratch / 'out'
+    results = []
+    for stage, fn in _stages(json_path, ndjson_path, users, out_dir).items():
+        if stage == 'delta_apply_100':
+            # per-batch latency: build the state once, time each batch
+            state, batches = fn()
+            samples = []
+            for batch in batches:
+                t0 = time.perf_counter()
+                state.apply(batch)
+                samples.append(time.perf_counter() - t0)
+            items = DELTA_BATCH
+            peak = _peak_bytes(lambda: state.apply([dict(u, updated_at='bench-mem') for u in batches[0]])) if memory else None
+        else:
+            samples = _time_runs(fn, repeat)
+            items = size
+            peak = _peak_bytes(fn) if memory else None
+        p50 = percentile(samples, 50, interpolate=True)
+        row = {
+            'stage': stage, 'size': size, 'runs': len(samples),
+            'p50_s': p50, 'p95_s': percentile(samples, 95, interpolate=True),
+            'p99_s': percentile(samples, 99, interpolate=True),
+            'throughput_per_s': items / p50 if p50 else None,
+            'peak_mb': None if peak is None else peak / 1e6,
+        }
+        results.append(row)
+        peak_text = '' if peak is None else f"  peak {row['peak_mb']:8.1f} MB"
+        print(f"[{size}] {stage:<20} p50 {p50 * 1000:9.2f} ms  p95 {row['p95_s'] * 1000:9.2f} ms  "
+              f"{row['throughput_per_s'] or 0:>12,.0f}/s{peak_text}")
+    startup = {row['stage']: row['p50_s'] for row in results if row['stage'] in ('parse_json_file', 'snapshot_load')}
+    if len(startup) == 2 and startup['snapshot_load']:
+        print(f"[{size}] startup: cold {startup['parse_json_file'] * 1000:.1f} ms, warm {startup['snapshot_load'] * 1000:.1f} ms "
+              f"({startup['parse_json_file'] / startup['snapshot_load']:.1f}x)")
+    return results
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Regression messages for stages slower than the baseline's p50 by more than `tolerance`."""
+    expected = {(row['stage'], row['size']): row for row in baseline}
+    failures = []
+    for row in results:
+        base = expected.get((row['stage'], row['size']))
+        if base is None:
+            continue
+        limit = base['p50_s'] * (1 + tolerance)
+        if row['p50_s'] > limit and row['p50_s'] - base['p50_s'] > MIN_REGRESSION_SECONDS:
+            failures.append(f"{row['stage']} @ {row['size']}: p50 {row['p50_s'] * 1000:.2f} ms vs baseline "
+                            f"{base['p50_s'] * 1000:.2f} ms (+{(row['p50_s'] / base['p50_s'] - 1) * 100:.0f}%)")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time the user pipeline across dataset sizes.")
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help="comma-separated user counts, e.g. 1000,100000,1000000")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per stage and size")
+    parser.add_argument('--questions', type=int, default=DEFAULT_QUESTIONS, help="questions answered per user")
+    parser.add_argument('--results', default='benchmarks/results.json')
+    parser.add_argument('--baseline', default='benchmarks/baseline.json')
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed p50 slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument('--update-baseline', action='store_true', help="write these results as the new baseline")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc peak-memory runs")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    results_path, baseline_path = Path(args.results).resolve(), Path(args.baseline).resolve()
+    cwd = os.getcwd()
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix='bench_') as scratch:
+        # is_profile_valid writes to filter_data/ relative to the working directory
+        os.chdir(scratch)
+        try:
+            for size in sizes:
+                results.extend(run_size(size, args.repeat, args.questions, not args.no_memory, Path(scratch)))
+        finally:
+            os.chdir(cwd)
+    document = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'questions': args.questions,
+        },
+        'results': results,
+    }
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    results_path.write_text(json.dumps(document, indent=2), encoding='utf-8')
+    print(f"wrote {results_path}")
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(document, indent=2), encoding='utf-8')
+        print(f"wrote baseline {baseline_path}")
+        return 0
+    if baseline_path.exists():
+        failures = compare(results, json.loads(baseline_path.read_text(encoding='utf-8'))['results'], args.tolerance)
+        if failures:
+            print("REGRESSIONS:")
+            for line in failures:
+                print(f"  {line}")
+            return 1
+        print(f"no regressions vs {baseline_path} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+from bisect import bisect_left, bisect_right, insort
+from itertools import combinations
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from filter.location_index import user_id
+
+# (age, minage_preference, maxage_preference); users sharing one are interchangeable here
+AgeProfile = Tuple[float, float, float]
+
+
+def age_profile(user: Dict[str, Any]) -> Optional[AgeProfile]:
+    """Return the user's (age, min, max) preference triple, or None without an age.
+
+    A missing bound means that side of the range is open.
+    """
+    age = user.get('age')
+    if age is None:
+        return None
+    lo = user.get('minage_preference')
+    hi = user.get('maxage_preference')
+    return (age, float('-inf') if lo is None else lo, float('inf') if hi is None else hi)
+
+
+def age_compatible(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """True when each user's age falls inside the other's preferred range."""
+    pa, pb = age_profile(a), age_profile(b)
+    if pa is None or pb is None:
+        return False
+    return pa[1] <= pb[0] <= pa[2] and pb[1] <= pa[0] <= pb[2]
+
+
+class AgeIndex:
+    """Mutual age-compatibility index over a bucket of users.
+
+    Users are grouped by age, then by their (min, max) preference. Ages are kept
+    sorted, so the ages a user accepts are one bisect away, and compatibility is
+    decided once per preference group instead of once per user pair. With integer
+    ages and a handful of distinct ranges per age, a query touches a few hundred
+    groups no matter how many users the bucket holds, and only then expands the
+    matching groups into ids.
+    """
+
+    def __init__(self, users: Optional[Iterable[Dict[str, Any]]] = None):
+        self._ages: List[float] = []
+        # age -> (min, max) -> {uid: None}
+        self._groups: Dict[float, Dict[Tuple[float, float], Dict[Any, None]]] = {}
+        self._profiles: Dict[Any, AgeProfile] = {}
+        if users is not None:
+            for user in users:
+                self.add(user)
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    def __contains__(self, uid: Any) -> bool:
+        return uid in self._profiles
+
+    def add(self, user: Dict[str, Any]) -> bool:
+        """Index `user`; returns False (and indexes nothing) when it has no age or id."""
+        uid = user_id(user)
+        profile = age_profile(user)
+        if uid is None or profile is None:
+            return False
+        if uid in self._profiles:
+            self.remove(uid)
+        age, lo, hi = profile
+        by_range = self._groups.get(age)
+        if by_range is None:
+            by_range = self._groups[age] = {}
+            insort(self._ages, age)
+        by_range.setdefault((lo, hi), {})[uid] = None
+        self._profiles[uid] = profile
+        return True
+
+    def remove(self, uid: Any) -> bool:
+        profile = self._profiles.pop(uid, None)
+        if profile is None:
+            return False
+        age, lo, hi = profile
+        by_range = self._groups[age]
+        group = by_range[(lo, hi)]
+        del group[uid]
+        if not group:
+            del by_range[(lo, hi)]
+            if not by_range:
+                del self._groups[age]
+                del self._ages[bisect_left(self._ages, age)]
+        return True
+
+    def _compatible_groups(self, profile: AgeProfile) -> Iterator[Tuple[AgeProfile, Dict[Any, None]]]:
+        age, lo, hi = profile
+        ages = self._ages
+        for i in range(bisect_left(ages, lo), bisect_right(ages, hi)):
+            other_age = ages[i]
+            for (other_lo, other_hi), group in self._groups[other_age].items():
+                if other_lo <= age <= other_hi:
+                    yield (other_age, other_lo, other_hi), group
+
+    def candidates(self, user: Dict[str, Any]) -> Iterator[Any]:
+        """Yield ids of indexed users mutually age-compatible with `user` (excluding itself)."""
+        profile = age_profile(user)
+        if profile is None:
+            return
+        uid = user_id(user)
+        for _, group in self._compatible_groups(profile):
+            for other in group:
+                if other != uid:
+                    yield other
+
+    def count(self, user: Dict[str, Any]) -> int:
+        """Number of compatible candidates for `user`, without listing them."""
+        profile = age_profile(user)
+        if profile is None:
+            return 0
+        uid = user_id(user)
+        total = 0
+        for _, group in self._compatible_groups(profile):
+            total += len(group)
+            if uid in group:
+                total -= 1
+        return total
+
+    def pairs(self) -> Iterator[Tuple[Any, Any]]:
+        """Yield every mutually compatible pair of indexed users exactly once."""
+        for age in self._ages:
+            for (lo, hi), group in self._groups[age].items():
+                profile = (age, lo, hi)
+                for other_profile, other_group in self._compatible_groups(profile):
+                    if other_profile < profile:
+                        continue
+                    if other_profile == profile:
+                        yield from combinations(group, 2)
+                    else:
+                        for a in group:
+                            for b in other_group:
+                                yield a, b
+
+    def counts(self) -> Dict[Any, int]:
+        """Map every indexed id to its number of compatible candidates (one pass per profile)."""
+        result: Dict[Any, int] = {}
+        for age in self._ages:
+            for (lo, hi), group in self._groups[age].items():
+                total = 0
+                self_compatible = False
+                for other_profile, other_group in self._compatible_groups((age, lo, hi)):
+                    total += len(other_group)
+                    if other_profile == (age, lo, hi):
+                        self_compatible = True
+                for uid in group:
+                    result[uid] = total - 1 if self_compatible else total
+        return result
+
+    def candidate_lists(self) -> Dict[Any, List[Any]]:
+        """Map every indexed id to its compatible candidates.
+
+        Ids that share an age profile share candidates, so each distinct profile
+        is resolved once and its groups expanded per member.
+        """
+        result: Dict[Any, List[Any]] = {}
+        for age in self._ages:
+            for (lo, hi), group in self._groups[age].items():
+                pool: List[Any] = []
+                for _, other_group in self._compatible_groups((age, lo, hi)):
+                    pool.extend(other_group)
+                for uid in group:
+                    result[uid] = [other for other in pool if other != uid]
+        return result
+
+
+def filter_by_age(data: Iterable[Dict[str, Any]], uuid: Any, *args, **kwargs) -> List[Any]:
+    """Return ids of users in `data` mutually age-compatible with the user `uuid`.
+
+    Pass `index=` to reuse an `AgeIndex` already built over `data`.
+    """
+    index = kwargs.get('index')
+    users = None
+    if index is None:
+        users = list(data)
+        index = AgeIndex(users)
+    target = None
+    for user in (users if users is not None else data):
+        if user_id(user) == uuid:
+            target = user
+            break
+    if target is None:
+        return []
+    return list(index.candidates(target))
@@ -0,0 +1,279 @@
+"""
+Questionnaire compatibility scoring.
+
+`AnswerEncoder` turns a user's `answers` (keyed q1..qN, see data/questions.json)
+into a fixed-width float vector plus a per-question "answered" mask:
+ - binary and scale answers use a thermometer code (one [t, 1 - t] pair per
+   step of the scale), so the dot product of two answers is 1 - |a - b| / range
+ - multi-choice answers are one-hot over the options
+ - free-text answers are left to filter/nlp_filtering.py
+Every answered question therefore contributes a similarity in [0, 1] to a plain
+dot product, and the compatibility of two users is
+
+    (V_a . V_b) / (M_a . M_b)
+
+i.e. the mean agreement over the questions both answered. A whole bucket is
+scored with two matrix products (NumPy when installed, a pure-Python fallback
+otherwise).
+
+`AnswerVectorCache` persists encoded vectors keyed by uuid and `updated_at`, so
+re-runs only re-encode users who changed.
+"""
+import hashlib
+import heapq
+import json
+import math
+import struct
+import tempfile
+from array import array
+from operator import mul
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from filter.location_index import user_id
+from json_parser import parse_json_file
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised when NumPy isn't installed
+    np = None
+
+QUESTIONS_FILE = 'data/questions.json'
+
+Encoded = Tuple[array, array]
+
+
+class AnswerEncoder:
+    """Fixed vector layout derived from the question list."""
+
+    def __init__(self, questions: Sequence[Dict[str, Any]]):
+        # key -> (question index, vector offset, kind, extra)
+        self.layout: Dict[str, Tuple[int, int, str, Any]] = {}
+        offset = 0
+        qindex = 0
+        for q in questions:
+            kind = q.get('type')
+            if kind == 'binary':
+                extra: Any = (0, 1)
+                width = 2
+            elif kind == 'scale':
+                lo, hi = q.get('scale_min', 1), q.get('scale_max', 5)
+                extra = (lo, hi)
+                width = 2 * max(1, hi - lo)
+            elif kind == 'multi-choice':
+                options = list(q.get('options', []))
+                if not options:
+                    continue
+                extra = {opt: i for i, opt in enumerate(options)}
+                width = len(options)
+            else:
+                continue
+            self.layout[q['key']] = (qindex, offset, kind, extra)
+            offset += width
+            qindex += 1
+        self.width = offset
+        self.num_questions = qindex
+        canonical = json.dumps(
+            [(k, i, o, kind, sorted(extra.items()) if isinstance(extra, dict) else extra)
+             for k, (i, o, kind, extra) in self.layout.items()],
+            sort_keys=True,
+        )
+        self.signature = hashlib.sha1(canonical.encode('utf-8')).digest()
+
+    @classmethod
+    def from_file(cls, file_path: str = QUESTIONS_FILE) -> Optional['AnswerEncoder']:
+        questions = parse_json_file(file_path)
+        return None if questions is None else cls(questions)
+
+    def encode(self, user: Dict[str, Any]) -> Encoded:
+        """Return (vector, mask) for one user; unanswered questions are all zeros."""
+        vec = array('f', bytes(4 * self.width))
+        mask = array('f', bytes(4 * self.num_questions))
+        answers = user.get('answers') or {}
+        for key, value in answers.items():
+            spec = self.layout.get(key)
+            if spec is None or value is None:
+                continue
+            qindex, offset, kind, extra = spec
+            if kind == 'multi-choice':
+                pos = extra.get(value)
+                if pos is None:
+                    continue
+                vec[offset + pos] = 1.0
+            else:
+                lo, hi = extra
+                steps = max(1, hi - lo)
+                try:
+                    level = min(steps, max(0, int(value) - lo))
+                except (TypeError, ValueError):
+                    continue
+                weight = 1.0 / math.sqrt(steps)
+                for step in range(steps):
+                    on = level > step
+                    vec[offset + 2 * step] = weight if on else 0.0
+                    vec[offset + 2 * step + 1] = 0.0 if on else weight
+            mask[qindex] = 1.0
+        return vec, mask
+
+
+def _score(a: Encoded, b: Encoded) -> float:
+    common = sum(map(mul, a[1], b[1]))
+    if not common:
+        return 0.0
+    return sum(map(mul, a[0], b[0])) / common
+
+
+class AnswerVectorCache:
+    """On-disk cache of encoded answers, keyed by uuid and `updated_at`.
+
+    The file is rewritten atomically by `save` (only when something changed)
+    and is discarded wholesale if the question layout no longer matches. Ids
+    are stored with a type tag so str and int ids keep their type on reload;
+    users with other kinds of id are still encoded but not persisted.
+    """
+
+    _MAGIC = b'AVEC'
+    _VERSION = 2
+    _STR, _INT = 0, 1
+    _HEADER = struct.Struct('<4sH20sIII')
+
+    def __init__(self, path: str | Path, encoder: AnswerEncoder):
+        self.path = Path(path)
+        self.encoder = encoder
+        self._entries: Dict[Any, Tuple[str, Encoded]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self) -> None:
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return
+        enc = self.encoder
+        try:
+            magic, version, signature, width, nq, count = self._HEADER.unpack_from(data, 0)
+        except struct.error:
+            return
+        if magic != self._MAGIC or version != self._VERSION or signature != enc.signature or width != enc.width or nq != enc.num_questions:
+            return
+        pos = self._HEADER.size
+        mask_len = (nq + 7) // 8
+        for _ in range(count):
+            kind, uid_len, ts_len = struct.unpack_from('<BHH', data, pos)
+            pos += 5
+            uid = data[pos:pos + uid_len].decode('utf-8')
+            if kind == self._INT:
+                uid = int(uid)
+            pos += uid_len
+            ts = data[pos:pos + ts_len].decode('utf-8')
+            pos += ts_len
+            vec = array('f')
+            vec.frombytes(data[pos:pos + 4 * width])
+            pos += 4 * width
+            bits = data[pos:pos + mask_len]
+            pos += mask_len
+            mask = array('f', (1.0 if bits[i >> 3] & (1 << (i & 7)) else 0.0 for i in range(nq)))
+            self._entries[uid] = (ts, (vec, mask))
+
+    def get(self, user: Dict[str, Any]) -> Encoded:
+        """Encoded answers for `user`, re-encoding only if `updated_at` changed."""
+        uid = user_id(user)
+        stamp = str(user.get('updated_at') or '')
+        entry = self._entries.get(uid) if uid is not None else None
+        if entry is not None and entry[0] == stamp:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        encoded = self.encoder.encode(user)
+        if uid is not None:
+            self._entries[uid] = (stamp, encoded)
+            self._dirty = True
+        return encoded
+
+    def discard(self, uid: Any) -> None:
+        if self._entries.pop(uid, None) is not None:
+            self._dirty = True
+
+    def save(self, force: bool = False) -> None:
+        if not (self._dirty or force):
+            return
+        enc = self.encoder
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', delete=False, dir=str(self.path.parent)) as tf:
+            entries = [(uid, entry) for uid, entry in self._entries.items()
+                       if isinstance(uid, str) or (isinstance(uid, int) and not isinstance(uid, bool))]
+            tf.write(self._HEADER.pack(self._MAGIC, self._VERSION, enc.signature, enc.width, enc.num_questions, len(entries)))
+            for uid, (ts, (vec, mask)) in entries:
+                uid_b, ts_b = str(uid).encode('utf-8'), ts.encode('utf-8')
+                kind = self._STR if isinstance(uid, str) else self._INT
+                tf.write(struct.pack('<BHH', kind, len(uid_b), len(ts_b)))
+                tf.write(uid_b)
+                tf.write(ts_b)
+                tf.write(vec.tobytes())
+                bits = bytearray((len(mask) + 7) // 8)
+                for i, m in enumerate(mask):
+                    if m:
+                        bits[i >> 3] |= 1 << (i & 7)
+                tf.write(bits)
+            tmp = Path(tf.name)
+        tmp.replace(self.path)
+        self._dirty = False
+
+
+class AnswerScorer:
+    """Pairwise and top-k questionnaire compatibility for a bucket of users."""
+
+    def __init__(self, encoder: AnswerEncoder, cache: Optional[AnswerVectorCache] = None):
+        self.encoder = encoder
+        self.cache = cache
+
+    def encode(self, user: Dict[str, Any]) -> Encoded:
+        return self.cache.get(user) if self.cache is not None else self.encoder.encode(user)
+
+    def score(self, a: Dict[str, Any], b: Dict[str, Any]) -> float:
+        """Mean agreement over the questions both users answered (0 when none)."""
+        return _score(self.encode(a), self.encode(b))
+
+    def pairwise(self, users: Sequence[Dict[str, Any]]):
+        """Score matrix for `users` (NumPy array if available, else nested lists)."""
+        encoded = [self.encode(u) for u in users]
+        if np is not None:
+            vecs = np.array([np.frombuffer(v, dtype=np.float32) for v, _ in encoded], dtype=np.float32).reshape(len(users), -1)
+            masks = np.array([np.frombuffer(m, dtype=np.float32) for _, m in encoded], dtype=np.float32).reshape(len(users), -1)
+            agree = vecs @ vecs.T
+            common = masks @ masks.T
+            return np.divide(agree, common, out=np.zeros_like(agree), where=common > 0)
+        return [[_score(a, b) for b in encoded] for a in encoded]
+
+    def top_k(self, users: Sequence[Dict[str, Any]], k: int = 10) -> Dict[Any, List[Tuple[Any, float]]]:
+        """For each user, the `k` best-scoring others in `users` as (id, score), best first."""
+        ids = [user_id(u) for u in users]
+        scores = self.pairwise(users)
+        result: Dict[Any, List[Tuple[Any, float]]] = {}
+        n = len(users)
+        if n < 2 or k <= 0:
+            return {uid: [] for uid in ids}
+        if np is not None:
+            np.fill_diagonal(scores, -np.inf)
+            kk = min(k, n - 1)
+            top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+            for i, row in enumerate(top):
+                ordered = sorted(row, key=lambda j: (-scores[i, j], j))
+                result[ids[i]] = [(ids[j], float(scores[i, j])) for j in ordered]
+            return result
+        for i, row in enumerate(scores):
+            best = heapq.nlargest(k, (j for j in range(n) if j != i), key=lambda j: (row[j], -j))
+            result[ids[i]] = [(ids[j], row[j]) for j in best]
+        return result
+
+    def score_many(self, user: Dict[str, Any], candidates: Iterable[Dict[str, Any]]) -> List[Tuple[Any, float]]:
+        """Score one user against `candidates`, best first."""
+        me = self.encode(user)
+        scored = [(user_id(c), _score(me, self.encode(c))) for c in candidates]
+        scored.sort(key=lambda item: -item[1])
+        return scored
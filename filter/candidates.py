@@ -0,0 +1,85 @@
+"""
+Candidate ranking for one location bucket.
+
+`CandidatePool` holds the valid members of a bucket and their interest masks.
+`top_k` keeps the members with a mutual gender preference and a mutual age
+range and ranks them by interest overlap (Jaccard), best `k` kept, ties broken
+by id. The on-demand `Recommender` and the batched `MatchProcessor` both rank
+through it, so the two request paths apply the same filters in the same way.
+
+A pool answering many requests (a batch) is built with `GenderIndex` and
+`AgeIndex`, so each request only expands compatible groups; a pool answering
+one request (`indexed=False`) checks members pairwise instead, which is
+cheaper than building the indexes for a single query.
+"""
+import heapq
+from typing import Any, Container, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from filter.age import AgeIndex, age_compatible
+from filter.gender import GenderIndex, gender_combo, genders_compatible
+from filter.interests import interest_mask, jaccard
+from filter.is_profile_valid import is_user_valid
+from filter.location_index import user_id
+
+Ranked = List[Tuple[Any, float]]
+
+
+class CandidatePool:
+    """Valid members of one bucket, indexed for ranking.
+
+    Args:
+        members: the bucket's users; invalid profiles and users without an id are skipped.
+        masks: precomputed interest masks by id (computed from the members otherwise).
+        indexed: build the age and gender indexes (worth it when several requests share the pool).
+    """
+
+    __slots__ = ('users', 'by_id', 'masks', 'age', 'gender')
+
+    def __init__(self, members: Iterable[Dict[str, Any]], masks: Optional[Mapping[Any, int]] = None, *,
+                 indexed: bool = True):
+        self.users = [u for u in members if is_user_valid(u) and user_id(u) is not None]
+        self.by_id = {user_id(u): u for u in self.users}
+        if masks is None:
+            masks = {uid: interest_mask(u) for uid, u in self.by_id.items()}
+        self.masks = masks
+        self.age: Optional[AgeIndex] = AgeIndex(self.users) if indexed else None
+        self.gender: Optional[GenderIndex] = GenderIndex(self.users) if indexed else None
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __contains__(self, uid: Any) -> bool:
+        return uid in self.by_id
+
+    def top_k(self, uid: Any, k: int, *, age: bool = True, gender: bool = True, min_score: float = 0.0,
+              within: Optional[Container[Any]] = None) -> Ranked:
+        """Best `k` (id, score) candidates for member `uid`, best first; [] if `uid` is not in the pool.
+
+        `age` / `gender` toggle the mutual age and gender checks, candidates
+        scoring below `min_score` are dropped, and `within` restricts the
+        candidates to a set of ids (e.g. a radius search).
+        """
+        user = self.by_id.get(uid)
+        if user is None or k <= 0:
+            return []
+        if self.age is None:
+            pool: Iterable[Any] = (other for other, o in self.by_id.items() if other != uid
+                                   and (not age or age_compatible(user, o))
+                                   and (not gender or genders_compatible(user, o)))
+            compatible = None
+        else:
+            pool = self.age.candidates(user) if age else (other for other in self.by_id if other != uid)
+            compatible = set(self.gender.compatible(gender_combo(user))) if gender else None
+            combo_of = self.gender.combo_of
+        mask, masks = self.masks[uid], self.masks
+        scored = []
+        for other in pool:
+            if compatible is not None and combo_of(other) not in compatible:
+                continue
+            if within is not None and other not in within:
+                continue
+            score = jaccard(mask, masks[other])
+            if score >= min_score:
+                scored.append((score, other))
+        best = heapq.nsmallest(k, scored, key=lambda item: (-item[0], str(item[1])))
+        return [(other, score) for score, other in best]
@@ -0,0 +1,451 @@
+"""
+Incremental (change-feed) maintenance of the location groupings in filter_data/.
+
+`GroupingState` keeps the groupings written by `filter_by_location` and
+`is_profile_valid` up to date from batches of changes, and persists them in a
+directory store (default filter_data/groupings/) laid out for delta writes:
+
+    members.log       append-only journal, one JSON line per change:
+                      {"u": <id and location fields>, "t": updated_at, "v": valid}
+                      for an added/updated user, {"d": <id>} for a deleted one
+    all/<n>.json      one location's entry of filtered_by_location.json
+    valid/<n>.json    the same for location_isvalid.json (absent when empty)
+    manifest.json     location order and file numbers, written last
+
+`GroupingState.open(directory)` rebuilds the state by replaying the journal.
+Only ids, `updated_at` stamps, validity flags and location fields are kept, so
+a population never has to be loaded as full user records.
+
+A batch of changes is applied user by user:
+ - a user whose `uuid` is new is added
+ - a known `uuid` with a different `updated_at` is moved out of the groupings
+   it was listed under and into the ones its new record belongs to
+ - a known `uuid` with the same `updated_at` is skipped
+ - ids passed as `deleted` are removed
+Only the locations covering the changed users are touched. `save` appends the
+batch to the journal and rewrites the group files of those locations only,
+plus the manifest. A save therefore costs O(batch + size of the touched
+groups + number of locations), independent of the rest of the population.
+The journal is compacted to one line per user once it holds more than twice
+as many lines as there are users.
+
+Group membership always equals `index.groups(...)` on the updated index, i.e.
+what a full regroup would compute. Group order and, for locations merged by
+case or spacing, the displayed spelling follow the order changes arrived in.
+
+`export` still writes the three single-file outputs in full (O(population))
+for consumers of that layout; `load_groupings_dir` reads the directory store
+back in the same shape.
+"""
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from filter.grouping_store import load_groupings, save_groupings, write_groupings
+from filter.is_profile_valid import is_user_valid
+from filter.location_index import LocationIndex, LocationKey, canonical_location, location_dict, user_id
+from json_parser import atomic_write_json
+
+FILE_LOCATION_KEYS = Path("filter_data/location_keys.json")
+FILE_BY_LOCATION = Path("filter_data/filtered_by_location.json")
+FILE_IS_VALID = Path("filter_data/location_isvalid.json")
+STORE_DIR = Path("filter_data/groupings")
+
+_STORE_VERSION = 1
+_MANIFEST = 'manifest.json'
+_JOURNAL = 'members.log'
+_ID_FIELDS = ('uuid', 'id', 'username')
+
+
+class DeltaStats:
+    """What one `apply` call did."""
+
+    __slots__ = ('added', 'updated', 'deleted', 'unchanged')
+
+    def __init__(self):
+        self.added = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'added': self.added, 'updated': self.updated, 'deleted': self.deleted, 'unchanged': self.unchanged}
+
+    def __repr__(self) -> str:
+        return f"DeltaStats({self.as_dict()!r})"
+
+
+def _label(loc: LocationKey) -> str:
+    """Stable name of a location across runs (its canonical form, as JSON)."""
+    return json.dumps([[key, list(val) if isinstance(val, tuple) else val] for key, val in canonical_location(loc)])
+
+
+class GroupingState:
+    """Location groupings that can be updated with deltas; see the module docstring.
+
+    Users without an id (uuid, id or username) can't be tracked across batches
+    and are ignored.
+
+    Args:
+        users: initial population.
+        index: optional `LocationIndex` already built over `users` (it is kept
+            and updated in place).
+        predicate: which users appear in the "valid" grouping.
+        directory: where `save` keeps the directory store.
+    """
+
+    def __init__(self, users: Optional[Iterable[Dict[str, Any]]] = None, *, index: Optional[LocationIndex] = None,
+                 predicate: Callable[[Dict[str, Any]], bool] = is_user_valid, directory: str | Path = STORE_DIR):
+        self.predicate = predicate
+        self.directory = Path(directory)
+        self._stamps: Dict[Any, Any] = {}
+        self._valid_ids: Set[Any] = set()
+        # location -> {uid: user}, in the same order as the index's groups
+        self._all: Dict[LocationKey, Dict[Any, Dict[str, Any]]] = {}
+        self._valid: Dict[LocationKey, Dict[Any, Dict[str, Any]]] = {}
+        if index is not None:
+            self.index = index
+            for user in index.users():
+                self._track(user)
+        else:
+            # keep only ids and location fields, not the full records
+            self.index = index = LocationIndex()
+            for user in users or ():
+                if user_id(user) is not None:
+                    self._track(user)
+                    index.add(self._stub(user))
+        for loc in index.locations():
+            self._render(loc)
+        # store bookkeeping: location label -> file number, what changed since the last save
+        self._files: Dict[str, int] = {}
+        self._next_file = 0
+        self._backend: Optional[str] = None
+        self._touched: Set[LocationKey] = set(self._all)
+        self._removed: Set[str] = set()
+        self._pending: List[str] = []
+        self._journal_lines = 0
+        self._journal_stale = True
+        self._dirty = {'keys': True, 'all': True, 'valid': True}
+
+    @classmethod
+    def open(cls, directory: str | Path = STORE_DIR, *,
+             predicate: Callable[[Dict[str, Any]], bool] = is_user_valid) -> 'GroupingState':
+        """Restore the state saved in `directory` (empty if there is no store yet).
+
+        Validity flags are read from the journal, so `predicate` only applies
+        to changes made after opening.
+        """
+        directory = Path(directory)
+        index = LocationIndex()
+        stamps: Dict[Any, Any] = {}
+        valid: Set[Any] = set()
+        lines = 0
+        journal = directory / _JOURNAL
+        if journal.exists():
+            with journal.open('r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    lines += 1
+                    entry = json.loads(line)
+                    if 'd' in entry:
+                        index.remove(entry['d'])
+                        stamps.pop(entry['d'], None)
+                        valid.discard(entry['d'])
+                        continue
+                    stub = entry['u']
+                    uid = user_id(stub)
+                    index.add(stub)
+                    stamps[uid] = entry.get('t')
+                    if entry.get('v'):
+                        valid.add(uid)
+                    else:
+                        valid.discard(uid)
+        state = cls(index=index, predicate=lambda stub: user_id(stub) in valid, directory=directory)
+        state.predicate = predicate
+        state._stamps = stamps
+        state._journal_lines = lines
+        state._journal_stale = not journal.exists()
+        manifest = cls._read_manifest(directory)
+        if manifest is not None:
+            state._files = {label: n for label, n in manifest['files']}
+            state._next_file = manifest['next_file']
+            state._backend = manifest['backend']
+            if manifest['journal_lines'] == lines:
+                # the group files already match the journal; nothing to rewrite
+                state._touched = set()
+        return state
+
+    @staticmethod
+    def _read_manifest(directory: Path) -> Optional[Dict[str, Any]]:
+        try:
+            manifest = json.loads((directory / _MANIFEST).read_text(encoding='utf-8'))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return manifest if manifest.get('version') == _STORE_VERSION else None
+
+    def __len__(self) -> int:
+        return len(self._stamps)
+
+    def _track(self, user: Dict[str, Any]) -> None:
+        uid = user_id(user)
+        self._stamps[uid] = user.get('updated_at')
+        if self.predicate(user):
+            self._valid_ids.add(uid)
+
+    def _stub(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """The fields of `user` the groupings need: ids and location."""
+        stub = {key: user[key] for key in _ID_FIELDS if user.get(key) is not None}
+        for key in self.index.keys:
+            if user.get(key) is not None:
+                stub[key] = user[key]
+        return stub
+
+    def _render(self, loc: LocationKey) -> None:
+        members = {user_id(u): u for u in self.index.members(loc)}
+        self._all[loc] = members
+        self._valid[loc] = {uid: u for uid, u in members.items() if uid in self._valid_ids}
+
+    def _detach(self, uid: Any) -> None:
+        loc = self.index.location_of(uid)
+        if not loc:
+            return
+        for other in self.index.covering(loc):
+            self._all[other].pop(uid, None)
+            if self._valid[other].pop(uid, None) is not None:
+                self._dirty['valid'] = True
+            self._touched.add(other)
+        self._dirty['all'] = True
+
+    def _drop_if_gone(self, loc: Optional[LocationKey]) -> None:
+        if loc and not self.index.has_location(loc):
+            del self._all[loc]
+            if self._valid.pop(loc):
+                self._dirty['valid'] = True
+            self._dirty['keys'] = True
+            self._touched.discard(loc)
+            self._removed.add(_label(loc))
+
+    def _attach(self, user: Dict[str, Any], loc: LocationKey) -> None:
+        if not loc:
+            return
+        uid = user_id(user)
+        if loc not in self._all:
+            self._render(loc)
+            self._dirty['keys'] = True
+            self._dirty['valid'] = self._dirty['valid'] or bool(self._valid[loc])
+            self._removed.discard(_label(loc))
+        valid = uid in self._valid_ids
+        for other in self.index.covering(loc):
+            self._touched.add(other)
+            if other == loc and uid in self._all[loc]:
+                continue
+            self._all[other][uid] = user
+            if valid:
+                self._valid[other][uid] = user
+                self._dirty['valid'] = True
+        self._dirty['all'] = True
+
+    def _upsert(self, user: Dict[str, Any]) -> None:
+        uid = user_id(user)
+        stub = self._stub(user)
+        old = self.index.location_of(uid)
+        self._detach(uid)
+        # remove before re-adding, as the index does, so a location that empties
+        # and comes back moves to the end just like in a full regroup
+        self.index.remove(uid)
+        self._drop_if_gone(old)
+        valid = bool(self.predicate(user))
+        if valid:
+            self._valid_ids.add(uid)
+        else:
+            self._valid_ids.discard(uid)
+        self._attach(stub, self.index.add(stub))
+        self._stamps[uid] = user.get('updated_at')
+        self._pending.append(json.dumps({'u': stub, 't': user.get('updated_at'), 'v': valid}, ensure_ascii=False))
+
+    def _delete(self, uid: Any) -> bool:
+        if uid not in self._stamps:
+            return False
+        old = self.index.location_of(uid)
+        self._detach(uid)
+        self.index.remove(uid)
+        self._drop_if_gone(old)
+        del self._stamps[uid]
+        self._valid_ids.discard(uid)
+        self._pending.append(json.dumps({'d': uid}, ensure_ascii=False))
+        return True
+
+    def apply(self, changes: Iterable[Dict[str, Any]] = (), deleted: Iterable[Any] = ()) -> DeltaStats:
+        """Apply added/updated user records and deleted ids; see the module docstring."""
+        stats = DeltaStats()
+        for user in changes:
+            uid = user_id(user)
+            if uid is None:
+                continue
+            if uid in self._stamps:
+                stamp = user.get('updated_at')
+                if stamp is not None and stamp == self._stamps[uid]:
+                    stats.unchanged += 1
+                    continue
+                stats.updated += 1
+            else:
+                stats.added += 1
+            self._upsert(user)
+        for uid in deleted:
+            if self._delete(uid):
+                stats.deleted += 1
+        return stats
+
+    def location_keys(self) -> List[Dict[str, Any]]:
+        return [location_dict(loc) for loc in self._all]
+
+    def _entry(self, loc: LocationKey, members: Dict[Any, Dict[str, Any]], valid: bool) -> Dict[str, Any]:
+        entry = location_dict(loc)
+        entry['users'] = list(members) if valid else [u.get('uuid') for u in members.values()]
+        return entry
+
+    def by_location(self) -> List[Dict[str, Any]]:
+        """Same shape and order as `filter_by_location`'s result."""
+        return [self._entry(loc, members, False) for loc, members in self._all.items()]
+
+    def valid_by_location(self) -> List[Dict[str, Any]]:
+        """Same shape and order as `is_profile_valid`'s result."""
+        return [self._entry(loc, members, True) for loc, members in self._valid.items() if members]
+
+    # directory store
+
+    def _write_journal(self, path: Path) -> None:
+        if self._journal_stale or self._journal_lines + len(self._pending) > 2 * max(len(self), 1):
+            lines = []
+            for stub in self.index.users():
+                uid = user_id(stub)
+                if uid is None:
+                    continue
+                lines.append(json.dumps({'u': self._stub(stub), 't': self._stamps.get(uid), 'v': uid in self._valid_ids},
+                                        ensure_ascii=False))
+            with tempfile.NamedTemporaryFile('w', delete=False, encoding='utf-8', dir=str(path.parent)) as tf:
+                tf.writelines(line + '\n' for line in lines)
+                tmp = Path(tf.name)
+            tmp.replace(path)
+            self._journal_lines = len(lines)
+            self._journal_stale = False
+        elif self._pending:
+            with path.open('a', encoding='utf-8') as f:
+                f.writelines(line + '\n' for line in self._pending)
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_lines += len(self._pending)
+        self._pending = []
+
+    def _file_of(self, loc: LocationKey) -> int:
+        label = _label(loc)
+        n = self._files.get(label)
+        if n is None:
+            n = self._files[label] = self._next_file
+            self._next_file += 1
+        return n
+
+    def save(self, directory: Optional[str | Path] = None, *, backend: str = 'json') -> List[Path]:
+        """Persist the changes since the last save to the directory store; returns the group files written.
+
+        The journal is appended to (or compacted), the group files of touched
+        locations are rewritten and those of vanished locations deleted, and the
+        manifest is replaced last. With `backend='binary'` group files use the
+        format of filter/grouping_store.py (`<n>.grp`).
+        """
+        directory = Path(directory) if directory is not None else self.directory
+        if directory != self.directory:
+            # a different store starts from scratch
+            self.directory = directory
+            self._files, self._next_file, self._removed, self._backend = {}, 0, set(), None
+            self._touched = set(self._all)
+            self._journal_stale = True
+        suffix = '.grp' if backend == 'binary' else '.json'
+        if self._backend is not None and self._backend != backend:
+            # switching formats: drop the old files and write every location again
+            old_suffix = '.grp' if self._backend == 'binary' else '.json'
+            for n in self._files.values():
+                for sub in ('all', 'valid'):
+                    (directory / sub / f"{n}{old_suffix}").unlink(missing_ok=True)
+            self._touched = set(self._all)
+        self._backend = backend
+        for sub in ('all', 'valid'):
+            (directory / sub).mkdir(parents=True, exist_ok=True)
+        self._write_journal(directory / _JOURNAL)
+        written = []
+        for loc in self._touched:
+            n = self._file_of(loc)
+            for sub, groups, valid in (('all', self._all, False), ('valid', self._valid, True)):
+                path = directory / sub / f"{n}{suffix}"
+                if valid and not groups[loc]:
+                    path.unlink(missing_ok=True)
+                    continue
+                entry = self._entry(loc, groups[loc], valid)
+                if backend == 'binary':
+                    write_groupings([entry], path)
+                else:
+                    atomic_write_json(entry, path, indent=2, sort_keys=True)
+                written.append(path)
+        for label in self._removed:
+            n = self._files.pop(label, None)
+            if n is not None:
+                for sub in ('all', 'valid'):
+                    (directory / sub / f"{n}{suffix}").unlink(missing_ok=True)
+        manifest = {
+            'version': _STORE_VERSION,
+            'backend': backend,
+            'journal_lines': self._journal_lines,
+            'next_file': self._next_file,
+            # in group order; every location has an all/ file, only non-empty ones a valid/ file
+            'locations': [[self._file_of(loc), bool(self._valid[loc])] for loc in self._all],
+            'files': sorted(self._files.items(), key=lambda item: item[1]),
+        }
+        atomic_write_json(manifest, directory / _MANIFEST)
+        self._touched = set()
+        self._removed = set()
+        return written
+
+    def export(self, *, keys_out: str | Path = FILE_LOCATION_KEYS, result_out: str | Path = FILE_BY_LOCATION,
+               valid_out: str | Path = FILE_IS_VALID, force: bool = False, backend: str = 'json') -> List[Path]:
+        """Atomically rewrite the single-file outputs that changed since the last export; returns the paths written.
+
+        Each changed file is serialized in full (O(population)); `save` is the
+        incremental path. With `backend='binary'` the two groupings are written
+        in the format of filter/grouping_store.py (pass matching
+        `result_out`/`valid_out` paths); the small location keys file stays JSON.
+        """
+        written = []
+        for name, path, build in (('keys', keys_out, self.location_keys), ('all', result_out, self.by_location),
+                                  ('valid', valid_out, self.valid_by_location)):
+            path = Path(path)
+            if force or self._dirty[name] or not path.exists():
+                if name == 'keys':
+                    atomic_write_json(build(), path, indent=2, sort_keys=True)
+                else:
+                    save_groupings(build(), path, backend=backend)
+                written.append(path)
+                self._dirty[name] = False
+        return written
+
+
+def load_groupings_dir(directory: str | Path = STORE_DIR, *, valid: bool = False) -> List[Dict[str, Any]]:
+    """Read a directory store back as one grouping list (the all/ or the valid/ files), in group order."""
+    directory = Path(directory)
+    manifest = GroupingState._read_manifest(directory)
+    if manifest is None:
+        return []
+    suffix = '.grp' if manifest.get('backend') == 'binary' else '.json'
+    sub = 'valid' if valid else 'all'
+    result = []
+    for n, has_valid in manifest['locations']:
+        if valid and not has_valid:
+            continue
+        path = directory / sub / f"{n}{suffix}"
+        if suffix == '.grp':
+            result.extend(load_groupings(path))
+        else:
+            result.append(json.loads(path.read_text(encoding='utf-8')))
+    return result
@@ -0,0 +1,153 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from filter.location_index import user_id
+
+# preference_gender value meaning "any gender"
+ANY_GENDER = 'N'
+
+
+def accepts(preference: Optional[str], gender: Optional[str]) -> bool:
+    """True when someone with `preference` is open to a partner of `gender`.
+
+    A missing preference is treated like "N" (no preference).
+    """
+    if preference is None or preference == ANY_GENDER:
+        return True
+    return preference == gender
+
+
+def genders_compatible(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """True when each user's preference_gender accepts the other's gender."""
+    return accepts(a.get('preference_gender'), b.get('gender')) and accepts(b.get('preference_gender'), a.get('gender'))
+
+
+# (gender, preference_gender); users sharing one are interchangeable here
+GenderCombo = Tuple[Optional[str], str]
+
+
+def gender_combo(user: Dict[str, Any]) -> GenderCombo:
+    """Return the user's (gender, preference) pair, with a missing preference read as "N"."""
+    preference = user.get('preference_gender')
+    return user.get('gender'), ANY_GENDER if preference is None else preference
+
+
+def combos_compatible(a: GenderCombo, b: GenderCombo) -> bool:
+    return accepts(a[1], b[0]) and accepts(b[1], a[0])
+
+
+class GenderIndex:
+    """Mutual gender-preference index over a bucket of users.
+
+    Users are partitioned by (gender, preference). There are at most a dozen
+    such combos, so the combos compatible with each one are worked out once
+    (with "N" accepting anyone on either side) and cached; a query then only
+    expands the compatible partitions instead of checking every user.
+    """
+
+    def __init__(self, users: Optional[Iterable[Dict[str, Any]]] = None):
+        # combo -> {uid: None}, in insertion order
+        self._groups: Dict[GenderCombo, Dict[Any, None]] = {}
+        self._combos: Dict[Any, GenderCombo] = {}
+        # combo -> compatible combos present in the index; reset when combos come or go
+        self._compatible: Dict[GenderCombo, Tuple[GenderCombo, ...]] = {}
+        if users is not None:
+            for user in users:
+                self.add(user)
+
+    def __len__(self) -> int:
+        return len(self._combos)
+
+    def __contains__(self, uid: Any) -> bool:
+        return uid in self._combos
+
+    def add(self, user: Dict[str, Any]) -> bool:
+        """Index `user`; returns False (and indexes nothing) when it has no id."""
+        uid = user_id(user)
+        if uid is None:
+            return False
+        if uid in self._combos:
+            self.remove(uid)
+        combo = gender_combo(user)
+        group = self._groups.get(combo)
+        if group is None:
+            group = self._groups[combo] = {}
+            self._compatible.clear()
+        group[uid] = None
+        self._combos[uid] = combo
+        return True
+
+    def remove(self, uid: Any) -> bool:
+        combo = self._combos.pop(uid, None)
+        if combo is None:
+            return False
+        group = self._groups[combo]
+        del group[uid]
+        if not group:
+            del self._groups[combo]
+            self._compatible.clear()
+        return True
+
+    def combo_of(self, uid: Any) -> Optional[GenderCombo]:
+        return self._combos.get(uid)
+
+    def combos(self) -> Dict[GenderCombo, int]:
+        """Number of indexed users per (gender, preference)."""
+        return {combo: len(group) for combo, group in self._groups.items()}
+
+    def compatible(self, combo: GenderCombo) -> Tuple[GenderCombo, ...]:
+        """Indexed combos mutually compatible with `combo` (possibly including itself)."""
+        found = self._compatible.get(combo)
+        if found is None:
+            found = self._compatible[combo] = tuple(other for other in self._groups if combos_compatible(combo, other))
+        return found
+
+    def candidates(self, user: Dict[str, Any]) -> Iterator[Any]:
+        """Yield ids of indexed users mutually gender-compatible with `user` (excluding itself)."""
+        uid = user_id(user)
+        for combo in self.compatible(gender_combo(user)):
+            for other in self._groups[combo]:
+                if other != uid:
+                    yield other
+
+    def count(self, user: Dict[str, Any]) -> int:
+        """Number of compatible candidates for `user`, without listing them."""
+        uid = user_id(user)
+        total = 0
+        for combo in self.compatible(gender_combo(user)):
+            group = self._groups[combo]
+            total += len(group)
+            if uid in group:
+                total -= 1
+        return total
+
+    def counts(self) -> Dict[Any, int]:
+        """Map every indexed id to its number of compatible candidates (one pass per combo)."""
+        result: Dict[Any, int] = {}
+        for combo, group in self._groups.items():
+            compatible = self.compatible(combo)
+            total = sum(len(self._groups[other]) for other in compatible)
+            if combo in compatible:
+                total -= 1
+            for uid in group:
+                result[uid] = total
+        return result
+
+
+def filter_by_gender(data: Iterable[Dict[str, Any]], uuid: Any, *args, **kwargs) -> List[Any]:
+    """Return ids of users in `data` mutually gender-compatible with the user `uuid`.
+
+    Pass `index=` to reuse a `GenderIndex` already built over `data`.
+    """
+    index = kwargs.get('index')
+    users = None
+    if index is None:
+        users = list(data)
+        index = GenderIndex(users)
+    target = None
+    for user in (users if users is not None else data):
+        if user_id(user) == uuid:
+            target = user
+            break
+    if target is None:
+        return []
+    return list(index.candidates(target))
@@ -0,0 +1,254 @@
+"""
+Binary persistence for the location groupings in filter_data/.
+
+The JSON outputs list every uuid as a pretty-printed string (~45 bytes each)
+and have to be parsed in full before anything can be looked up. The binary
+layout written here stores each id in a 16-byte slot and keeps one offset-table
+row per location, so a reader can `mmap` the file and decode only the
+locations it asks for:
+
+    header     magic 'GRPB', version, location count, id count, section offsets
+    locations  per location: label offset/length, first id slot, id count
+    labels     location dicts as compact JSON (sorted keys)
+    ids        16-byte slots: uuid bytes, or an index into `strings` for ids
+               that aren't canonical UUID strings (flagged in `extra`)
+    extra      one bit per id slot
+    strings    non-UUID ids, length-prefixed UTF-8
+
+Files are written to a temp file and atomically replaced, like
+`atomic_write_json`. `GroupingFile.to_json()` / `export_json()` give back the
+exact JSON document for debugging.
+"""
+import json
+import mmap
+import struct
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from instrumentation import instrument
+from json_parser import atomic_write_json
+
+_MAGIC = b'GRPB'
+_VERSION = 1
+# magic, version, locations, ids, labels offset, ids offset, extra offset, strings offset
+_HEADER = struct.Struct('<4sHxxQQQQQQ')
+_LOCATION = struct.Struct('<QIQQ')
+_SLOT = 16
+
+BACKENDS = ('json', 'binary')
+
+
+def _uuid_bytes(uid: Any) -> Optional[bytes]:
+    """16 bytes for a canonical (lowercase, hyphenated) UUID string, else None."""
+    if not isinstance(uid, str) or len(uid) != 36 or uid[8] != '-' or uid[13] != '-' or uid[18] != '-' or uid[23] != '-':
+        return None
+    digits = uid[:8] + uid[9:13] + uid[14:18] + uid[19:23] + uid[24:]
+    if digits != digits.lower():
+        return None
+    try:
+        raw = bytes.fromhex(digits)
+    except ValueError:
+        return None
+    # fromhex skips whitespace, so a short result means the string wasn't pure hex
+    return raw if len(raw) == 16 else None
+
+
+def _format_uuid(h: str) -> str:
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+
+
+def _encode_id(uid: Any, strings: List[bytes]) -> tuple:
+    raw = _uuid_bytes(uid)
+    if raw is not None:
+        return raw, False
+    strings.append(json.dumps(uid).encode('utf-8'))
+    return struct.pack('<Q8x', len(strings) - 1), True
+
+
+@instrument(count=lambda result, groups, path: {'bytes_written': Path(path).stat().st_size})
+def write_groupings(groups: List[Dict[str, Any]], path: str | Path) -> None:
+    """Write `groups` (entries shaped like filter_by_location's output) in the binary layout, atomically."""
+    labels = bytearray()
+    table = bytearray()
+    slots = bytearray()
+    extra = bytearray()
+    strings: List[bytes] = []
+    n_ids = 0
+    for entry in groups:
+        label = json.dumps({k: v for k, v in entry.items() if k != 'users'}, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        users = entry.get('users') or []
+        table += _LOCATION.pack(len(labels), len(label), n_ids, len(users))
+        labels += label
+        for uid in users:
+            slot, is_extra = _encode_id(uid, strings)
+            slots += slot
+            if n_ids % 8 == 0:
+                extra.append(0)
+            if is_extra:
+                extra[n_ids >> 3] |= 1 << (n_ids & 7)
+            n_ids += 1
+    string_blob = b''.join(struct.pack('<I', len(s)) + s for s in strings)
+    labels_at = _HEADER.size + len(table)
+    ids_at = labels_at + len(labels)
+    extra_at = ids_at + len(slots)
+    strings_at = extra_at + len(extra)
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', delete=False, dir=str(p.parent)) as tf:
+        tf.write(_HEADER.pack(_MAGIC, _VERSION, len(groups), n_ids, labels_at, ids_at, extra_at, strings_at))
+        tf.write(table)
+        tf.write(labels)
+        tf.write(slots)
+        tf.write(extra)
+        tf.write(string_blob)
+        tmp = Path(tf.name)
+    tmp.replace(p)
+
+
+def save_groupings(groups: List[Dict[str, Any]], path: str | Path, *, backend: str = 'json') -> None:
+    """Persist groupings with the chosen backend ('json' keeps the original pretty-printed format)."""
+    if backend == 'json':
+        atomic_write_json(groups, path, indent=2, sort_keys=True)
+    elif backend == 'binary':
+        write_groupings(groups, path)
+    else:
+        raise ValueError(f"unknown backend {backend!r}; expected one of {BACKENDS}")
+
+
+class GroupingFile:
+    """Memory-mapped reader for files written by `write_groupings`.
+
+    Only the header and the location table are read up front; labels and ids
+    are decoded on demand. Use as a context manager or call `close()`.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        with self.path.open('rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self._n_locations, self._n_ids, self._labels_at, self._ids_at, self._extra_at, self._strings_at = \
+                _HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            self._mm.close()
+            raise ValueError(f"not a grouping file: {path}")
+        if magic != _MAGIC or version != _VERSION:
+            self._mm.close()
+            raise ValueError(f"not a grouping file: {path}")
+        self._label_index: Optional[Dict[str, int]] = None
+        self._string_offsets: Optional[List[int]] = None
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def __enter__(self) -> 'GroupingFile':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._n_locations
+
+    @property
+    def num_ids(self) -> int:
+        return self._n_ids
+
+    def _row(self, i: int) -> tuple:
+        if not 0 <= i < self._n_locations:
+            raise IndexError(i)
+        return _LOCATION.unpack_from(self._mm, _HEADER.size + i * _LOCATION.size)
+
+    def _label_bytes(self, i: int) -> bytes:
+        label_off, label_len, _, _ = self._row(i)
+        start = self._labels_at + label_off
+        return self._mm[start:start + label_len]
+
+    def location(self, i: int) -> Dict[str, Any]:
+        """The location dict of entry `i`."""
+        return json.loads(self._label_bytes(i))
+
+    def locations(self) -> List[Dict[str, Any]]:
+        return [self.location(i) for i in range(self._n_locations)]
+
+    def find(self, location: Dict[str, Any]) -> Optional[int]:
+        """Entry number for a location dict (compared by its fields), or None."""
+        if self._label_index is None:
+            self._label_index = {self._label_bytes(i).decode('utf-8'): i for i in range(self._n_locations)}
+        label = json.dumps({k: v for k, v in location.items() if k != 'users'}, sort_keys=True, separators=(',', ':'))
+        return self._label_index.get(label)
+
+    def count(self, i: int) -> int:
+        return self._row(i)[3]
+
+    def _is_extra(self, slot: int) -> bool:
+        return bool(self._mm[self._extra_at + (slot >> 3)] & (1 << (slot & 7)))
+
+    def _string(self, n: int) -> Any:
+        if self._string_offsets is None:
+            offsets = []
+            pos, end = self._strings_at, len(self._mm)
+            while pos < end:
+                offsets.append(pos)
+                (length,) = struct.unpack_from('<I', self._mm, pos)
+                pos += 4 + length
+            self._string_offsets = offsets
+        pos = self._string_offsets[n]
+        (length,) = struct.unpack_from('<I', self._mm, pos)
+        return json.loads(self._mm[pos + 4:pos + 4 + length])
+
+    def iter_users(self, i: int) -> Iterator[Any]:
+        """Yield the ids listed under entry `i`, in their original order."""
+        _, _, first, count = self._row(i)
+        start = self._ids_at + first * _SLOT
+        # one hex conversion for the whole range, sliced per slot
+        digits = self._mm[start:start + count * _SLOT].hex()
+        for n in range(count):
+            slot = first + n
+            if self._is_extra(slot):
+                yield self._string(struct.unpack_from('<Q', self._mm, start + n * _SLOT)[0])
+            else:
+                yield _format_uuid(digits[n * 32:(n + 1) * 32])
+
+    def users(self, i: int) -> List[Any]:
+        return list(self.iter_users(i))
+
+    def contains(self, i: int, uid: Any) -> bool:
+        """True if `uid` is listed under entry `i`; a UUID is found with one scan of the mapped slots."""
+        _, _, first, count = self._row(i)
+        needle = _uuid_bytes(uid)
+        if needle is not None:
+            start = self._ids_at + first * _SLOT
+            end = start + count * _SLOT
+            pos = self._mm.find(needle, start, end)
+            while pos != -1:
+                slot = (pos - self._ids_at) // _SLOT
+                if (pos - start) % _SLOT == 0 and not self._is_extra(slot):
+                    return True
+                pos = self._mm.find(needle, pos + 1, end)
+            return False
+        return uid in self.iter_users(i)
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        """The full grouping document, identical to what the JSON backend writes."""
+        result = []
+        for i in range(self._n_locations):
+            entry = self.location(i)
+            entry['users'] = self.users(i)
+            result.append(entry)
+        return result
+
+    def export_json(self, path: str | Path) -> None:
+        atomic_write_json(self.to_json(), path, indent=2, sort_keys=True)
+
+
+def load_groupings(path: str | Path) -> List[Dict[str, Any]]:
+    """Read a grouping file in either format (binary is detected by its magic)."""
+    p = Path(path)
+    with p.open('rb') as f:
+        magic = f.read(len(_MAGIC))
+    if magic == _MAGIC:
+        with GroupingFile(p) as grouping:
+            return grouping.to_json()
+    return json.loads(p.read_text(encoding='utf-8'))
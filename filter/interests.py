@@ -0,0 +1,238 @@
+"""
+Interest-overlap candidate generation.
+
+Interests come from a small fixed pool (`interests_pool` in generate_users.py),
+so each user's interests are encoded as one integer bitmask and exact Jaccard
+overlap is two popcounts. For large buckets, `MinHashLSH` buckets users by
+banded MinHash signatures so high-overlap candidates are found without
+comparing every pair; candidates are then re-ranked with the exact Jaccard.
+
+`InterestStage` plugs both into the filter pipeline after location grouping.
+"""
+import random
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from filter.location_index import user_id
+from filter.pipeline import Bucket, BucketStage
+from generate_users import interests_pool
+
+_PRIME = (1 << 61) - 1
+
+
+class InterestCodec:
+    """Maps interest tags to bit positions; unseen tags get the next free bit."""
+
+    def __init__(self, tags: Iterable[str] = interests_pool):
+        self.bits: Dict[str, int] = {}
+        for tag in tags:
+            self.bit(tag)
+
+    def bit(self, tag: str) -> int:
+        key = tag.strip().lower()
+        pos = self.bits.get(key)
+        if pos is None:
+            pos = self.bits[key] = len(self.bits)
+        return pos
+
+    def mask(self, interests: Optional[Iterable[str]]) -> int:
+        value = 0
+        for tag in interests or ():
+            if isinstance(tag, str) and tag.strip():
+                value |= 1 << self.bit(tag)
+        return value
+
+    def tags(self, mask: int) -> List[str]:
+        return [tag for tag, pos in self.bits.items() if mask >> pos & 1]
+
+
+DEFAULT_CODEC = InterestCodec()
+
+
+def interest_mask(user: Dict[str, Any], codec: InterestCodec = DEFAULT_CODEC) -> int:
+    return codec.mask(user.get('interests'))
+
+
+def jaccard(a: int, b: int) -> float:
+    """Jaccard overlap of two interest bitmasks."""
+    union = (a | b).bit_count()
+    return (a & b).bit_count() / union if union else 0.0
+
+
+def _bit_positions(mask: int) -> List[int]:
+    positions = []
+    while mask:
+        low = mask & -mask
+        positions.append(low.bit_length() - 1)
+        mask ^= low
+    return positions
+
+
+class MinHashLSH:
+    """Banded MinHash index over interest bitmasks.
+
+    Each of `num_perm` universal hash functions maps bit positions to values and
+    a signature keeps the minimum per function. Signatures are cut into `bands`
+    bands; users sharing any whole band are candidates. With `rows` = num_perm /
+    bands, a pair with Jaccard s becomes a candidate with probability
+    1 - (1 - s^rows)^bands.
+    """
+
+    def __init__(self, num_perm: int = 32, bands: int = 16, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self._params = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+        # per bit position, its hash under every function (the tag universe is small)
+        self._bit_hashes: Dict[int, Tuple[int, ...]] = {}
+        self._buckets: List[Dict[Tuple[int, ...], Set[Any]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[Any, Tuple[int, ...]] = {}
+        self._masks: Dict[Any, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._masks)
+
+    def _hashes(self, pos: int) -> Tuple[int, ...]:
+        hashes = self._bit_hashes.get(pos)
+        if hashes is None:
+            hashes = self._bit_hashes[pos] = tuple((a * (pos + 1) + b) % _PRIME for a, b in self._params)
+        return hashes
+
+    def signature(self, mask: int) -> Tuple[int, ...]:
+        positions = _bit_positions(mask)
+        if not positions:
+            return ()
+        return tuple(map(min, zip(*(self._hashes(pos) for pos in positions))))
+
+    def _bands(self, sig: Tuple[int, ...]):
+        rows = self.rows
+        for band in range(self.bands):
+            yield band, sig[band * rows:(band + 1) * rows]
+
+    def add(self, uid: Any, mask: int) -> None:
+        if uid in self._masks:
+            self.remove(uid)
+        sig = self.signature(mask)
+        self._masks[uid] = mask
+        self._signatures[uid] = sig
+        if not sig:
+            return
+        for band, key in self._bands(sig):
+            self._buckets[band].setdefault(key, set()).add(uid)
+
+    def remove(self, uid: Any) -> bool:
+        if self._masks.pop(uid, None) is None:
+            return False
+        sig = self._signatures.pop(uid)
+        for band, key in self._bands(sig) if sig else ():
+            members = self._buckets[band].get(key)
+            if members is not None:
+                members.discard(uid)
+                if not members:
+                    del self._buckets[band][key]
+        return True
+
+    def candidates(self, mask: int, exclude: Any = None) -> Set[Any]:
+        """Ids sharing at least one band with `mask`'s signature."""
+        sig = self.signature(mask)
+        found: Set[Any] = set()
+        if sig:
+            for band, key in self._bands(sig):
+                found.update(self._buckets[band].get(key, ()))
+        found.discard(exclude)
+        return found
+
+    def query(self, mask: int, *, threshold: float = 0.0, k: Optional[int] = None, exclude: Any = None) -> List[Tuple[Any, float]]:
+        """LSH candidates re-ranked by exact Jaccard, best first."""
+        masks = self._masks
+        scored = [(uid, jaccard(mask, masks[uid])) for uid in self.candidates(mask, exclude)]
+        scored = [item for item in scored if item[1] >= threshold]
+        scored.sort(key=lambda item: -item[1])
+        return scored if k is None else scored[:k]
+
+
+def exact_top_k(mask: int, masks: Dict[Any, int], k: int, *, threshold: float = 0.0, exclude: Any = None) -> List[Tuple[Any, float]]:
+    """Exact Jaccard top-k over `masks`; users with equal masks are scored once."""
+    by_mask: Dict[int, List[Any]] = {}
+    for uid, m in masks.items():
+        if uid != exclude:
+            by_mask.setdefault(m, []).append(uid)
+    scored = sorted(((jaccard(mask, m), ids) for m, ids in by_mask.items()), key=lambda item: -item[0])
+    result: List[Tuple[Any, float]] = []
+    for score, ids in scored:
+        if score < threshold or len(result) >= k:
+            break
+        result.extend((uid, score) for uid in ids[:k - len(result)])
+    return result
+
+
+class InterestStage(BucketStage):
+    """Drop users without anyone in their bucket sharing at least `min_jaccard` of their interests.
+
+    Buckets up to `lsh_threshold` users are checked exactly (once per distinct
+    mask); larger buckets use `MinHashLSH` candidates, which may miss a few
+    low-overlap partners. The bucket's masks and LSH index (if built) are kept in
+    `shared['interests']`.
+    """
+
+    name = 'interests'
+
+    def __init__(self, min_jaccard: float = 0.2, *, lsh_threshold: int = 1_000, codec: InterestCodec = DEFAULT_CODEC):
+        self.min_jaccard = min_jaccard
+        self.lsh_threshold = lsh_threshold
+        self.codec = codec
+
+    def _viable_exact(self, masks: Iterable[int]) -> Set[int]:
+        counts: Dict[int, int] = {}
+        for m in masks:
+            counts[m] = counts.get(m, 0) + 1
+        threshold = self.min_jaccard
+        # two users with the same non-empty mask overlap completely
+        viable = {m for m, n in counts.items() if n > 1 and m and threshold <= 1.0}
+        distinct = list(counts)
+        for i, m in enumerate(distinct):
+            for other in distinct[i + 1:]:
+                if m in viable and other in viable:
+                    continue
+                if jaccard(m, other) >= threshold:
+                    viable.add(m)
+                    viable.add(other)
+        return viable
+
+    def prune(self, bucket: Bucket) -> None:
+        ids = [user_id(u) for u in bucket.users]
+        masks = {uid: self.codec.mask(u.get('interests')) for uid, u in zip(ids, bucket.users)}
+        lsh = None
+        if len(bucket.users) <= self.lsh_threshold:
+            viable = self._viable_exact(masks.values())
+            kept = [u for uid, u in zip(ids, bucket.users) if masks[uid] in viable]
+        else:
+            lsh = MinHashLSH()
+            for uid, m in masks.items():
+                lsh.add(uid, m)
+            kept = []
+            for uid, u in zip(ids, bucket.users):
+                if lsh.query(masks[uid], threshold=self.min_jaccard, k=1, exclude=uid):
+                    kept.append(u)
+                else:
+                    lsh.remove(uid)
+        bucket.users = kept
+        bucket.shared['interests'] = (masks, lsh)
+
+
+def filter_by_interests(data: Iterable[Dict[str, Any]], uuid: Any, k: int = 10, *args, **kwargs) -> List[Any]:
+    """Return ids of up to `k` users in `data` with the highest interest overlap with user `uuid`.
+
+    Pass `index=` to reuse a `MinHashLSH` already built over `data` (approximate);
+    otherwise the overlap is computed exactly.
+    """
+    index = kwargs.get('index')
+    if index is not None:
+        mask = index._masks.get(uuid)
+        return [] if mask is None else [uid for uid, _ in index.query(mask, k=k, exclude=uuid)]
+    masks = {user_id(u): interest_mask(u) for u in data}
+    if uuid not in masks:
+        return []
+    return [uid for uid, _ in exact_top_k(masks[uuid], masks, k, exclude=uuid)]
@@ -0,0 +1,338 @@
+import functools
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+LOCATION_KEYS = ('city', 'country', 'state', 'region', 'county')
+
+# A normalized location value is either a stripped string or a tuple of them
+LocationValue = Any
+LocationKey = Tuple[Tuple[str, LocationValue], ...]
+
+# raw (value, ...) tuples whose normalization is memoized
+NORMALIZE_CACHE_SIZE = 65_536
+
+
+def user_id(user: Dict[str, Any]) -> Any:
+    """Return the identifier used in output groupings (uuid, then id, then username)."""
+    return user.get('uuid') or user.get('id') or user.get('username')
+
+
+def _clean(val: Any) -> str:
+    return str(val).strip()
+
+
+def _display(raw: Tuple[Any, ...], keys: Tuple[str, ...]) -> LocationKey:
+    items = []
+    for key, val in zip(keys, raw):
+        if not val:
+            continue
+        if isinstance(val, tuple):
+            cleaned = tuple(c for c in (_clean(v) for v in val if v) if c)
+            if cleaned:
+                items.append((key, cleaned))
+        else:
+            cleaned = _clean(val)
+            if cleaned:
+                items.append((key, cleaned))
+    return tuple(items)
+
+
+def _raw(user: Dict[str, Any], keys: Iterable[str]) -> Tuple[Any, ...]:
+    return tuple(tuple(v) if isinstance(v, list) else v for v in map(user.get, keys))
+
+
+def normalize_location(user: Dict[str, Any], keys: Iterable[str] = LOCATION_KEYS) -> LocationKey:
+    """Return a hashable, normalized location for `user`.
+
+    Empty (or whitespace-only) values are skipped, strings are stripped and list
+    values become tuples of stripped strings. The result is a tuple of
+    (key, value) pairs in `keys` order; it keeps the original spelling and is
+    what gets written to filter_data/. Matching uses `canonical_location`.
+    """
+    keys = tuple(keys)
+    return _display(_raw(user, keys), keys)
+
+
+def canonical_location(loc: LocationKey) -> LocationKey:
+    """Matching form of a normalized location.
+
+    Values are casefolded with runs of whitespace collapsed, so "New York" and
+    "new  york" compare equal. Keys are kept as they are: {state: NY, region: NY}
+    and {state: NY} stay distinct, as in the matching rule of `_covers`.
+    """
+    items = []
+    for key, val in loc:
+        if isinstance(val, tuple):
+            val = tuple(' '.join(v.split()).casefold() for v in val)
+        else:
+            val = ' '.join(val.split()).casefold()
+        items.append((key, val))
+    return tuple(items)
+
+
+def location_dict(loc: LocationKey) -> Dict[str, Any]:
+    """Convert a normalized location back to the dict shape written to filter_data/."""
+    return {key: list(val) if isinstance(val, tuple) else val for key, val in loc}
+
+
+def _atoms(val: LocationValue) -> Tuple[str, ...]:
+    return val if isinstance(val, tuple) else (val,)
+
+
+def _covers(loc: LocationKey, other: LocationKey) -> bool:
+    """True when users at canonical location `other` are listed under canonical `loc` (the matching rule below)."""
+    values = dict(other)
+    for key, val in loc:
+        if key not in values or not set(_atoms(val)) & set(_atoms(values[key])):
+            return False
+    return True
+
+
+class LocationNormalizer:
+    """Memoized location normalization with integer location ids.
+
+    A user's raw location fields are normalized once per distinct combination:
+    the (display, id) result is cached in a bounded LRU keyed by the raw values,
+    so the common case is one tuple build and one cache hit. Every distinct
+    canonical location gets a small integer id; ids are never reused, so equal
+    ids always mean the same canonical location and grouping/dedup are integer
+    comparisons. (Only the raw-value cache is bounded; the id table holds one
+    entry per distinct canonical location, which stays small.)
+    """
+
+    def __init__(self, keys: Iterable[str] = LOCATION_KEYS, maxsize: int = NORMALIZE_CACHE_SIZE):
+        self.keys = tuple(keys)
+        self._ids: Dict[LocationKey, int] = {}
+        self._canonical: List[LocationKey] = []
+        self._lookup = functools.lru_cache(maxsize=maxsize)(self._compute)
+
+    def __len__(self) -> int:
+        return len(self._canonical)
+
+    def _compute(self, raw: Tuple[Any, ...]) -> Tuple[LocationKey, Optional[int]]:
+        display = _display(raw, self.keys)
+        return display, self.id_of(display, create=True)
+
+    def normalize(self, user: Dict[str, Any]) -> Tuple[LocationKey, Optional[int]]:
+        """(display location, location id) for `user`; the id is None without any location."""
+        raw = tuple(tuple(v) if isinstance(v, list) else v for v in map(user.get, self.keys))
+        try:
+            return self._lookup(raw)
+        except TypeError:
+            # unhashable field values (e.g. dicts) skip the cache
+            return self._compute(raw)
+
+    def id_of(self, loc: LocationKey, *, create: bool = False) -> Optional[int]:
+        """Id of a normalized (display) location; None if it is empty or unknown and `create` is off."""
+        if not loc:
+            return None
+        canonical = canonical_location(loc)
+        lid = self._ids.get(canonical)
+        if lid is None and create:
+            lid = self._ids[canonical] = len(self._canonical)
+            self._canonical.append(canonical)
+        return lid
+
+    def canonical(self, lid: int) -> LocationKey:
+        return self._canonical[lid]
+
+    def cache_info(self):
+        return self._lookup.cache_info()
+
+
+# shared by every filter that groups by location (same keys => same ids)
+NORMALIZER = LocationNormalizer()
+
+
+def location_id(user: Dict[str, Any]) -> Optional[int]:
+    """Shared integer id of the user's canonical location (None without a location)."""
+    return NORMALIZER.normalize(user)[1]
+
+
+class LocationIndex:
+    """Inverted index of users grouped by location.
+
+    Each user's location is normalized once on insert (through the shared,
+    memoized `LocationNormalizer`) and users whose canonical locations are equal
+    share a group keyed by the integer location id. Every canonical (key, value)
+    pair points at the groups that contain it, so looking up the users of a
+    location only touches the groups that can match instead of rescanning every
+    user. Groups are reported under the normalized location of the first user
+    that created them.
+
+    A user matches a location when, for every key of the location, the user has
+    an overlapping value for that key (plain equality for scalar values), compared
+    in canonical form. This is the rule the original nested-loop filters applied,
+    minus their sensitivity to case and spacing.
+    """
+
+    def __init__(self, users: Optional[Iterable[Dict[str, Any]]] = None, keys: Iterable[str] = LOCATION_KEYS,
+                 normalizer: Optional[LocationNormalizer] = None):
+        self.keys = tuple(keys)
+        if normalizer is None:
+            normalizer = NORMALIZER if self.keys == NORMALIZER.keys else LocationNormalizer(self.keys)
+        self.normalizer = normalizer
+        self._seq = 0
+        # seq -> (user, location id); dicts keep insertion order so output order is stable
+        self._rows: Dict[int, Tuple[Dict[str, Any], Optional[int]]] = {}
+        self._by_id: Dict[Any, int] = {}
+        # location id -> {seq: None} (an ordered set of rows)
+        self._groups: Dict[int, Dict[int, None]] = {}
+        # location id -> normalized location reported for the group
+        self._display: Dict[int, LocationKey] = {}
+        # (key, canonical atom) -> {location id: None}
+        self._postings: Dict[Tuple[str, str], Dict[int, None]] = {}
+        if users is not None:
+            for user in users:
+                self.add(user)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, uid: Any) -> bool:
+        return uid in self._by_id
+
+    def add(self, user: Dict[str, Any]) -> LocationKey:
+        """Index `user` and return its group's normalized location (() without one).
+
+        Re-adding a user with a known id replaces the previous entry.
+        """
+        uid = user_id(user)
+        if uid is not None and uid in self._by_id:
+            self.remove(uid)
+        loc, lid = self.normalizer.normalize(user)
+        seq = self._seq
+        self._seq += 1
+        self._rows[seq] = (user, lid)
+        if uid is not None:
+            self._by_id[uid] = seq
+        if lid is None:
+            return ()
+        group = self._groups.get(lid)
+        if group is None:
+            group = self._groups[lid] = {}
+            self._display[lid] = loc
+            for key, val in self.normalizer.canonical(lid):
+                for atom in _atoms(val):
+                    self._postings.setdefault((key, atom), {})[lid] = None
+        group[seq] = None
+        return self._display[lid]
+
+    def remove(self, uid: Any) -> Optional[Dict[str, Any]]:
+        """Drop the user with id `uid` from the index; return it, or None if unknown."""
+        seq = self._by_id.pop(uid, None)
+        if seq is None:
+            return None
+        user, lid = self._rows.pop(seq)
+        group = self._groups.get(lid)
+        if group is not None:
+            group.pop(seq, None)
+            if not group:
+                del self._groups[lid]
+                del self._display[lid]
+                for key, val in self.normalizer.canonical(lid):
+                    for atom in _atoms(val):
+                        posting = self._postings.get((key, atom))
+                        if posting is not None:
+                            posting.pop(lid, None)
+                            if not posting:
+                                del self._postings[(key, atom)]
+        return user
+
+    def update(self, user: Dict[str, Any]) -> LocationKey:
+        """Alias for `add`, kept for readability at call sites that edit users."""
+        return self.add(user)
+
+    def get(self, uid: Any) -> Optional[Dict[str, Any]]:
+        seq = self._by_id.get(uid)
+        return None if seq is None else self._rows[seq][0]
+
+    def location_id(self, uid: Any) -> Optional[int]:
+        seq = self._by_id.get(uid)
+        return None if seq is None else self._rows[seq][1]
+
+    def location_of(self, uid: Any) -> Optional[LocationKey]:
+        """Normalized location of the group `uid` is in (() without a location, None if unknown)."""
+        seq = self._by_id.get(uid)
+        if seq is None:
+            return None
+        lid = self._rows[seq][1]
+        return () if lid is None else self._display[lid]
+
+    def users(self) -> Iterator[Dict[str, Any]]:
+        """Iterate indexed users in insertion order."""
+        for user, _ in self._rows.values():
+            yield user
+
+    def locations(self) -> List[LocationKey]:
+        """Unique normalized locations, in the order they were first seen."""
+        return list(self._display.values())
+
+    def has_location(self, loc: LocationKey) -> bool:
+        return self.normalizer.id_of(loc) in self._groups
+
+    def _candidates(self, canonical: LocationKey) -> Dict[int, None]:
+        found: Dict[int, None] = {}
+        for key, val in canonical:
+            for atom in _atoms(val):
+                found.update(dict.fromkeys(self._postings.get((key, atom), ())))
+        return found
+
+    def covering(self, loc: LocationKey) -> List[LocationKey]:
+        """Indexed locations whose `members` include users at `loc` (the inverse of `members`)."""
+        canonical = canonical_location(loc)
+        canon = self.normalizer.canonical
+        return [self._display[lid] for lid in self._candidates(canonical) if _covers(canon(lid), canonical)]
+
+    def _matching_groups(self, canonical: LocationKey) -> List[int]:
+        candidates: Optional[set] = None
+        # Intersect the smallest posting sets first
+        per_key = []
+        for key, val in canonical:
+            found = set()
+            for atom in _atoms(val):
+                found.update(self._postings.get((key, atom), ()))
+            per_key.append(found)
+        for found in sorted(per_key, key=len):
+            candidates = found if candidates is None else candidates & found
+            if not candidates:
+                return []
+        return list(candidates or ())
+
+    def _members(self, canonical: LocationKey) -> List[Dict[str, Any]]:
+        groups = self._matching_groups(canonical)
+        if len(groups) == 1:
+            seqs: Iterable[int] = self._groups[groups[0]]
+        else:
+            seqs = sorted(seq for g in groups for seq in self._groups[g])
+        return [self._rows[seq][0] for seq in seqs]
+
+    def members(self, loc: LocationKey) -> List[Dict[str, Any]]:
+        """Users matching `loc`, in insertion order."""
+        return self._members(canonical_location(loc))
+
+    def groups(
+        self,
+        predicate: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        *,
+        skip_empty: bool = False,
+        id_of: Callable[[Dict[str, Any]], Any] = user_id,
+    ) -> List[Dict[str, Any]]:
+        """Return one dict per unique location with the ids of its matching users.
+
+        Args:
+            predicate: optional filter applied to each matching user.
+            skip_empty: drop locations without any (matching) users.
+            id_of: how to turn a user into the id listed under 'users'.
+        """
+        result = []
+        canon = self.normalizer.canonical
+        for lid, loc in self._display.items():
+            members = self._members(canon(lid))
+            if predicate is not None:
+                members = [u for u in members if predicate(u)]
+            if skip_empty and not members:
+                continue
+            entry = location_dict(loc)
+            entry['users'] = [id_of(u) for u in members]
+            result.append(entry)
+        return result
@@ -0,0 +1,196 @@
+"""
+Text similarity over profile bios, interests and free-text answers.
+
+`TextIndex` keeps a shared vocabulary (terms interned to ints), sparse term
+frequencies per profile and an inverted index term -> {profile: tf}. A top-k
+query only walks the postings of the query's own terms and accumulates cosine
+scores over TF-IDF weights, so it never compares against profiles that share
+no terms, and never computes all pairs.
+
+Profiles can be added, updated (e.g. after a bio edit) or removed at any time.
+IDF weights and document norms are snapshotted and refreshed once enough of the
+corpus has changed since the last snapshot, which keeps updates cheap.
+"""
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from filter.location_index import user_id
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'i', "i'm", 'in', 'is', 'it', 'just',
+    'me', 'my', 'of', 'on', 'or', 'so', 'the', 'to', 'up', 'who', 'with', 'you', 'your', 'also',
+))
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def profile_terms(user: Dict[str, Any]) -> Counter:
+    """Term counts for a profile: bio words, interest tags and free-text answer words.
+
+    Interests are kept as whole tags (prefixed "#") so "board games" stays one term.
+    """
+    texts = [v for v in (user.get('answers') or {}).values() if isinstance(v, str)]
+    bio = user.get('bio')
+    if isinstance(bio, str):
+        texts.append(bio)
+    # one regex pass over all of the profile's text
+    terms = Counter(tokenize(' '.join(texts)))
+    for tag in user.get('interests') or ():
+        if isinstance(tag, str) and tag.strip():
+            terms['#' + tag.strip().lower()] += 1
+    return terms
+
+
+class TextIndex:
+    """Incremental TF-IDF index with inverted postings; see the module docstring.
+
+    Args:
+        refresh_ratio: fraction of the corpus that may change before IDF weights
+            and norms are recomputed.
+        max_df_ratio: terms found in more than this fraction of profiles are
+            ignored at query time (they carry almost no signal but have the
+            longest postings).
+    """
+
+    def __init__(self, users: Optional[Iterable[Dict[str, Any]]] = None, *, refresh_ratio: float = 0.1, max_df_ratio: float = 0.5):
+        self.refresh_ratio = refresh_ratio
+        self.max_df_ratio = max_df_ratio
+        self._vocab: Dict[str, int] = {}
+        self._docs: Dict[Any, Dict[int, int]] = {}
+        self._postings: Dict[int, Dict[Any, int]] = {}
+        self._idf: Dict[int, float] = {}
+        self._norms: Dict[Any, float] = {}
+        self._snapshot_size = 0
+        self._changes = 0
+        # while bulk loading, norms are computed once by the final refresh()
+        self._bulk = True
+        if users is not None:
+            for user in users:
+                self.add(user)
+        self._bulk = False
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, uid: Any) -> bool:
+        return uid in self._docs
+
+    def _term_id(self, term: str) -> int:
+        tid = self._vocab.get(term)
+        if tid is None:
+            tid = self._vocab[term] = len(self._vocab)
+        return tid
+
+    def _weight(self, tid: int) -> float:
+        idf = self._idf.get(tid)
+        if idf is None:
+            # term unseen at the last snapshot: weight it from current counts
+            idf = math.log((1 + len(self._docs)) / (1 + len(self._postings.get(tid, ())))) + 1.0
+        return idf
+
+    def _norm(self, doc: Dict[int, int]) -> float:
+        idf, weight = self._idf, self._weight
+        total = 0.0
+        for tid, tf in doc.items():
+            w = idf.get(tid) or weight(tid)
+            total += (tf * w) ** 2
+        return math.sqrt(total)
+
+    def add(self, user: Dict[str, Any]) -> None:
+        """Index (or re-index) one profile."""
+        uid = user_id(user)
+        if uid is None:
+            return
+        if uid in self._docs:
+            self.remove(uid)
+        doc = {self._term_id(term): count for term, count in profile_terms(user).items()}
+        self._docs[uid] = doc
+        for tid, tf in doc.items():
+            self._postings.setdefault(tid, {})[uid] = tf
+        if not self._bulk:
+            self._norms[uid] = self._norm(doc)
+        self._changes += 1
+
+    update = add
+
+    def remove(self, uid: Any) -> bool:
+        doc = self._docs.pop(uid, None)
+        if doc is None:
+            return False
+        for tid in doc:
+            posting = self._postings.get(tid)
+            if posting is not None:
+                posting.pop(uid, None)
+                if not posting:
+                    del self._postings[tid]
+        self._norms.pop(uid, None)
+        self._changes += 1
+        return True
+
+    def refresh(self) -> None:
+        """Recompute IDF weights and norms from the current corpus."""
+        n = len(self._docs)
+        self._idf = {tid: math.log((1 + n) / (1 + len(posting))) + 1.0 for tid, posting in self._postings.items()}
+        self._norms = {uid: self._norm(doc) for uid, doc in self._docs.items()}
+        self._snapshot_size = n
+        self._changes = 0
+
+    def _maybe_refresh(self) -> None:
+        if self._changes > self.refresh_ratio * max(self._snapshot_size, 1):
+            self.refresh()
+
+    def _query(self, terms: Dict[int, int], k: int, exclude: Any = None) -> List[Tuple[Any, float]]:
+        self._maybe_refresh()
+        max_df = self.max_df_ratio * len(self._docs)
+        weights = {}
+        for tid, tf in terms.items():
+            posting = self._postings.get(tid)
+            if posting and len(posting) <= max_df:
+                weights[tid] = tf * self._weight(tid)
+        qnorm = math.sqrt(sum(w * w for w in weights.values()))
+        if not qnorm:
+            return []
+        scores: Dict[Any, float] = {}
+        get = scores.get
+        for tid, qw in weights.items():
+            w = qw * self._weight(tid)
+            for uid, tf in self._postings[tid].items():
+                scores[uid] = get(uid, 0.0) + w * tf
+        scores.pop(exclude, None)
+        norms = self._norms
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1] / (norms.get(item[0]) or 1.0))
+        return [(uid, score / (qnorm * (norms.get(uid) or 1.0))) for uid, score in best]
+
+    def similar(self, uid: Any, k: int = 10) -> List[Tuple[Any, float]]:
+        """Top-k profiles most similar to the indexed profile `uid`, as (id, cosine)."""
+        doc = self._docs.get(uid)
+        if doc is None:
+            return []
+        return self._query(doc, k, exclude=uid)
+
+    def search(self, text: str, k: int = 10) -> List[Tuple[Any, float]]:
+        """Top-k profiles for free text."""
+        terms: Counter = Counter()
+        for term in tokenize(text):
+            tid = self._vocab.get(term)
+            if tid is not None:
+                terms[tid] += 1
+        return self._query(terms, k)
+
+
+def filter_by_text(data: Iterable[Dict[str, Any]], uuid: Any, k: int = 10, *args, **kwargs) -> List[Any]:
+    """Return ids of the `k` profiles in `data` whose text is most similar to user `uuid`'s.
+
+    Pass `index=` to reuse a `TextIndex` already built over `data`.
+    """
+    index = kwargs.get('index')
+    if index is None:
+        index = TextIndex(data)
+    return [uid for uid, _ in index.similar(uuid, k)]
@@ -0,0 +1,274 @@
+"""
+Single-pass filter pipeline.
+
+Stages are chained generators. User stages (e.g. validity) filter the user
+stream; `LocationStage` turns the stream into location buckets; bucket stages
+(gender, age) prune users that have no possible partner inside their bucket.
+Every user read from the source is also added to one shared `LocationIndex`,
+so the location groupings written by `filter_by_location`/`is_profile_valid`
+can reuse it instead of regrouping the users.
+
+Each stage records how many items went in and out and the time spent in its
+own code (upstream time excluded).
+"""
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from filter.age import AgeIndex
+from filter.gender import GenderIndex
+from filter.is_profile_valid import is_user_valid
+from filter.location_index import LocationIndex, LocationKey, location_dict, user_id
+from instrumentation import METRICS
+
+
+class StageStats:
+    """Users in/out of a stage (users inside buckets count individually), buckets out and own time."""
+
+    __slots__ = ('name', 'users_in', 'users_out', 'buckets_out', 'seconds')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.users_in = 0
+        self.users_out = 0
+        self.buckets_out = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'stage': self.name, 'in': self.users_in, 'out': self.users_out, 'buckets': self.buckets_out, 'seconds': self.seconds}
+
+
+class Bucket:
+    """Users sharing one normalized location, plus per-bucket structures built by stages."""
+
+    __slots__ = ('location', 'users', 'shared')
+
+    def __init__(self, location: LocationKey, users: List[Dict[str, Any]]):
+        self.location = location
+        self.users = users
+        self.shared: Dict[str, Any] = {}
+
+    def as_dict(self) -> Dict[str, Any]:
+        entry = location_dict(self.location)
+        entry['users'] = [user_id(u) for u in self.users]
+        return entry
+
+
+class PipelineContext:
+    """State shared by all stages of one run."""
+
+    def __init__(self, index: Optional[LocationIndex] = None):
+        self.index = index if index is not None else LocationIndex()
+        self.stats: List[StageStats] = []
+
+
+def _count(stats: StageStats, item: Any, out: bool) -> None:
+    if isinstance(item, Bucket):
+        n = len(item.users)
+        if out:
+            stats.buckets_out += 1
+    else:
+        n = 1
+    if out:
+        stats.users_out += n
+    else:
+        stats.users_in += n
+
+
+class _Timed:
+    """Iterator wrapper measuring a stage's inclusive time and output count."""
+
+    __slots__ = ('_it', 'stats', 'inclusive')
+
+    def __init__(self, it: Iterator, stats: StageStats):
+        self._it = it
+        self.stats = stats
+        self.inclusive = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            item = next(self._it)
+        finally:
+            self.inclusive += time.perf_counter() - t0
+        _count(self.stats, item, True)
+        return item
+
+
+class _Counted:
+    """Iterator wrapper counting what a stage pulls from upstream."""
+
+    __slots__ = ('_it', 'stats')
+
+    def __init__(self, it: Iterator, stats: StageStats):
+        self._it = it
+        self.stats = stats
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self._it)
+        _count(self.stats, item, False)
+        return item
+
+
+class Stage:
+    """Base stage: `process` consumes an iterator and yields results."""
+
+    name = 'stage'
+
+    def process(self, items: Iterator, context: PipelineContext) -> Iterator:
+        raise NotImplementedError
+
+
+class UserFilterStage(Stage):
+    """Keep users for which `predicate(user)` is true."""
+
+    def __init__(self, name: str, predicate: Callable[[Dict[str, Any]], bool]):
+        self.name = name
+        self.predicate = predicate
+
+    def process(self, users, context):
+        predicate = self.predicate
+        for user in users:
+            if predicate(user):
+                yield user
+
+
+class ValidityStage(UserFilterStage):
+    """Drop banned/unverified profiles (same rule as `is_profile_valid`)."""
+
+    def __init__(self):
+        super().__init__('validity', is_user_valid)
+
+
+class LocationStage(Stage):
+    """Group the user stream into `Bucket`s, reusing locations normalized by the shared index."""
+
+    name = 'location'
+
+    def process(self, users, context):
+        buckets: Dict[LocationKey, List[Dict[str, Any]]] = {}
+        index = context.index
+        for user in users:
+            loc = index.location_of(user_id(user))
+            if loc is None:
+                loc = index.add(user)
+            if loc:
+                buckets.setdefault(loc, []).append(user)
+        for loc, members in buckets.items():
+            yield Bucket(loc, members)
+
+
+class BucketStage(Stage):
+    """Prune each bucket with `prune(bucket)`; empty buckets are dropped."""
+
+    def process(self, buckets, context):
+        for bucket in buckets:
+            self.prune(bucket)
+            if bucket.users:
+                yield bucket
+
+    def prune(self, bucket: Bucket) -> None:
+        raise NotImplementedError
+
+
+class GenderStage(BucketStage):
+    """Drop users whose gender preference can't be met by anyone in their bucket; keeps the bucket's `GenderIndex` in `shared['gender']`."""
+
+    name = 'gender'
+
+    def prune(self, bucket):
+        index = GenderIndex(bucket.users)
+        counts = index.counts()
+        kept = []
+        for user in bucket.users:
+            uid = user_id(user)
+            if counts.get(uid, 0) > 0:
+                kept.append(user)
+            else:
+                index.remove(uid)
+        bucket.users = kept
+        bucket.shared['gender'] = index
+
+
+class AgeStage(BucketStage):
+    """Drop users without a mutually age-compatible partner; keeps the bucket's `AgeIndex` in `shared['age']`."""
+
+    name = 'age'
+
+    def prune(self, bucket):
+        index = AgeIndex(bucket.users)
+        counts = index.counts()
+        kept = []
+        for user in bucket.users:
+            uid = user_id(user)
+            if counts.get(uid, 0) > 0:
+                kept.append(user)
+            else:
+                index.remove(uid)
+        bucket.users = kept
+        bucket.shared['age'] = index
+
+
+def default_stages() -> List[Stage]:
+    return [ValidityStage(), LocationStage(), GenderStage(), AgeStage()]
+
+
+class Pipeline:
+    """Chain of stages run lazily over one pass of a user stream."""
+
+    def __init__(self, stages: Optional[Iterable[Stage]] = None):
+        self.stages = list(stages) if stages is not None else default_stages()
+        self.context: Optional[PipelineContext] = None
+
+    def _source(self, users: Iterable[Dict[str, Any]], context: PipelineContext) -> Iterator[Dict[str, Any]]:
+        index = context.index
+        for user in users:
+            index.add(user)
+            yield user
+
+    def iter(self, users: Iterable[Dict[str, Any]], context: Optional[PipelineContext] = None) -> Iterator:
+        """Lazily yield the last stage's output; stats fill in as items flow through."""
+        context = context or PipelineContext()
+        self.context = context
+        source_stats = StageStats('source')
+        upstream = _Timed(self._source(users, context), source_stats)
+        context.stats = [source_stats]
+        timers = [upstream]
+        for stage in self.stages:
+            stats = StageStats(stage.name)
+            context.stats.append(stats)
+            upstream = _Timed(stage.process(_Counted(upstream, stats), context), stats)
+            timers.append(upstream)
+        try:
+            yield from upstream
+        finally:
+            # convert inclusive times into per-stage times
+            previous = 0.0
+            for timer in timers:
+                timer.stats.seconds = timer.inclusive - previous
+                previous = timer.inclusive
+            source_stats.users_in = source_stats.users_out
+            if METRICS.enabled:
+                for stats in context.stats:
+                    name = f'stage.{stats.name}'
+                    METRICS.observe(name, stats.seconds)
+                    METRICS.count('users_in', stats.users_in, name)
+                    METRICS.count('users_out', stats.users_out, name)
+                    METRICS.count('buckets', stats.buckets_out, name)
+
+    def run(self, users: Iterable[Dict[str, Any]], context: Optional[PipelineContext] = None) -> List[Any]:
+        return list(self.iter(users, context))
+
+    def report(self) -> str:
+        """Per-stage counts and timings of the last run as a small text table."""
+        if self.context is None:
+            return ''
+        lines = [f"{'stage':<10} {'in':>8} {'out':>8} {'buckets':>8} {'ms':>9}"]
+        for stats in self.context.stats:
+            lines.append(f"{stats.name:<10} {stats.users_in:>8} {stats.users_out:>8} {stats.buckets_out:>8} {stats.seconds * 1000:>9.2f}")
+        return '\n'.join(lines)
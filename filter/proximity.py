@@ -0,0 +1,213 @@
+import heapq
+import math
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from filter.location_index import user_id
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+Cell = Tuple[int, int]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in kilometres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _coords(user: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    lat, lon = user.get('lat'), user.get('lon')
+    if lat is None or lon is None:
+        return None
+    lat, lon = float(lat), float(lon)
+    if math.isnan(lat) or math.isnan(lon):
+        return None
+    return lat, lon
+
+
+class GridIndex:
+    """Uniform lat/lon grid for radius and k-nearest-neighbour searches.
+
+    Points are bucketed into square cells of `cell_km` (measured at the equator).
+    A radius query only visits the cells overlapping the search box, and a kNN
+    query grows rings of cells outward until nothing closer can remain, so the
+    work per query depends on local density rather than the total user count.
+    Results are (id, distance_km) pairs ordered by distance. Longitudes are not
+    wrapped at the antimeridian.
+    """
+
+    def __init__(self, users: Optional[Iterable[Dict[str, Any]]] = None, *, cell_km: float = 1.0):
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self._cells: Dict[Cell, Dict[Any, Tuple[float, float]]] = {}
+        self._points: Dict[Any, Tuple[float, float]] = {}
+        if users is not None:
+            for user in users:
+                self.add(user)
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, uid: Any) -> bool:
+        return uid in self._points
+
+    def _cell(self, lat: float, lon: float) -> Cell:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def insert(self, uid: Any, lat: float, lon: float) -> None:
+        """Add or move the point `uid`."""
+        if uid in self._points:
+            self.remove(uid)
+        self._points[uid] = (lat, lon)
+        self._cells.setdefault(self._cell(lat, lon), {})[uid] = (lat, lon)
+
+    def add(self, user: Dict[str, Any]) -> bool:
+        """Insert a user dict by its lat/lon; False if it has no coordinates or id."""
+        uid = user_id(user)
+        coords = _coords(user)
+        if uid is None or coords is None:
+            return False
+        self.insert(uid, *coords)
+        return True
+
+    def remove(self, uid: Any) -> bool:
+        point = self._points.pop(uid, None)
+        if point is None:
+            return False
+        cell = self._cell(*point)
+        members = self._cells[cell]
+        del members[uid]
+        if not members:
+            del self._cells[cell]
+        return True
+
+    def _lon_span_deg(self, lat: float, km: float) -> float:
+        """Longitude degrees covering `km` at the worst latitude within `km` of `lat`."""
+        worst = min(90.0, abs(lat) + km / KM_PER_DEGREE)
+        cos_lat = math.cos(math.radians(worst))
+        if cos_lat < 1e-6:
+            return 360.0
+        return min(360.0, km / (KM_PER_DEGREE * cos_lat))
+
+    def _cells_in_box(self, lat: float, lon: float, km: float) -> Iterator[Dict[Any, Tuple[float, float]]]:
+        dlat = km / KM_PER_DEGREE
+        dlon = self._lon_span_deg(lat, km)
+        r0, c0 = self._cell(lat - dlat, lon - dlon)
+        r1, c1 = self._cell(lat + dlat, lon + dlon)
+        # for sparse indexes it is cheaper to walk the occupied cells
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > len(self._cells):
+            for (r, c), members in self._cells.items():
+                if r0 <= r <= r1 and c0 <= c <= c1:
+                    yield members
+            return
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                members = self._cells.get((r, c))
+                if members:
+                    yield members
+
+    def radius(self, lat: float, lon: float, km: float, *, exclude: Any = None) -> List[Tuple[Any, float]]:
+        """All points within `km` of (lat, lon), nearest first."""
+        found = []
+        dlat = km / KM_PER_DEGREE
+        dlon = self._lon_span_deg(lat, km)
+        for members in self._cells_in_box(lat, lon, km):
+            for uid, (plat, plon) in members.items():
+                # cheap bounding-box reject before the trigonometry
+                if abs(plat - lat) > dlat or abs(plon - lon) > dlon or uid == exclude:
+                    continue
+                d = haversine_km(lat, lon, plat, plon)
+                if d <= km:
+                    found.append((uid, d))
+        found.sort(key=lambda item: item[1])
+        return found
+
+    def knn(self, lat: float, lon: float, k: int, *, max_km: Optional[float] = None, exclude: Any = None) -> List[Tuple[Any, float]]:
+        """The `k` nearest points to (lat, lon), optionally capped at `max_km`."""
+        if k <= 0 or not self._points:
+            return []
+        r0, c0 = self._cell(lat, lon)
+        # max-heap of the best k so far, as (-distance, uid)
+        best: List[Tuple[float, Any]] = []
+        best_km: Optional[float] = max_km
+        seen = 0
+        ring = 0
+        while True:
+            if ring and 8 * ring > len(self._cells):
+                # rings now cost more than the occupied cells: sweep what is left
+                cells: Iterable[Dict[Any, Tuple[float, float]]] = [
+                    members for (r, c), members in self._cells.items()
+                    if max(abs(r - r0), abs(c - c0)) >= ring
+                ]
+                last = True
+            else:
+                cells = filter(None, (self._cells.get(cell) for cell in self._ring(r0, c0, ring)))
+                last = False
+            for members in cells:
+                for uid, (plat, plon) in members.items():
+                    seen += 1
+                    if uid == exclude:
+                        continue
+                    # latitude difference alone bounds the distance from below
+                    if best_km is not None and abs(plat - lat) * KM_PER_DEGREE > best_km:
+                        continue
+                    d = haversine_km(lat, lon, plat, plon)
+                    if max_km is not None and d > max_km:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, uid))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, uid))
+                    else:
+                        continue
+                    if len(best) == k:
+                        best_km = -best[0][0]
+            if last or seen >= len(self._points):
+                break
+            # anything outside the searched rings is at least this far away
+            reach_km = ring * self.cell_deg * KM_PER_DEGREE
+            cos_lat = math.cos(math.radians(min(90.0, abs(lat) + (ring + 1) * self.cell_deg)))
+            bound_km = reach_km * max(cos_lat, 0.0)
+            if len(best) == k and bound_km >= -best[0][0]:
+                break
+            if max_km is not None and bound_km > max_km:
+                break
+            ring += 1
+        return sorted(((uid, -negd) for negd, uid in best), key=lambda item: item[1])
+
+    @staticmethod
+    def _ring(r0: int, c0: int, ring: int) -> Iterator[Cell]:
+        if ring == 0:
+            yield (r0, c0)
+            return
+        for c in range(c0 - ring, c0 + ring + 1):
+            yield (r0 - ring, c)
+            yield (r0 + ring, c)
+        for r in range(r0 - ring + 1, r0 + ring):
+            yield (r, c0 - ring)
+            yield (r, c0 + ring)
+
+    def batch_radius(self, km: float) -> Dict[Any, List[Tuple[Any, float]]]:
+        """Radius neighbours for every indexed point (the point itself excluded)."""
+        return {uid: self.radius(lat, lon, km, exclude=uid) for uid, (lat, lon) in self._points.items()}
+
+    def batch_knn(self, k: int, *, max_km: Optional[float] = None) -> Dict[Any, List[Tuple[Any, float]]]:
+        """k nearest neighbours for every indexed point (the point itself excluded)."""
+        return {uid: self.knn(lat, lon, k, max_km=max_km, exclude=uid) for uid, (lat, lon) in self._points.items()}
+
+
+def filter_by_proximity(data: Iterable[Dict[str, Any]], uuid: Any, km: float, *args, **kwargs) -> List[Any]:
+    """Return ids of users within `km` of user `uuid`, nearest first.
+
+    Pass `index=` to reuse a `GridIndex` already built over `data`.
+    """
+    index = kwargs.get('index')
+    if index is None:
+        index = GridIndex(data)
+    point = index._points.get(uuid)
+    if point is None:
+        return []
+    return [uid for uid, _ in index.radius(point[0], point[1], km, exclude=uuid)]
@@ -0,0 +1,225 @@
+"""
+Activity- and freshness-weighted candidate ranking.
+
+Each candidate gets one score from profile fields alone:
+
+    recency    * 0.5 ** (days since last_login / recency_half_life_days)
+  + freshness  * 0.5 ** (days since created_at / freshness_half_life_days)
+  + verified   * is_verified
+  + credits    * min(credits, credits_cap) / credits_cap
+
+ISO timestamps are parsed once per distinct string (`epoch_seconds`) into
+integer epoch seconds when an `ActivityRanker` is built, and scores are
+computed once per candidate, never per comparison. Selection is lazy:
+`top_k` is a `heapq.nsmallest` over the candidates, O(n log k), and
+`iter_ranked` is a generator over a heapified pool (O(n) to start, one heap
+pop per result), so paging never needs a full sort.
+
+`RankingStage` plugs the ranker into the filter pipeline after location
+grouping.
+"""
+import functools
+import heapq
+import itertools
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from filter.location_index import user_id
+from filter.pipeline import Bucket, BucketStage
+
+DAY = 86_400
+TIMESTAMP_CACHE_SIZE = 65_536
+
+
+@functools.lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def _parse_iso(value: str) -> Optional[int]:
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        # naive timestamps are taken as UTC, like the generated data
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def epoch_seconds(value: Any) -> Optional[int]:
+    """Integer epoch seconds for an ISO string, datetime or number; None if missing or unparseable."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if math.isfinite(value) else None
+    if isinstance(value, datetime):
+        dt = value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+        return int(dt.timestamp())
+    if isinstance(value, str):
+        return _parse_iso(value.strip())
+    return None
+
+
+class RankWeights:
+    """Weights and scales of the ranking score (see the module docstring)."""
+
+    __slots__ = ('recency', 'freshness', 'verified', 'credits',
+                 'recency_half_life_days', 'freshness_half_life_days', 'credits_cap')
+
+    def __init__(self, recency: float = 1.0, freshness: float = 0.25, verified: float = 0.5, credits: float = 0.25, *,
+                 recency_half_life_days: float = 1.0, freshness_half_life_days: float = 90.0, credits_cap: float = 500.0):
+        self.recency = recency
+        self.freshness = freshness
+        self.verified = verified
+        self.credits = credits
+        self.recency_half_life_days = recency_half_life_days
+        self.freshness_half_life_days = freshness_half_life_days
+        self.credits_cap = credits_cap
+
+    def as_dict(self) -> Dict[str, float]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+DEFAULT_WEIGHTS = RankWeights()
+
+
+def _decay(then: Optional[int], now: int, half_life_days: float) -> float:
+    if then is None or half_life_days <= 0:
+        return 0.0
+    return 0.5 ** (max(0, now - then) / (half_life_days * DAY))
+
+
+class ActivityRanker:
+    """Precomputed ranking scores for a set of candidates.
+
+    Args:
+        users: candidates (users without an id are skipped).
+        weights: score weights; defaults to `DEFAULT_WEIGHTS`.
+        now: reference time (epoch seconds, datetime or ISO string); defaults to the current time.
+    """
+
+    def __init__(self, users: Iterable[Dict[str, Any]] = (), *, weights: Optional[RankWeights] = None, now: Any = None):
+        self.weights = weights or DEFAULT_WEIGHTS
+        parsed = epoch_seconds(now)
+        self.now = int(time.time()) if parsed is None else parsed
+        self._seq = itertools.count()
+        # uid -> (negated score, insertion seq); seq breaks ties in insertion order
+        self._keys: Dict[Any, Tuple[float, int]] = {}
+        # heap-ready (negated score, seq, uid) rows of everyone, rebuilt after changes
+        self._rows: Optional[List[Tuple[float, int, Any]]] = None
+        for user in users:
+            self.add(user)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, uid: Any) -> bool:
+        return uid in self._keys
+
+    def score_of(self, user: Dict[str, Any]) -> float:
+        w = self.weights
+        score = w.recency * _decay(epoch_seconds(user.get('last_login')), self.now, w.recency_half_life_days)
+        score += w.freshness * _decay(epoch_seconds(user.get('created_at')), self.now, w.freshness_half_life_days)
+        if user.get('is_verified'):
+            score += w.verified
+        credits = user.get('credits')
+        if isinstance(credits, (int, float)) and not isinstance(credits, bool) and w.credits_cap > 0:
+            score += w.credits * max(0.0, min(float(credits), w.credits_cap)) / w.credits_cap
+        return score
+
+    def add(self, user: Dict[str, Any]) -> bool:
+        """Score and index `user` (replacing a previous entry); False when it has no id."""
+        uid = user_id(user)
+        if uid is None:
+            return False
+        self._keys[uid] = (-self.score_of(user), next(self._seq))
+        self._rows = None
+        return True
+
+    def remove(self, uid: Any) -> bool:
+        if self._keys.pop(uid, None) is None:
+            return False
+        self._rows = None
+        return True
+
+    def score(self, uid: Any) -> Optional[float]:
+        key = self._keys.get(uid)
+        return None if key is None else -key[0]
+
+    def _pool(self, candidates: Optional[Iterable[Any]], exclude: Any) -> List[Tuple[float, int, Any]]:
+        keys = self._keys
+        if candidates is None:
+            if self._rows is None:
+                self._rows = [(neg, seq, uid) for uid, (neg, seq) in keys.items()]
+            if exclude is None or exclude not in keys:
+                return self._rows
+            return [row for row in self._rows if row[2] != exclude]
+        pool = []
+        for uid in candidates:
+            key = keys.get(uid)
+            if key is not None and uid != exclude:
+                pool.append((key[0], key[1], uid))
+        return pool
+
+    def top_k(self, k: int, candidates: Optional[Iterable[Any]] = None, *, exclude: Any = None) -> List[Tuple[Any, float]]:
+        """Best `k` (id, score) pairs among `candidates` (default: everyone indexed), in O(n log k)."""
+        if k <= 0:
+            return []
+        return [(uid, -neg) for neg, _, uid in heapq.nsmallest(k, self._pool(candidates, exclude))]
+
+    def iter_ranked(self, candidates: Optional[Iterable[Any]] = None, *, exclude: Any = None) -> Iterator[Tuple[Any, float]]:
+        """Yield (id, score) best first, lazily.
+
+        The pool is heapified once (O(n), no full sort) when the first result is
+        requested, and each result after that is one O(log n) heap pop, so a
+        caller reading m results pays O(n + m log n).
+        """
+        heap = list(self._pool(candidates, exclude))
+        heapq.heapify(heap)
+        while heap:
+            neg, _, uid = heapq.heappop(heap)
+            yield uid, -neg
+
+    def page(self, number: int, page_size: int = 20, candidates: Optional[Iterable[Any]] = None, *,
+             exclude: Any = None) -> List[Tuple[Any, float]]:
+        """Results of page `number` (0-based) of `iter_ranked`."""
+        start = number * page_size
+        if start == 0:
+            return self.top_k(page_size, candidates, exclude=exclude)
+        return list(itertools.islice(self.iter_ranked(candidates, exclude=exclude), start, start + page_size))
+
+
+class RankingStage(BucketStage):
+    """Score each bucket's users by activity and freshness; the ranker is kept in `shared['ranking']`.
+
+    With `limit`, only the best `limit` users of each bucket are kept (best
+    first); otherwise the bucket is left as is and callers page through
+    `shared['ranking'].iter_ranked()` or `.page(n)`.
+    """
+
+    name = 'ranking'
+
+    def __init__(self, weights: Optional[RankWeights] = None, *, limit: Optional[int] = None, now: Any = None):
+        self.weights = weights
+        self.limit = limit
+        self.now = now
+
+    def prune(self, bucket: Bucket) -> None:
+        ranker = ActivityRanker(bucket.users, weights=self.weights, now=self.now)
+        if self.limit is not None:
+            by_id = {user_id(u): u for u in bucket.users}
+            bucket.users = [by_id[uid] for uid, _ in ranker.top_k(self.limit)]
+        bucket.shared['ranking'] = ranker
+
+
+def filter_by_activity(data: Iterable[Dict[str, Any]], uuid: Any, k: int = 10, *args, **kwargs) -> List[Any]:
+    """Return ids of up to `k` users in `data` (other than `uuid`) ranked by activity and freshness.
+
+    Pass `index=` to reuse an `ActivityRanker` already built over `data`, and
+    `weights=` / `now=` to configure a new one.
+    """
+    index = kwargs.get('index')
+    if index is None:
+        index = ActivityRanker(data, weights=kwargs.get('weights'), now=kwargs.get('now'))
+    return [uid for uid, _ in index.top_k(k, exclude=uuid)]
@@ -2,14 +2,20 @@
 Generator script for synthetic dating-app users and questions.
 Writes:
  - data/questions.json
- - data/users.json
+ - data/users.json (or NDJSON with --format ndjson)
 
-Run with: python generate_users.py
+Run with: python generate_users.py [--users N] [--seed S] [--format ndjson] [--city-skew 1.2] ...
+(see --help). Users are generated and written one at a time, so sizes in the
+millions don't need to fit in memory.
 """
+import argparse
 import json
+import math
 import random
+import tempfile
 import uuid
 from datetime import datetime, timedelta, timezone
+from pathlib import Path
 
 # Config
 NUM_USERS = 1000
@@ -17,7 +23,8 @@ NUM_QUESTIONS = 150
 OUTPUT_USERS = "data/users.json"
 OUTPUT_QUESTIONS = "data/questions.json"
 SEED = 42
-random.seed(SEED)
+# seeded runs use this instead of the wall clock so timestamps are reproducible
+REFERENCE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
 
 # Small helper pools
 first_names = [
@@ -49,6 +56,8 @@ cities = [
     {"city":"Toronto","state":"ON","country":"Canada","lat":43.6532,"lon":-79.3832}
 ]
 
+CITY_WEIGHTS = [1.2,1.5,0.7,0.8,0.6,0.9,0.5,1.1,0.4,0.4]
+
 # Use single-letter codes to match Django model choices: M, F, O (other), N (prefer not / any)
 genders = ["M", "F", "O"]
 preference_options = ["M", "F", "O", "N"]
@@ -93,55 +102,54 @@ free_templates = [
     "What's an embarrassing moment you can laugh about now?"
 ]
 
-questions = []
-qid = 1
-# Add binary questions
-for t in binary_templates:
-    questions.append({"id": qid, "key": f"q{qid}", "text": t, "type": "binary"})
-    qid += 1
-# Add scale questions
-for t in scale_templates:
-    questions.append({"id": qid, "key": f"q{qid}", "text": t, "type": "scale", "scale_min": 1, "scale_max": 5})
-    qid += 1
-# Add multi-choice
-for t, opts in mc_templates:
-    questions.append({"id": qid, "key": f"q{qid}", "text": t, "type": "multi-choice", "options": opts})
-    qid += 1
-# Add free text
-for t in free_templates:
-    questions.append({"id": qid, "key": f"q{qid}", "text": t, "type": "free-text"})
-    qid += 1
-
-# If we need more to reach NUM_QUESTIONS, create paraphrased lifestyle/opinion questions
-extra_templates = [
-    "Do you enjoy attending live sporting events?",
-    "Do you prefer nights out or nights in?",
-    "Are you open to long-distance relationships?",
-    "Would you relocate for a partner?",
-    "Do you enjoy spontaneous trips?",
-    "How do you feel about a partner's exes?",
-    "Do you like sharing passwords with partner?",
-    "Do you prefer texting or calling?",
-    "Do you like debating ideas?",
-    "Would you date someone with children?",
-]
-while qid <= NUM_QUESTIONS:
-    t = random.choice(extra_templates)
-    qtype = random.choice(["binary","scale","multi-choice","free-text"])
-    if qtype == "binary":
+def build_questions(num_questions=NUM_QUESTIONS):
+    """Return the question list: fixed templates first, padded with random extras."""
+    questions = []
+    qid = 1
+    # Add binary questions
+    for t in binary_templates:
         questions.append({"id": qid, "key": f"q{qid}", "text": t, "type": "binary"})
-    elif qtype == "scale":
-        questions.append({"id": qid, "key": f"q{qid}", "text": t + " (1-5)", "type": "scale", "scale_min": 1, "scale_max": 5})
-    elif qtype == "multi-choice":
-        opts = random.choice([opt for _, opt in mc_templates])
+        qid += 1
+    # Add scale questions
+    for t in scale_templates:
+        questions.append({"id": qid, "key": f"q{qid}", "text": t, "type": "scale", "scale_min": 1, "scale_max": 5})
+        qid += 1
+    # Add multi-choice
+    for t, opts in mc_templates:
         questions.append({"id": qid, "key": f"q{qid}", "text": t, "type": "multi-choice", "options": opts})
-    else:
-        questions.append({"id": qid, "key": f"q{qid}", "text": t + " (short answer)", "type": "free-text"})
-    qid += 1
+        qid += 1
+    # Add free text
+    for t in free_templates:
+        questions.append({"id": qid, "key": f"q{qid}", "text": t, "type": "free-text"})
+        qid += 1
 
-# Save questions
-with open(OUTPUT_QUESTIONS, "w", encoding="utf-8") as f:
-    json.dump(questions, f, indent=2, ensure_ascii=False)
+    # If we need more to reach NUM_QUESTIONS, create paraphrased lifestyle/opinion questions
+    extra_templates = [
+        "Do you enjoy attending live sporting events?",
+        "Do you prefer nights out or nights in?",
+        "Are you open to long-distance relationships?",
+        "Would you relocate for a partner?",
+        "Do you enjoy spontaneous trips?",
+        "How do you feel about a partner's exes?",
+        "Do you like sharing passwords with partner?",
+        "Do you prefer texting or calling?",
+        "Do you like debating ideas?",
+        "Would you date someone with children?",
+    ]
+    while qid <= num_questions:
+        t = random.choice(extra_templates)
+        qtype = random.choice(["binary","scale","multi-choice","free-text"])
+        if qtype == "binary":
+            questions.append({"id": qid, "key": f"q{qid}", "text": t, "type": "binary"})
+        elif qtype == "scale":
+            questions.append({"id": qid, "key": f"q{qid}", "text": t + " (1-5)", "type": "scale", "scale_min": 1, "scale_max": 5})
+        elif qtype == "multi-choice":
+            opts = random.choice([opt for _, opt in mc_templates])
+            questions.append({"id": qid, "key": f"q{qid}", "text": t, "type": "multi-choice", "options": opts})
+        else:
+            questions.append({"id": qid, "key": f"q{qid}", "text": t + " (short answer)", "type": "free-text"})
+        qid += 1
+    return questions
 
 # Helper to random jitter lat/lon
 def jitter(lat, lon, km=10):
@@ -172,9 +180,36 @@ def answer_for_question(q):
     return None
 
 # Generate users clustered by city to create similar/different groups
-users = []
-for i in range(NUM_USERS):
-    uid = str(uuid.uuid4())
+def random_uuid():
+    """A version-4 UUID drawn from the module RNG (so seeded runs repeat)."""
+    return str(uuid.UUID(int=random.getrandbits(128), version=4))
+
+
+def make_cities(num_cities=None):
+    """The base cities, plus synthetic satellites ("Austin 2", ...) up to `num_cities`."""
+    result = list(cities)
+    n = 0
+    while num_cities is not None and len(result) < num_cities:
+        base = cities[n % len(cities)]
+        copy = len(result) // len(cities) + 1
+        lat, lon = jitter(base["lat"], base["lon"], km=300)
+        result.append(dict(base, city=f"{base['city']} {copy}", lat=lat, lon=lon))
+        n += 1
+    return result
+
+
+def city_weights(city_list, skew=None):
+    """Sampling weights: the hand-tuned defaults, or Zipf-like 1/rank**skew (0 = uniform)."""
+    if skew is None and len(city_list) == len(cities):
+        return CITY_WEIGHTS
+    skew = 1.0 if skew is None else skew
+    return [1.0 / math.pow(rank, skew) for rank in range(1, len(city_list) + 1)]
+
+
+def generate_user(questions, *, city_list=None, weights=None, now=None):
+    """Return one synthetic user dict answering `questions` (pass [] to skip answers)."""
+    now = now or datetime.now(timezone.utc)
+    uid = random_uuid()
     first = random.choice(first_names)
     last = random.choice(last_names)
     username = f"{first.lower()}.{last.lower()}{random.randint(1,9999)}"
@@ -182,7 +217,7 @@ for i in range(NUM_USERS):
     # gender uses single-letter codes to match Django choices
     gender = random.choices(genders, weights=[0.45,0.45,0.1])[0]
     pref = random.choices(preference_options, weights=[0.45,0.45,0.05,0.05])[0]
-    city = random.choices(cities, weights=[1.2,1.5,0.7,0.8,0.6,0.9,0.5,1.1,0.4,0.4])[0]
+    city = random.choices(city_list or cities, weights=weights or CITY_WEIGHTS)[0]
     lat, lon = jitter(city["lat"], city["lon"], km=random.uniform(0.5,12.0))
     is_verified = random.random() < 0.25
     is_banned = random.random() < 0.01
@@ -251,58 +286,147 @@ for i in range(NUM_USERS):
         "answers": answers,
         "photos": photos,
         # use timezone-aware timestamps to align with Django timezone usage
-        "created_at": (datetime.now(timezone.utc) - timedelta(days=random.randint(0,1000))).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat(),
-        "last_login": (datetime.now(timezone.utc) - timedelta(minutes=random.randint(0,60*24))).isoformat(),
+        "created_at": (now - timedelta(days=random.randint(0,1000))).isoformat(),
+        "updated_at": now.isoformat(),
+        "last_login": (now - timedelta(minutes=random.randint(0,60*24))).isoformat(),
         "language": random.choice(["en","es","fr","de","pt","it"]),
         "timezone": random.choice(["America/Los_Angeles","America/New_York","Europe/London","America/Chicago","America/Denver","America/Toronto"]) 
     }
-    users.append(user)
-
-# Add a few intentionally similar "test users" for algorithm debugging
-for t in [
-    {"username":"alice.sf","city":"San Francisco","age":28,"gender":"F","pref":"M"},
-    {"username":"bob.sf","city":"San Francisco","age":30,"gender":"M","pref":"F"},
-    {"username":"carol.ny","city":"New York","age":27,"gender":"F","pref":"M"}
-]:
-    uid = str(uuid.uuid4())
-    city = next((c for c in cities if c['city'] == t['city']), random.choice(cities))
-    lat, lon = jitter(city['lat'], city['lon'])
-    user = {
-        "uuid": uid,
-        "username": t['username'],
-        "display_name": t['username'].split('.')[0].capitalize(),
-        "email": f"{t['username']}@example.com",
-        "is_verified": True,
-        "is_banned": False,
-        "credits": 100,
-        "gender": t['gender'],
-        "preference_gender": t['pref'],
-        "age": t['age'],
-        "minage_preference": max(18, t['age']-3),
-        "maxage_preference": t['age']+3,
-        "identity_ref": f"idprov_{random.randint(100000,999999)}",
-        "city": city['city'],
-        "state": city['state'],
-        "region": city.get('state',''),
-        "country": city['country'],
-        "lat": round(lat,6),
-        "lon": round(lon,6),
-        "bio": "Test account for matching",
-        "interests": ["hiking","coffee","music"],
-        "answers": {"q1": True, "q2": 4},
-        "photos": [f"https://example.com/photos/{uid}/1.jpg"],
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat(),
-        "last_login": datetime.now(timezone.utc).isoformat(),
-        "language": "en",
-        "timezone": "America/Los_Angeles"
-    }
-    users.append(user)
+    return user
+
+def generate_test_users(now=None):
+    """Add a few intentionally similar "test users" for algorithm debugging."""
+    now = now or datetime.now(timezone.utc)
+    users = []
+    for t in [
+        {"username":"alice.sf","city":"San Francisco","age":28,"gender":"F","pref":"M"},
+        {"username":"bob.sf","city":"San Francisco","age":30,"gender":"M","pref":"F"},
+        {"username":"carol.ny","city":"New York","age":27,"gender":"F","pref":"M"}
+    ]:
+        uid = random_uuid()
+        city = next((c for c in cities if c['city'] == t['city']), random.choice(cities))
+        lat, lon = jitter(city['lat'], city['lon'])
+        user = {
+            "uuid": uid,
+            "username": t['username'],
+            "display_name": t['username'].split('.')[0].capitalize(),
+            "email": f"{t['username']}@example.com",
+            "is_verified": True,
+            "is_banned": False,
+            "credits": 100,
+            "gender": t['gender'],
+            "preference_gender": t['pref'],
+            "age": t['age'],
+            "minage_preference": max(18, t['age']-3),
+            "maxage_preference": t['age']+3,
+            "identity_ref": f"idprov_{random.randint(100000,999999)}",
+            "city": city['city'],
+            "state": city['state'],
+            "region": city.get('state',''),
+            "country": city['country'],
+            "lat": round(lat,6),
+            "lon": round(lon,6),
+            "bio": "Test account for matching",
+            "interests": ["hiking","coffee","music"],
+            "answers": {"q1": True, "q2": 4},
+            "photos": [f"https://example.com/photos/{uid}/1.jpg"],
+            "created_at": now.isoformat(),
+            "updated_at": now.isoformat(),
+            "last_login": now.isoformat(),
+            "language": "en",
+            "timezone": "America/Los_Angeles"
+        }
+        users.append(user)
+    return users
+
+
+def stream_users(num_users, questions=(), seed=None, *, city_skew=None, num_cities=None, now=None):
+    """Yield `num_users` synthetic users one at a time.
+
+    Args:
+        seed: seeds the module RNG; seeded runs also default `now` to
+            REFERENCE_TIME, so the same arguments give byte-identical users.
+        city_skew: None keeps the default city weights; a number uses
+            1/rank**city_skew over the cities (0 = uniform, larger = more skewed).
+        num_cities: add synthetic satellite cities up to this many locations.
+        now: reference time for created_at/updated_at/last_login.
+    """
+    if seed is not None:
+        random.seed(seed)
+        now = now or REFERENCE_TIME
+    city_list = make_cities(num_cities)
+    weights = city_weights(city_list, city_skew)
+    for _ in range(num_users):
+        yield generate_user(questions, city_list=city_list, weights=weights, now=now)
+
+
+def generate_users(num_users, questions=(), seed=None, **options):
+    """Return `num_users` synthetic users as a list (see `stream_users` for the options)."""
+    return list(stream_users(num_users, questions, seed, **options))
+
+
+def write_users(users, path, fmt="json"):
+    """Stream `users` to `path` as a JSON array or NDJSON, atomically; returns the count written."""
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8", dir=str(p.parent)) as f:
+        if fmt == "ndjson":
+            for user in users:
+                f.write(json.dumps(user, ensure_ascii=False))
+                f.write("\n")
+                count += 1
+        else:
+            f.write("[")
+            for user in users:
+                f.write(",\n" if count else "\n")
+                f.write(json.dumps(user, indent=2, ensure_ascii=False))
+                count += 1
+            f.write("\n]" if count else "]")
+        tmp = Path(f.name)
+    tmp.replace(p)
+    return count
+
+
+def _chain(first, then):
+    yield from first
+    yield from then()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic users and questions.")
+    parser.add_argument("--users", type=int, default=NUM_USERS, help="number of users (default %(default)s)")
+    parser.add_argument("--questions", type=int, default=NUM_QUESTIONS, help="number of questions (0 skips answers)")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--format", choices=("json", "ndjson"), default="json")
+    parser.add_argument("--out", help="users file (default data/users.json or data/users.ndjson)")
+    parser.add_argument("--questions-out", default=OUTPUT_QUESTIONS)
+    parser.add_argument("--city-skew", type=float, default=None, help="Zipf exponent for city popularity")
+    parser.add_argument("--cities", type=int, default=None, help="total number of cities, incl. synthetic ones")
+    parser.add_argument("--no-test-users", action="store_true", help="skip the hand-written test users")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    questions = build_questions(args.questions) if args.questions > 0 else []
+
+    # Save questions
+    with open(args.questions_out, "w", encoding="utf-8") as f:
+        json.dump(questions, f, indent=2, ensure_ascii=False)
+
+    out = args.out or (OUTPUT_USERS if args.format == "json" else str(Path(OUTPUT_USERS).with_suffix(".ndjson")))
+    users = stream_users(args.users, questions, None, city_skew=args.city_skew, num_cities=args.cities, now=REFERENCE_TIME)
+    if not args.no_test_users:
+        users = _chain(users, lambda: generate_test_users(REFERENCE_TIME))
+
+    # Save users
+    count = write_users(users, out, args.format)
+
+    print(f"Wrote {count} users to {out}")
+    print(f"Wrote {len(questions)} questions to {args.questions_out}")
 
-# Save users
-with open(OUTPUT_USERS, "w", encoding="utf-8") as f:
-    json.dump(users, f, indent=2, ensure_ascii=False)
 
-print(f"Wrote {len(users)} users to {OUTPUT_USERS}")
-print(f"Wrote {len(questions)} questions to {OUTPUT_QUESTIONS}")
+if __name__ == "__main__":
+    main()
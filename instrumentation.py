@@ -0,0 +1,253 @@
+"""
+Lightweight timers, counters and optional profiling for the hot paths.
+
+Functions decorated with `instrument(...)` (parse_json_file, filter_by_location,
+is_profile_valid, atomic_write_json, ...) record call counts, wall time and
+per-call counters such as users in/out, buckets and bytes written. When
+metrics are disabled the wrapper is a single attribute check before calling
+through.
+
+Enable with the environment variable
+
+    MATCHMAKING_METRICS=1                  timers and counters
+    MATCHMAKING_METRICS=1,profile,memory   plus cProfile and tracemalloc capture
+    MATCHMAKING_METRICS_FILE=metrics.prom  export at exit (.prom/.txt: Prometheus
+                                           text format, anything else: JSON)
+
+or from code with `METRICS.enable(...)`, then `METRICS.export(path)`.
+"""
+import atexit
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+ENV_VAR = 'MATCHMAKING_METRICS'
+ENV_FILE = 'MATCHMAKING_METRICS_FILE'
+PREFIX = 'matchmaking'
+# recent durations kept per timer for percentiles
+SAMPLES = 1024
+
+
+def percentile(samples: Iterable[float], pct: float, *, interpolate: bool = False) -> Optional[float]:
+    """`pct`-th percentile of `samples` (nearest rank, or linear interpolation); None when empty."""
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    pos = (len(ordered) - 1) * min(100.0, max(0.0, pct)) / 100.0
+    if not interpolate:
+        return ordered[int(round(pos))]
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+class TimerStats:
+    __slots__ = ('count', 'total', 'max', 'peak_bytes', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.peak_bytes = 0
+        self.samples: deque = deque(maxlen=SAMPLES)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> float:
+        value = percentile(self.samples, pct)
+        return 0.0 if value is None else value
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'count': self.count, 'seconds_total': self.total, 'seconds_max': self.max,
+                'p50': self.percentile(50), 'p99': self.percentile(99), 'peak_bytes': self.peak_bytes}
+
+
+class Metrics:
+    """Registry of timers and counters; see the module docstring."""
+
+    def __init__(self):
+        self.enabled = False
+        self.profile = False
+        self.memory = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.timers: Dict[str, TimerStats] = {}
+        # (counter name, function name) -> value
+        self.counters: Dict[Tuple[str, str], float] = {}
+        self._profiler: Optional[cProfile.Profile] = None
+
+    def enable(self, *, profile: bool = False, memory: bool = False) -> None:
+        self.enabled = True
+        self.profile = profile
+        self.memory = memory
+        if profile and self._profiler is None:
+            self._profiler = cProfile.Profile()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.profile = self.memory = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+            self._profiler = cProfile.Profile() if self.profile else None
+
+    def observe(self, name: str, seconds: float, peak_bytes: int = 0) -> None:
+        with self._lock:
+            stats = self.timers.get(name)
+            if stats is None:
+                stats = self.timers[name] = TimerStats()
+            stats.observe(seconds)
+            if peak_bytes > stats.peak_bytes:
+                stats.peak_bytes = peak_bytes
+
+    def count(self, counter: str, value: float = 1, fn: str = '') -> None:
+        if not self.enabled:
+            return
+        key = (counter, fn)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def call(self, name: str, func: Callable, args: tuple, kwargs: dict,
+             count: Optional[Callable[..., Dict[str, float]]] = None) -> Any:
+        """Run `func` under the timer `name` (and the profiler, for the outermost call)."""
+        local = self._local
+        depth = getattr(local, 'depth', 0)
+        profiler = self._profiler if self.profile and depth == 0 else None
+        if self.memory and depth == 0:
+            tracemalloc.reset_peak()
+        local.depth = depth + 1
+        t0 = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            elapsed = time.perf_counter() - t0
+            local.depth = depth
+        peak = tracemalloc.get_traced_memory()[1] if self.memory and tracemalloc.is_tracing() else 0
+        self.observe(name, elapsed, peak)
+        if count is not None:
+            for counter, value in count(result, *args, **kwargs).items():
+                self.count(counter, value, name)
+        return result
+
+    # export
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters: Dict[str, Dict[str, float]] = {}
+            for (counter, fn), value in self.counters.items():
+                counters.setdefault(counter, {})[fn or '_'] = value
+            return {'timers': {name: stats.as_dict() for name, stats in self.timers.items()}, 'counters': counters}
+
+    def to_prometheus(self) -> str:
+        snap = self.snapshot()
+        timers = snap['timers']
+        lines = []
+
+        def family(metric: str, kind: str, samples) -> None:
+            samples = list(samples)
+            if samples:
+                lines.append(f"# TYPE {PREFIX}_{metric} {kind}")
+                lines.extend(f"{PREFIX}_{metric}{labels} {value}" for labels, value in samples)
+
+        family('calls_total', 'counter', ((f'{{fn="{n}"}}', t['count']) for n, t in timers.items()))
+        family('call_seconds', 'summary', [(f'{{fn="{n}",quantile="{q}"}}', f"{t[key]:.9f}")
+                                           for n, t in timers.items() for q, key in ((0.5, 'p50'), (0.99, 'p99'))]
+               + [(f'_sum{{fn="{n}"}}', f"{t['seconds_total']:.9f}") for n, t in timers.items()]
+               + [(f'_count{{fn="{n}"}}', t['count']) for n, t in timers.items()])
+        family('call_seconds_max', 'gauge', ((f'{{fn="{n}"}}', f"{t['seconds_max']:.9f}") for n, t in timers.items()))
+        family('call_peak_bytes', 'gauge', ((f'{{fn="{n}"}}', t['peak_bytes']) for n, t in timers.items() if t['peak_bytes']))
+        for counter, per_fn in snap['counters'].items():
+            family(f'{counter}_total', 'counter', ((f'{{fn="{fn}"}}', f"{value:g}") for fn, value in per_fn.items()))
+        return '\n'.join(lines) + '\n'
+
+    def profile_text(self, limit: int = 30) -> str:
+        """Top functions by cumulative time from the cProfile capture ('' when not profiling)."""
+        if self._profiler is None:
+            return ''
+        out = io.StringIO()
+        try:
+            pstats.Stats(self._profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+        except TypeError:
+            # nothing was captured yet
+            return ''
+        return out.getvalue()
+
+    def export(self, path: str | Path) -> None:
+        """Write metrics to `path`: Prometheus text for .prom/.txt, JSON otherwise.
+
+        With profiling on, the cProfile stats are also dumped next to it (`<path>.pstats`).
+        """
+        p = Path(path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        if p.suffix in ('.prom', '.txt'):
+            p.write_text(self.to_prometheus(), encoding='utf-8')
+        else:
+            p.write_text(json.dumps(self.snapshot(), indent=2), encoding='utf-8')
+        if self._profiler is not None and self.profile_text():
+            self._profiler.dump_stats(str(p) + '.pstats')
+
+
+METRICS = Metrics()
+
+
+def grouping_counts(groups: Any, users: Any = None) -> Dict[str, float]:
+    """Counters for a location grouping result: buckets, users listed and (if sized) users in."""
+    counts: Dict[str, float] = {}
+    if isinstance(groups, list):
+        counts['buckets'] = len(groups)
+        counts['users_out'] = sum(len(entry.get('users') or ()) for entry in groups if isinstance(entry, dict))
+    if hasattr(users, '__len__'):
+        counts['users_in'] = len(users)
+    return counts
+
+
+def instrument(name: Optional[str] = None, *, count: Optional[Callable[..., Dict[str, float]]] = None):
+    """Decorator timing a function (and recording `count(result, *args, **kwargs)` counters) when metrics are on."""
+    def decorate(func: Callable) -> Callable:
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return func(*args, **kwargs)
+            return METRICS.call(label, func, args, kwargs, count)
+        return wrapper
+    return decorate
+
+
+def _configure_from_env() -> None:
+    value = os.environ.get(ENV_VAR, '').strip().lower()
+    if value in ('', '0', 'off', 'false', 'no'):
+        return
+    options = {part.strip() for part in value.split(',')}
+    METRICS.enable(profile='profile' in options, memory='memory' in options)
+    target = os.environ.get(ENV_FILE)
+    if target:
+        atexit.register(METRICS.export, target)
+
+
+_configure_from_env()
@@ -2,9 +2,28 @@
 import json
 from pathlib import Path
 import tempfile
-from typing import Any, Optional
+from typing import Any, Dict, Iterable, Iterator, Optional
 
+from instrumentation import instrument
 
+# Fields `filter_by_location` needs; pass as `fields=` to skip everything else
+LOCATION_FIELDS = ('uuid', 'city', 'country', 'state', 'region', 'county')
+
+_CHUNK_SIZE = 1 << 16
+_WHITESPACE = ' \t\n\r'
+# characters that can follow a complete array element
+_ELEMENT_END = _WHITESPACE + ',]'
+
+
+def _count_parsed(result: Any, *args, **kwargs) -> Dict[str, int]:
+    return {'users_out': len(result)} if isinstance(result, list) else {}
+
+
+def _count_written(result: Any, obj: Any, path: str | Path, **kwargs) -> Dict[str, int]:
+    return {'bytes_written': Path(path).stat().st_size}
+
+
+@instrument(count=_count_parsed)
 def parse_json_file(file_path: str) -> Optional[Any]:
     """Read JSON from a path and return the parsed object.
 
@@ -22,6 +41,109 @@ def parse_json_file(file_path: str) -> Optional[Any]:
         return None
 
 
+def _project(obj: Any, fields: Optional[Iterable[str]]) -> Any:
+    if fields is None or not isinstance(obj, dict):
+        return obj
+    return {k: obj[k] for k in fields if k in obj}
+
+
+def iter_json_array(file_path: str, fields: Optional[Iterable[str]] = None, *, chunk_size: int = _CHUNK_SIZE) -> Iterator[Any]:
+    """Yield the elements of a top-level JSON array one at a time.
+
+    The file is read in chunks and each element is decoded as soon as it is
+    complete, so only one element (plus a read buffer) is held in memory. If
+    `fields` is given, dict elements are projected down to those keys before
+    being yielded.
+
+    Unlike `parse_json_file`, errors are raised, not printed: a missing file
+    raises FileNotFoundError and malformed JSON raises json.JSONDecodeError,
+    even after some elements were yielded, so a truncated or corrupt file is
+    never mistaken for a complete one.
+    """
+    fields = tuple(fields) if fields is not None else None
+    decoder = json.JSONDecoder()
+    p = Path(file_path)
+    with p.open("r", encoding="utf-8") as f:
+        buf = f.read(chunk_size)
+        eof = not buf
+        pos = 0
+
+        def skip_ws() -> bool:
+            # advance `pos` past whitespace, reading more as needed; False at EOF
+            nonlocal buf, pos, eof
+            while True:
+                while pos < len(buf) and buf[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buf):
+                    return True
+                if eof:
+                    return False
+                buf = f.read(chunk_size)
+                pos = 0
+                eof = not buf
+
+        if not skip_ws() or buf[pos] != '[':
+            raise json.JSONDecodeError("Expected a JSON array", buf, pos)
+        pos += 1
+        first = True
+        while True:
+            if not skip_ws():
+                raise json.JSONDecodeError("Unterminated JSON array", buf, pos)
+            if buf[pos] == ']':
+                return
+            if not first:
+                if buf[pos] != ',':
+                    raise json.JSONDecodeError("Expected ',' between array elements", buf, pos)
+                pos += 1
+                if not skip_ws():
+                    raise json.JSONDecodeError("Unterminated JSON array", buf, pos)
+            first = False
+            scalar = buf[pos] not in '{["'
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                    # strings and containers end at their closing character; a number or
+                    # literal is only complete once a delimiter follows it ("2e10" cut
+                    # after "2" or "2e" would otherwise decode as 2)
+                    if eof or not scalar or (end < len(buf) and buf[end] in _ELEMENT_END):
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                # grow geometrically so a large element isn't re-decoded once per chunk
+                more = f.read(max(chunk_size, len(buf) - pos))
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+            yield _project(obj, fields)
+            pos = end
+            # drop consumed text so the buffer stays around one chunk
+            if pos >= chunk_size:
+                buf = buf[pos:]
+                pos = 0
+
+
+def iter_ndjson(file_path: str, fields: Optional[Iterable[str]] = None) -> Iterator[Any]:
+    """Yield one parsed object per non-blank line of a newline-delimited JSON file.
+
+    Projection and error handling match `iter_json_array`.
+    """
+    fields = tuple(fields) if fields is not None else None
+    p = Path(file_path)
+    with p.open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield _project(json.loads(line), fields)
+
+
+def iter_users(file_path: str, fields: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+    """Stream users from `file_path`, picking the reader by extension (.ndjson/.jsonl or JSON array)."""
+    if Path(file_path).suffix in ('.ndjson', '.jsonl'):
+        return iter_ndjson(file_path, fields)
+    return iter_json_array(file_path, fields)
+
+
+@instrument(count=_count_written)
 def atomic_write_json(obj: Any, path: str | Path, *, indent: int = 2, sort_keys: bool = False) -> None:
     """Write JSON to `path` atomically (write temp file then replace).
 
@@ -7,15 +7,39 @@
 
 from filter.location import filter_by_location
 from filter.is_profile_valid import is_profile_valid
-from json_parser import parse_json_file
+from filter.pipeline import Pipeline
+from snapshot import load_users
 
-users = parse_json_file('data/users.json')
+USERS_FILE = 'data/users.json'
+
+
+def get_users():
+    """The parsed users of USERS_FILE, loaded (from the warm-start snapshot when fresh) on first use."""
+    users = globals().get('users')
+    if users is None:
+        users = globals()['users'] = load_users(USERS_FILE)
+    return users
+
+
+def __getattr__(name):
+    # `main.users` keeps working for importers, but nothing is parsed at import time
+    if name == 'users':
+        return get_users()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if(__name__ == "__main__"):
-    by_location = filter_by_location(users)
-   
+    users = get_users()
+    # One pass over the users: validity -> location -> gender -> age. The
+    # location index built along the way is shared by both writers below.
+    pipeline = Pipeline()
+    buckets = pipeline.run(users)
+    index = pipeline.context.index
+
+    by_location = filter_by_location(users, index=index)
+    is_valid = is_profile_valid(None, users, index=index)
 
-    is_valid = is_profile_valid(by_location, users)
-    print(f"Is profile valid? {is_valid}")
-    print("This is the main module.")
\ No newline at end of file
+    print(pipeline.report())
+    print(f"{len(by_location)} locations, {len(is_valid)} with valid profiles, "
+          f"{sum(len(b.users) for b in buckets)} users remaining after pruning")
+    print("This is the main module.")
@@ -0,0 +1,434 @@
+"""
+Micro-batched match request processor.
+
+Match queries are JSON objects, one per line:
+
+    {"id": "q1", "uuid": "<user uuid>", "k": 10, "radius_km": 25,
+     "filters": {"gender": true, "age": true, "min_score": 0.1}}
+
+Only `uuid` is required; `id` is echoed back (defaults to the uuid), `k`
+defaults to 10, and without `radius_km` the whole location bucket is
+searched. `filters` toggles the gender and age checks (both on by default)
+and sets a minimum interest score. Every response is one JSON line:
+
+    {"id": "q1", "uuid": "...", "matches": [["<uuid>", 0.42], ...]}
+
+or the same with an "error" message instead of matches.
+
+Queries that arrive close together are coalesced into a micro-batch (up to
+`max_batch` queries or `max_delay` seconds). Within a batch, the queries are
+grouped by the location bucket of their user, and each bucket is prepared
+once: valid members, interest masks, gender and age indexes and, if any query
+asks for a radius, a grid index. The queries are then answered against that
+shared state.
+
+Queries can come from a JSONL file (or stdin) or from a local asyncio TCP
+endpoint that streams responses back as they complete. Replay mode starts a
+local server, sends a recorded request file over one connection and reports
+throughput and p50/p95/p99 latency.
+
+Run from the repo root with:
+    python match_server.py make-requests requests_match.jsonl [--count 10000]
+    python match_server.py jsonl requests_match.jsonl [--out responses.jsonl]
+    python match_server.py serve [--port 8765]
+    python match_server.py replay requests_match.jsonl [--rate 5000]
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from filter.candidates import CandidatePool
+from filter.is_profile_valid import is_user_valid
+from filter.location_index import LocationIndex, LocationKey
+from filter.proximity import GridIndex
+from instrumentation import percentile
+from snapshot import load_users
+
+DEFAULT_K = 10
+MAX_BATCH = 256
+MAX_DELAY = 0.002
+# grid cell size for radius queries; generated users sit within a city's few km
+GRID_CELL_KM = 5.0
+
+
+def _number(value: Any, name: str) -> float:
+    """`value` as a finite, non-negative number; ValueError (a "bad query") otherwise."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{name} must be a number")
+    try:
+        finite = math.isfinite(value)
+    except OverflowError:
+        # an int too large for a float
+        finite = False
+    if not finite:
+        raise ValueError(f"{name} must be finite")
+    if value < 0:
+        raise ValueError(f"{name} must not be negative")
+    return value
+
+
+class _BucketState:
+    """Per-batch state of one location bucket, shared by the batch's queries on it."""
+
+    __slots__ = ('pool', '_grid')
+
+    def __init__(self, members: List[Dict[str, Any]]):
+        self.pool = CandidatePool(members)
+        self._grid: Optional[GridIndex] = None
+
+    @property
+    def grid(self) -> GridIndex:
+        if self._grid is None:
+            self._grid = GridIndex(self.pool.users, cell_km=GRID_CELL_KM)
+        return self._grid
+
+
+class MatchProcessor:
+    """Answers batches of match queries against a fixed user population."""
+
+    def __init__(self, users: Iterable[Dict[str, Any]]):
+        self.index = LocationIndex(users)
+        self.batches = 0
+        self.queries = 0
+
+    def _answer(self, query: Dict[str, Any], state: _BucketState) -> Dict[str, Any]:
+        uid = query['uuid']
+        user = state.pool.by_id.get(uid)
+        response: Dict[str, Any] = {'id': query.get('id', uid), 'uuid': uid}
+        if user is None:
+            response['matches'] = []
+            return response
+        filters = query.get('filters')
+        if filters is None:
+            filters = {}
+        elif not isinstance(filters, dict):
+            raise ValueError("filters must be a JSON object")
+        k = int(_number(query.get('k', DEFAULT_K), 'k'))
+        min_score = float(_number(filters.get('min_score', 0.0), 'min_score'))
+        radius = query.get('radius_km')
+        nearby = None
+        if radius is not None:
+            radius = float(_number(radius, 'radius_km'))
+            lat, lon = user.get('lat'), user.get('lon')
+            nearby = set() if lat is None or lon is None else \
+                {other for other, _ in state.grid.radius(float(lat), float(lon), radius, exclude=uid)}
+        best = state.pool.top_k(uid, k, age=bool(filters.get('age', True)), gender=bool(filters.get('gender', True)),
+                                min_score=min_score, within=nearby)
+        response['matches'] = [[other, round(score, 6)] for other, score in best]
+        return response
+
+    def process_batch(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Responses for `queries`, in the same order; each location bucket is prepared once per batch."""
+        self.batches += 1
+        self.queries += len(queries)
+        by_bucket: Dict[LocationKey, List[int]] = {}
+        responses: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+        for i, query in enumerate(queries):
+            uid = query.get('uuid')
+            try:
+                loc = self.index.location_of(uid) if uid is not None else None
+            except TypeError:
+                # unhashable uuid value
+                loc = None
+            if uid is None:
+                responses[i] = {'id': query.get('id'), 'error': query.get('error', "query needs a uuid")}
+            elif loc is None:
+                responses[i] = {'id': query.get('id', uid), 'uuid': uid, 'error': "unknown user"}
+            elif not loc:
+                responses[i] = {'id': query.get('id', uid), 'uuid': uid, 'matches': []}
+            else:
+                by_bucket.setdefault(loc, []).append(i)
+        for loc, positions in by_bucket.items():
+            state = _BucketState(self.index.members(loc))
+            for i in positions:
+                # one bad query must not fail the rest of the batch
+                try:
+                    responses[i] = self._answer(queries[i], state)
+                except (TypeError, ValueError) as e:
+                    responses[i] = _error_response(queries[i], f"bad query: {e}")
+                except Exception as e:
+                    responses[i] = _error_response(queries[i], f"internal error: {e!r}")
+        return responses
+
+
+def _error_response(query: Dict[str, Any], message: str) -> Dict[str, Any]:
+    uid = query.get('uuid')
+    response = {'id': query.get('id', uid), 'uuid': uid, 'error': message}
+    if uid is None:
+        del response['uuid']
+    return response
+
+
+def _parse_line(line: str) -> Dict[str, Any]:
+    try:
+        query = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {'error': f"invalid JSON: {e.msg}"}
+    return query if isinstance(query, dict) else {'error': "query must be a JSON object"}
+
+
+class MicroBatcher:
+    """Coalesces concurrently submitted queries into batches for a `MatchProcessor`.
+
+    `submit` returns a future for the query's response. A batch is processed
+    once `max_batch` queries are waiting or `max_delay` seconds after its first
+    query arrived, whichever comes first.
+    """
+
+    def __init__(self, processor: MatchProcessor, *, max_batch: int = MAX_BATCH, max_delay: float = MAX_DELAY):
+        self.processor = processor
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.batch_sizes: List[int] = []
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._flush()
+
+    def submit(self, query: Dict[str, Any]) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((query, future))
+        if len(self._pending) >= self.max_batch or len(self._pending) == 1:
+            self._full.set()
+        return future
+
+    def _flush(self) -> None:
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if not batch:
+            return
+        self.batch_sizes.append(len(batch))
+        queries = [q for q, _ in batch]
+        try:
+            responses = self.processor.process_batch(queries)
+        except Exception as e:
+            # only this batch fails; its callers get an error response and the batcher keeps running
+            responses = [_error_response(q, f"internal error: {e!r}") for q in queries]
+        for (_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
+
+    async def _run(self) -> None:
+        while True:
+            await self._full.wait()
+            self._full.clear()
+            if len(self._pending) < self.max_batch:
+                # give concurrent queries a moment to join the batch
+                await asyncio.sleep(self.max_delay)
+            self._flush()
+            if self._pending:
+                self._full.set()
+
+
+def process_jsonl(processor: MatchProcessor, lines: Iterable[str], out: IO[str], *, max_batch: int = MAX_BATCH) -> int:
+    """Answer JSONL queries in batches of `max_batch`, writing each batch's responses as it completes."""
+    count = 0
+    batch: List[Dict[str, Any]] = []
+
+    def flush():
+        for response in processor.process_batch(batch):
+            out.write(json.dumps(response) + '\n')
+        out.flush()
+        batch.clear()
+
+    for line in lines:
+        if not line.strip():
+            continue
+        batch.append(_parse_line(line))
+        count += 1
+        if len(batch) >= max_batch:
+            flush()
+    if batch:
+        flush()
+    return count
+
+
+async def _handle(batcher: MicroBatcher, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    lock = asyncio.Lock()
+    inflight = set()
+
+    async def reply(future: asyncio.Future) -> None:
+        response = await future
+        async with lock:
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+            await writer.drain()
+
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.ensure_future(reply(batcher.submit(_parse_line(line.decode('utf-8')))))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        if inflight:
+            await asyncio.gather(*inflight)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(processor: MatchProcessor, host: str = '127.0.0.1', port: int = 0, **options) -> Tuple[asyncio.AbstractServer, MicroBatcher]:
+    """Serve JSONL queries over TCP; responses stream back in completion order (match them by `id`)."""
+    batcher = MicroBatcher(processor, **options)
+    batcher.start()
+    server = await asyncio.start_server(lambda r, w: _handle(batcher, r, w), host, port)
+    return server, batcher
+
+
+async def replay(processor: MatchProcessor, queries: List[str], *, rate: Optional[float] = None, **options) -> Dict[str, Any]:
+    """Send recorded query lines to a local server over one connection and time every response."""
+    server, batcher = await start_server(processor, **options)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    sent: Dict[Any, float] = {}
+    latencies: List[float] = []
+    errors = 0
+
+    async def receive():
+        nonlocal errors
+        for _ in range(len(queries)):
+            line = await reader.readline()
+            if not line:
+                break
+            response = json.loads(line)
+            latencies.append(time.perf_counter() - sent.pop(response.get('id'), time.perf_counter()))
+            if 'error' in response:
+                errors += 1
+
+    receiver = asyncio.ensure_future(receive())
+    t0 = time.perf_counter()
+    for i, line in enumerate(queries):
+        query = _parse_line(line)
+        # ids must be unique to pair responses with requests
+        query['id'] = f"{query.get('id', '')}#{i}"
+        sent[query['id']] = time.perf_counter()
+        writer.write((json.dumps(query) + '\n').encode('utf-8'))
+        if rate is not None:
+            ahead = (i + 1) / rate - (time.perf_counter() - t0)
+            if ahead > 0:
+                await writer.drain()
+                await asyncio.sleep(ahead)
+        elif i % 256 == 255:
+            await writer.drain()
+    await writer.drain()
+    await receiver
+    elapsed = time.perf_counter() - t0
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    await batcher.stop()
+    sizes = batcher.batch_sizes
+    return {
+        'queries': len(queries),
+        'responses': len(latencies),
+        'errors': errors,
+        'seconds': elapsed,
+        'throughput_per_s': len(latencies) / elapsed if elapsed else None,
+        'batches': len(sizes),
+        'mean_batch': sum(sizes) / len(sizes) if sizes else 0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def make_requests(users: List[Dict[str, Any]], count: int, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """Sample queries for valid users, some with a radius, some with filters."""
+    rng = random.Random(seed)
+    valid = [u for u in users if is_user_valid(u) and u.get('uuid')] or users
+    for i in range(count):
+        query: Dict[str, Any] = {'id': f"q{i}", 'uuid': rng.choice(valid)['uuid'], 'k': rng.choice((5, 10, 20))}
+        if rng.random() < 0.3:
+            query['radius_km'] = rng.choice((5, 10, 25))
+        if rng.random() < 0.2:
+            query['filters'] = {'min_score': 0.1}
+        yield query
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Answer match queries in micro-batches.")
+    parser.add_argument('--users', default='data/users.json', help="user file (JSON array or NDJSON)")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--max-delay', type=float, default=MAX_DELAY, help="seconds to wait for a batch to fill")
+    sub = parser.add_subparsers(dest='command', required=True)
+    make = sub.add_parser('make-requests', help="write sample queries for the user file")
+    make.add_argument('path')
+    make.add_argument('--count', type=int, default=10_000)
+    make.add_argument('--seed', type=int, default=0)
+    jsonl = sub.add_parser('jsonl', help="answer queries from a JSONL file ('-' for stdin)")
+    jsonl.add_argument('path')
+    jsonl.add_argument('--out', help="write responses here instead of stdout")
+    serve = sub.add_parser('serve', help="serve JSONL queries over TCP")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    rep = sub.add_parser('replay', help="replay a query file against a local server and report latency")
+    rep.add_argument('path')
+    rep.add_argument('--rate', type=float, help="queries per second (default: as fast as possible)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    users = load_users(args.users) or []
+    if args.command == 'make-requests':
+        with open(args.path, 'w', encoding='utf-8') as f:
+            for query in make_requests(users, args.count, args.seed):
+                f.write(json.dumps(query) + '\n')
+        print(f"wrote {args.count} queries to {args.path}")
+        return 0
+    processor = MatchProcessor(users)
+    options = {'max_batch': args.max_batch, 'max_delay': args.max_delay}
+    if args.command == 'jsonl':
+        source = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8')
+        out = open(args.out, 'w', encoding='utf-8') if args.out else sys.stdout
+        try:
+            process_jsonl(processor, source, out, max_batch=args.max_batch)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if out is not sys.stdout:
+                out.close()
+        return 0
+    if args.command == 'serve':
+        async def serve():
+            server, _ = await start_server(processor, args.host, args.port, **options)
+            print(f"serving {len(users)} users on {args.host}:{args.port}")
+            async with server:
+                await server.serve_forever()
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        return 0
+    with open(args.path, encoding='utf-8') as f:
+        queries = [line for line in f if line.strip()]
+    stats = asyncio.run(replay(processor, queries, rate=args.rate, **options))
+    print(f"{stats['responses']}/{stats['queries']} responses ({stats['errors']} errors) in {stats['seconds']:.2f}s, "
+          f"{stats['throughput_per_s']:,.0f}/s, {stats['batches']} batches (mean {stats['mean_batch']:.1f})")
+    print(f"latency p50={stats['p50'] * 1000:.2f}ms p95={stats['p95'] * 1000:.2f}ms p99={stats['p99'] * 1000:.2f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+On-demand top-k recommendations with a bounded cache.
+
+Only active users ask for matches, so instead of grouping everyone up front a
+`Recommender` computes one user's candidates when asked:
+ - users listed under the user's location (`LocationIndex.members`)
+ - valid profiles only (`is_user_valid`), mutual gender preference, mutual age range
+ - ranked by interest overlap (Jaccard over interest masks), best `k` kept
+The last two steps are `CandidatePool.top_k`, which match_server.py uses too.
+Results are cached per user in an LRU with a time-to-live. An entry is dropped
+early only when the user or one of the candidates it lists changes
+`updated_at`, gets banned or loses verification; each cached candidate keeps
+a reverse link to the entries listing it, so that costs one lookup per
+affected entry, not a scan of the cache. Users who become eligible (new
+sign-ups, moves, ...) show up in existing entries once they expire.
+
+`stats()` reports hit rate, invalidations and p50/p99 latencies of cache hits
+and misses, for sizing `maxsize` and `ttl`.
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Iterable, Optional, Set
+
+from filter.candidates import CandidatePool, Ranked
+from filter.interests import interest_mask
+from filter.is_profile_valid import is_user_valid
+from filter.location_index import LocationIndex, user_id
+from instrumentation import percentile
+
+DEFAULT_K = 10
+
+
+def _invalidates(old: Dict[str, Any], new: Dict[str, Any]) -> bool:
+    """True when replacing `old` by `new` makes results involving the user stale."""
+    return (old.get('updated_at') != new.get('updated_at')
+            or (bool(new.get('is_banned')) and not old.get('is_banned'))
+            or (bool(old.get('is_verified')) and not new.get('is_verified')))
+
+
+class _Entry:
+    __slots__ = ('ranked', 'expires_at')
+
+    def __init__(self, ranked: Ranked, expires_at: float):
+        self.ranked = ranked
+        self.expires_at = expires_at
+
+
+class Recommender:
+    """Lazily computed, cached top-k candidates per user; see the module docstring.
+
+    Args:
+        users: initial population (users without an id are ignored).
+        k: candidates returned per user.
+        maxsize: cached users at most; the least recently used is evicted first.
+        ttl: seconds an entry stays valid (None: until invalidated or evicted).
+        latency_samples: how many recent hit/miss latencies to keep.
+        clock: time source for the TTL (seconds).
+    """
+
+    def __init__(self, users: Iterable[Dict[str, Any]] = (), *, k: int = DEFAULT_K, maxsize: int = 10_000,
+                 ttl: Optional[float] = 300.0, latency_samples: int = 10_000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.k = k
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.index = LocationIndex()
+        self._masks: Dict[Any, int] = {}
+        self._cache: 'OrderedDict[Any, _Entry]' = OrderedDict()
+        # candidate id -> ids of cached entries listing it
+        self._listed_in: Dict[Any, Set[Any]] = {}
+        self._hit_latencies: Deque[float] = deque(maxlen=latency_samples)
+        self._miss_latencies: Deque[float] = deque(maxlen=latency_samples)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalidated = 0
+        for user in users:
+            self.update(user)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    # population
+
+    def update(self, user: Dict[str, Any]) -> int:
+        """Add or replace a user record; returns how many cache entries it invalidated."""
+        uid = user_id(user)
+        if uid is None:
+            return 0
+        old = self.index.get(uid)
+        self.index.add(user)
+        self._masks[uid] = interest_mask(user)
+        if old is None or not _invalidates(old, user):
+            return 0
+        return self._invalidate(uid)
+
+    def remove(self, uid: Any) -> int:
+        """Forget a user; entries for and listing it are invalidated. Returns how many."""
+        if self.index.remove(uid) is None:
+            return 0
+        self._masks.pop(uid, None)
+        return self._invalidate(uid)
+
+    def _invalidate(self, uid: Any) -> int:
+        dropped = 0
+        for owner in [uid, *self._listed_in.get(uid, ())]:
+            if self._drop(owner):
+                dropped += 1
+        self.invalidated += dropped
+        return dropped
+
+    def _drop(self, owner: Any) -> bool:
+        entry = self._cache.pop(owner, None)
+        if entry is None:
+            return False
+        for other, _ in entry.ranked:
+            listed = self._listed_in.get(other)
+            if listed is not None:
+                listed.discard(owner)
+                if not listed:
+                    del self._listed_in[other]
+        return True
+
+    # queries
+
+    def compute(self, uid: Any, k: Optional[int] = None) -> Ranked:
+        """Top-k (candidate id, score) pairs for `uid`, best first, bypassing the cache."""
+        user = self.index.get(uid)
+        if user is None or not is_user_valid(user):
+            return []
+        loc = self.index.location_of(uid)
+        if not loc:
+            return []
+        pool = CandidatePool(self.index.members(loc), self._masks, indexed=False)
+        return pool.top_k(uid, self.k if k is None else k)
+
+    def recommend(self, uid: Any) -> Ranked:
+        """Cached top-k candidates for `uid` (computed on a miss or after expiry)."""
+        t0 = time.perf_counter()
+        now = self.clock()
+        entry = self._cache.get(uid)
+        if entry is not None:
+            if entry.expires_at > now:
+                self._cache.move_to_end(uid)
+                self.hits += 1
+                self._hit_latencies.append(time.perf_counter() - t0)
+                return entry.ranked
+            self._drop(uid)
+            self.expired += 1
+        ranked = self.compute(uid)
+        if uid in self.index:
+            self._store(uid, ranked, now)
+        self.misses += 1
+        self._miss_latencies.append(time.perf_counter() - t0)
+        return ranked
+
+    def _store(self, uid: Any, ranked: Ranked, now: float) -> None:
+        while len(self._cache) >= self.maxsize > 0:
+            oldest = next(iter(self._cache))
+            self._drop(oldest)
+            self.evicted += 1
+        if self.maxsize <= 0:
+            return
+        expires_at = float('inf') if self.ttl is None else now + self.ttl
+        self._cache[uid] = _Entry(ranked, expires_at)
+        for other, _ in ranked:
+            self._listed_in.setdefault(other, set()).add(uid)
+
+    # metrics
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters, hit rate and p50/p99 latencies (seconds) of recent hits and misses."""
+        lookups = self.hits + self.misses
+        return {
+            'users': len(self.index),
+            'cached': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'invalidated': self.invalidated,
+            'hit_p50': percentile(self._hit_latencies, 50),
+            'hit_p99': percentile(self._hit_latencies, 99),
+            'miss_p50': percentile(self._miss_latencies, 50),
+            'miss_p99': percentile(self._miss_latencies, 99),
+        }
@@ -0,0 +1,284 @@
+"""
+History of pairs that have already been matched.
+
+`PairHistory` answers "have these two users been matched before?" regardless
+of argument order. Users are interned to 32-bit ids and a pair is packed into
+one 64-bit key. Keys live in two tiers:
+ - a small dict of recent inserts
+ - a large sorted `array('Q')` of older keys (with a parallel `array('I')` of
+   match times) searched with bisect, ~12 bytes per pair
+A Bloom filter in front of both answers most "never matched" lookups (the
+common case in the queue's hot path) without touching either tier.
+
+Pairs can be forgotten after `ttl` seconds, and the whole history can be
+snapshotted to a compact binary file and restored. The uid table is stored
+as a UTF-8 JSON array, so str and int ids come back with their types.
+"""
+import json
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_MAGIC = b'PHST'
+_VERSION = 2
+_HEADER = struct.Struct('<4sHBxdQQQQB7x')
+_MASK64 = (1 << 64) - 1
+
+
+def _mix64(x: int) -> int:
+    """splitmix64 finalizer; spreads pair keys evenly over the Bloom filter."""
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+class _Bloom:
+    __slots__ = ('bits', 'size', 'hashes')
+
+    def __init__(self, capacity: int, bits_per_item: int = 10, hashes: int = 7):
+        self.size = max(64, capacity * bits_per_item)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.hashes = hashes
+
+    def add(self, key: int) -> None:
+        h = _mix64(key)
+        pos, step, size, bits = h & 0xFFFFFFFF, (h >> 32) | 1, self.size, self.bits
+        for _ in range(self.hashes):
+            pos %= size
+            bits[pos >> 3] |= 1 << (pos & 7)
+            pos += step
+
+    def __contains__(self, key: int) -> bool:
+        h = _mix64(key)
+        pos, step, size, bits = h & 0xFFFFFFFF, (h >> 32) | 1, self.size, self.bits
+        for _ in range(self.hashes):
+            pos %= size
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+            pos += step
+        return True
+
+
+class PairHistory:
+    """Order-independent set of matched pairs with optional TTL; see the module docstring.
+
+    Args:
+        ttl: seconds after which a pair is forgotten (None keeps pairs forever).
+        capacity: expected number of pairs, used to size the Bloom filter; it is
+            rebuilt at twice the size whenever the history outgrows it.
+        merge_threshold: recent inserts kept in the dict before merging into
+            the sorted arrays.
+        clock: wall-clock time source in seconds.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, *, capacity: int = 1_000_000, merge_threshold: int = 100_000,
+                 clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.merge_threshold = merge_threshold
+        self._uids: List[Any] = []
+        self._ids: Dict[Any, int] = {}
+        self._keys = array('Q')
+        self._times = array('I')
+        self._recent: Dict[int, int] = {}
+        self._capacity = capacity
+        self._bloom = _Bloom(capacity)
+
+    def __len__(self) -> int:
+        return len(self._keys) + sum(1 for key in self._recent if not self._in_frozen(key))
+
+    def _intern(self, uid: Any) -> int:
+        idx = self._ids.get(uid)
+        if idx is None:
+            idx = self._ids[uid] = len(self._uids)
+            self._uids.append(uid)
+        return idx
+
+    def _key(self, a: Any, b: Any, *, create: bool) -> Optional[int]:
+        if create:
+            ia, ib = self._intern(a), self._intern(b)
+        else:
+            ia, ib = self._ids.get(a), self._ids.get(b)
+            if ia is None or ib is None:
+                return None
+        if ia > ib:
+            ia, ib = ib, ia
+        return (ia << 32) | ib
+
+    def _frozen_index(self, key: int) -> int:
+        i = bisect_left(self._keys, key)
+        return i if i < len(self._keys) and self._keys[i] == key else -1
+
+    def _in_frozen(self, key: int) -> bool:
+        return self._frozen_index(key) >= 0
+
+    def _matched_at(self, key: int) -> Optional[int]:
+        when = self._recent.get(key)
+        if when is not None:
+            return when
+        i = self._frozen_index(key)
+        return None if i < 0 else self._times[i]
+
+    def record(self, a: Any, b: Any, when: Optional[float] = None) -> None:
+        """Remember that `a` and `b` were matched (at `when`, default now)."""
+        if a == b:
+            return
+        key = self._key(a, b, create=True)
+        self._recent[key] = int(self.clock() if when is None else when)
+        self._bloom.add(key)
+        if len(self._recent) >= self.merge_threshold:
+            self.compact()
+
+    def have_matched(self, a: Any, b: Any, now: Optional[float] = None) -> bool:
+        """True if `a` and `b` were matched before (and the pair hasn't expired)."""
+        key = self._key(a, b, create=False)
+        if key is None or key not in self._bloom:
+            return False
+        when = self._matched_at(key)
+        if when is None:
+            return False
+        if self.ttl is not None:
+            now = self.clock() if now is None else now
+            return when + self.ttl > now
+        return True
+
+    def forget(self, a: Any, b: Any) -> bool:
+        """Drop one pair; returns False if it wasn't recorded."""
+        key = self._key(a, b, create=False)
+        if key is None:
+            return False
+        found = self._recent.pop(key, None) is not None
+        i = self._frozen_index(key)
+        if i >= 0:
+            del self._keys[i]
+            del self._times[i]
+            found = True
+        return found
+
+    def compact(self) -> None:
+        """Merge recent inserts into the sorted arrays.
+
+        Each recent key is placed with one bisect and the arrays are rebuilt from
+        slices, so the copying runs at C speed rather than pair by pair.
+        """
+        if not self._recent:
+            return
+        keys, times = self._keys, self._times
+        merged_keys = array('Q')
+        merged_times = array('I')
+        prev = 0
+        for key, when in sorted(self._recent.items()):
+            i = bisect_left(keys, key, prev)
+            merged_keys.extend(keys[prev:i])
+            merged_times.extend(times[prev:i])
+            merged_keys.append(key)
+            merged_times.append(when)
+            # a re-recorded pair replaces the older entry
+            prev = i + 1 if i < len(keys) and keys[i] == key else i
+        merged_keys.extend(keys[prev:])
+        merged_times.extend(times[prev:])
+        self._keys, self._times = merged_keys, merged_times
+        self._recent = {}
+        if len(merged_keys) > self._capacity:
+            while len(merged_keys) > self._capacity:
+                self._capacity *= 2
+            self._rebuild_bloom()
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Forget every pair older than `ttl`; returns how many were dropped.
+
+        This scans every stored pair, so run it periodically rather than per lookup
+        (`have_matched` already ignores expired pairs).
+        """
+        if self.ttl is None:
+            return 0
+        self.compact()
+        cutoff = (self.clock() if now is None else now) - self.ttl
+        keep = [i for i, when in enumerate(self._times) if when > cutoff]
+        dropped = len(self._keys) - len(keep)
+        if dropped:
+            keys, times = self._keys, self._times
+            self._keys = array('Q', (keys[i] for i in keep))
+            self._times = array('I', (times[i] for i in keep))
+            self._rebuild_bloom()
+        return dropped
+
+    def _rebuild_bloom(self) -> None:
+        self._bloom = _Bloom(self._capacity)
+        for key in self._keys:
+            self._bloom.add(key)
+        for key in self._recent:
+            self._bloom.add(key)
+
+    def memory_bytes(self) -> int:
+        """Approximate bytes used by the pair arrays, Bloom filter and recent dict."""
+        return (sys.getsizeof(self._keys) + sys.getsizeof(self._times) + sys.getsizeof(self._bloom.bits)
+                + sys.getsizeof(self._recent) + sys.getsizeof(self._ids) + sys.getsizeof(self._uids))
+
+    # persistence
+
+    def save(self, path: str | Path) -> None:
+        """Write a binary snapshot atomically (temp file then replace)."""
+        self.compact()
+        p = Path(path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        for uid in self._uids:
+            if not isinstance(uid, (str, int)):
+                raise ValueError(f"user ids must be str or int to be saved, got {type(uid).__name__}")
+        uid_blob = json.dumps(self._uids, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        keys, times = self._keys, self._times
+        if sys.byteorder != 'little':
+            keys, times = array('Q', keys), array('I', times)
+            keys.byteswap()
+            times.byteswap()
+        bloom = self._bloom
+        header = _HEADER.pack(_MAGIC, _VERSION, 1 if self.ttl is not None else 0, self.ttl or 0.0,
+                              len(self._uids), len(uid_blob), len(keys), bloom.size, bloom.hashes)
+        with tempfile.NamedTemporaryFile('wb', delete=False, dir=str(p.parent)) as tf:
+            tf.write(header)
+            tf.write(uid_blob)
+            keys.tofile(tf)
+            times.tofile(tf)
+            # the Bloom filter is saved too so restoring doesn't rehash every pair
+            tf.write(bloom.bits)
+            tmp = Path(tf.name)
+        tmp.replace(p)
+
+    @classmethod
+    def load(cls, path: str | Path, **kwargs) -> 'PairHistory':
+        """Restore a history written by `save`, with user ids of their original types."""
+        with Path(path).open('rb') as f:
+            magic, version, has_ttl, ttl, n_uids, blob_len, n_pairs, bloom_size, bloom_hashes = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"not a pair history snapshot: {path}")
+            blob = f.read(blob_len)
+            keys, times = array('Q'), array('I')
+            keys.fromfile(f, n_pairs)
+            times.fromfile(f, n_pairs)
+            bloom_bits = bytearray(f.read((bloom_size + 7) // 8))
+        if sys.byteorder != 'little':
+            keys.byteswap()
+            times.byteswap()
+        kwargs.setdefault('ttl', ttl if has_ttl else None)
+        kwargs.setdefault('capacity', max(1, bloom_size // 10))
+        history = cls(**kwargs)
+        history._uids = json.loads(blob.decode('utf-8'))
+        history._ids = {uid: i for i, uid in enumerate(history._uids)}
+        history._keys, history._times = keys, times
+        if history._bloom.size == bloom_size and history._bloom.hashes == bloom_hashes:
+            history._bloom.bits = bloom_bits
+        else:
+            history._rebuild_bloom()
+        return history
+
+    def pairs(self) -> List[Tuple[Any, Any]]:
+        """All remembered pairs as (uid, uid) tuples (mainly for debugging)."""
+        self.compact()
+        mask = 0xFFFFFFFF
+        return [(self._uids[key >> 32], self._uids[key & mask]) for key in self._keys]
@@ -0,0 +1,307 @@
+"""
+Asyncio matchmaking queue.
+
+Users enqueue with their profile and get back a future. A scheduler task pairs
+each arrival with the longest-waiting compatible user in the same location
+bucket (same canonical location, mutual gender preference, mutual age range)
+and resolves both futures with the partner's profile. Pairs already present in
+an optional `PairHistory` are never matched again, and new matches are recorded
+in it. Users who wait longer than `max_wait` get None. The queue holds at most `maxsize` users: `enqueue`
+waits for room, `enqueue_nowait` raises `QueueFull`. Cancelling a returned
+future gives its slot back right away. After `stop()`, enqueueing (including
+callers still waiting for room) raises `QueueClosed`.
+"""
+import asyncio
+import functools
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterator, Optional
+
+from filter.age import age_compatible
+from filter.gender import GenderCombo, combos_compatible, gender_combo
+from filter.location_index import location_id, user_id
+from instrumentation import percentile
+from room.have_matched import PairHistory
+
+
+class QueueFull(Exception):
+    """Raised by `MatchQueue.enqueue_nowait` when the queue is at capacity."""
+
+
+class QueueClosed(Exception):
+    """Raised when enqueueing on a stopped `MatchQueue`."""
+
+
+class _EntryFuture(asyncio.Future):
+    """Future handed to producers; cancelling it releases the entry's queue slot at once.
+
+    (Overriding `cancel` avoids a done-callback, and the extra loop callback it
+    costs, on every successfully matched entry.)
+    """
+
+    _on_cancel = None
+
+    def cancel(self, msg: Any = None) -> bool:
+        cancelled = super().cancel(msg)
+        if cancelled and self._on_cancel is not None:
+            self._on_cancel()
+        return cancelled
+
+
+class _Entry:
+    __slots__ = ('uid', 'user', 'bucket', 'combo', 'future', 'enqueued_at')
+
+    def __init__(self, uid: Any, user: Dict[str, Any], future: asyncio.Future, enqueued_at: float):
+        self.uid = uid
+        self.user = user
+        # shared integer id of the canonical location (None without one)
+        self.bucket: Optional[int] = location_id(user)
+        self.combo: GenderCombo = gender_combo(user)
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+
+class MatchQueue:
+    """Pairs queued users as they arrive; see the module docstring.
+
+    Args:
+        maxsize: maximum number of users waiting or pending at once.
+        max_wait: seconds a user may wait before their future resolves to None.
+        max_scan: waiting users inspected per (gender, preference) group when
+            looking for a partner, which bounds the cost of one arrival.
+        latency_samples: how many recent enqueue-to-match latencies to keep.
+        history: pairs to exclude; matches made by the queue are added to it.
+    """
+
+    def __init__(self, maxsize: int = 10_000, *, max_wait: float = 30.0, max_scan: int = 256, latency_samples: int = 10_000,
+                 history: Optional[PairHistory] = None):
+        self.maxsize = maxsize
+        self.history = history
+        self.max_wait = max_wait
+        self.max_scan = max_scan
+        self._pending: Deque[_Entry] = deque()
+        # all waiting entries in arrival order (oldest first) for expiry
+        self._waiting: 'OrderedDict[Any, _Entry]' = OrderedDict()
+        # bucket -> (gender, preference) -> uid -> entry, each in arrival order
+        self._buckets: Dict[Optional[int], Dict[GenderCombo, 'OrderedDict[Any, _Entry]']] = {}
+        self._latencies: Deque[float] = deque(maxlen=latency_samples)
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.matched = 0
+        self.timed_out = 0
+        self._stopped = False
+        # cancelled entries still sitting in `_pending` (they no longer hold a slot)
+        self._cancelled_pending = 0
+        # slots given back by cancellations since the scheduler last notified producers
+        self._released = 0
+
+    def __len__(self) -> int:
+        return len(self._pending) - self._cancelled_pending + len(self._waiting)
+
+    # lifecycle
+
+    def start(self) -> None:
+        self._stopped = False
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the scheduler, resolve everyone still queued with None and fail blocked `enqueue` calls."""
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for entry in list(self._pending) + list(self._waiting.values()):
+            if not entry.future.done():
+                entry.future.set_result(None)
+        self._pending.clear()
+        self._waiting.clear()
+        self._buckets.clear()
+        self._cancelled_pending = 0
+        self._released = 0
+        async with self._space:
+            self._space.notify_all()
+
+    async def __aenter__(self) -> 'MatchQueue':
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    # producers
+
+    def enqueue_nowait(self, user: Dict[str, Any]) -> asyncio.Future:
+        """Queue `user` and return a future for its partner (None on timeout)."""
+        if self._stopped:
+            raise QueueClosed("match queue is stopped")
+        if len(self) >= self.maxsize:
+            raise QueueFull(f"match queue is full ({self.maxsize} users)")
+        uid = user_id(user)
+        if uid is None:
+            raise ValueError("user needs a uuid, id or username")
+        loop = asyncio.get_running_loop()
+        future = _EntryFuture(loop=loop)
+        entry = _Entry(uid, user, future, loop.time())
+        future._on_cancel = functools.partial(self._on_cancel, entry)
+        self._pending.append(entry)
+        self.enqueued += 1
+        self._wakeup.set()
+        return entry.future
+
+    async def enqueue(self, user: Dict[str, Any]) -> asyncio.Future:
+        """Like `enqueue_nowait`, but waits for room instead of raising."""
+        async with self._space:
+            await self._space.wait_for(lambda: self._stopped or len(self) < self.maxsize)
+            return self.enqueue_nowait(user)
+
+    async def match(self, user: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Enqueue `user` and wait for its partner."""
+        return await (await self.enqueue(user))
+
+    # scheduler
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            timeout = None
+            if self._waiting:
+                oldest = next(iter(self._waiting.values()))
+                timeout = max(0.0, oldest.enqueued_at + self.max_wait - loop.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            freed = self._drain(loop.time())
+            freed += self._expire(loop.time())
+            freed += self._released
+            self._released = 0
+            if freed:
+                async with self._space:
+                    self._space.notify(freed)
+            # let producers run between batches
+            await asyncio.sleep(0)
+
+    def _drain(self, now: float) -> int:
+        freed = 0
+        while self._pending:
+            entry = self._pending.popleft()
+            if entry.future.done():
+                # only cancellation completes a pending future; its slot was released then
+                if entry.future.cancelled():
+                    self._cancelled_pending -= 1
+                continue
+            partner = self._find_partner(entry)
+            if partner is None:
+                self._add_waiting(entry)
+                continue
+            self._remove_waiting(partner)
+            if self.history is not None:
+                self.history.record(entry.uid, partner.uid)
+            self._latencies.append(now - entry.enqueued_at)
+            self._latencies.append(now - partner.enqueued_at)
+            entry.future.set_result(partner.user)
+            partner.future.set_result(entry.user)
+            self.matched += 2
+            freed += 2
+        return freed
+
+    def _expire(self, now: float) -> int:
+        freed = 0
+        while self._waiting:
+            entry = next(iter(self._waiting.values()))
+            if entry.enqueued_at + self.max_wait > now and not entry.future.done():
+                break
+            self._remove_waiting(entry)
+            if not entry.future.done():
+                entry.future.set_result(None)
+                self.timed_out += 1
+            freed += 1
+        return freed
+
+    def _compatible_groups(self, entry: _Entry) -> Iterator['OrderedDict[Any, _Entry]']:
+        groups = self._buckets.get(entry.bucket)
+        if not groups:
+            return
+        for combo, group in groups.items():
+            if combos_compatible(entry.combo, combo):
+                yield group
+
+    def _find_partner(self, entry: _Entry) -> Optional[_Entry]:
+        """Oldest waiting entry compatible with `entry`, scanning at most `max_scan` per group."""
+        best = None
+        for group in self._compatible_groups(entry):
+            scanned = 0
+            for other in group.values():
+                if best is not None and other.enqueued_at >= best.enqueued_at:
+                    break
+                scanned += 1
+                if scanned > self.max_scan:
+                    break
+                if other.uid == entry.uid or other.future.done():
+                    continue
+                if self._acceptable(entry, other):
+                    best = other
+                    break
+        return best
+
+    def _acceptable(self, entry: _Entry, other: _Entry) -> bool:
+        if self.history is not None and self.history.have_matched(entry.uid, other.uid):
+            return False
+        return age_compatible(entry.user, other.user)
+
+    def _add_waiting(self, entry: _Entry) -> None:
+        previous = self._waiting.get(entry.uid)
+        if previous is not None:
+            # re-queued user: the newer request replaces the older one
+            self._remove_waiting(previous)
+            if not previous.future.done():
+                previous.future.set_result(None)
+        self._waiting[entry.uid] = entry
+        groups = self._buckets.setdefault(entry.bucket, {})
+        groups.setdefault(entry.combo, OrderedDict())[entry.uid] = entry
+
+    def _on_cancel(self, entry: _Entry) -> None:
+        # a caller gave up on its future: free the slot now instead of at expiry
+        if self._stopped:
+            return
+        if self._waiting.get(entry.uid) is entry:
+            self._remove_waiting(entry)
+        else:
+            self._cancelled_pending += 1
+        self._released += 1
+        self._wakeup.set()
+
+    def _remove_waiting(self, entry: _Entry) -> None:
+        self._waiting.pop(entry.uid, None)
+        groups = self._buckets.get(entry.bucket)
+        if groups is None:
+            return
+        group = groups.get(entry.combo)
+        if group is not None and group.get(entry.uid) is entry:
+            del group[entry.uid]
+            if not group:
+                del groups[entry.combo]
+                if not groups:
+                    del self._buckets[entry.bucket]
+
+    # metrics
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters plus p50/p99 enqueue-to-match latency (seconds) over recent matches."""
+        samples = list(self._latencies)
+        return {
+            'enqueued': self.enqueued,
+            'matched': self.matched,
+            'timed_out': self.timed_out,
+            'waiting': len(self._waiting),
+            'pending': len(self._pending),
+            'p50': percentile(samples, 50),
+            'p99': percentile(samples, 99),
+        }
@@ -0,0 +1,407 @@
+"""
+Room lifecycle management.
+
+`RoomRegistry` keeps rooms in per-shard dicts, each behind its own lock, so
+concurrent workers touching different rooms rarely contend. Idle rooms are
+expired by a hashed timer wheel per shard: each tick only looks at the rooms
+scheduled for that slot, never at every room.
+
+`ShardedRoomService` offers the same API with each shard living in its own
+worker process.
+"""
+import multiprocessing
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+class RoomError(Exception):
+    """Base class for room lifecycle errors."""
+
+
+class RoomNotFound(RoomError, KeyError):
+    """The room does not exist (never created, closed or expired)."""
+
+
+class RoomFull(RoomError):
+    """The room is already at capacity."""
+
+
+def shard_of(room_id: str, num_shards: int) -> int:
+    """Stable shard number for `room_id` (the same in every process)."""
+    return zlib.crc32(room_id.encode('utf-8')) % num_shards
+
+
+class Room:
+    __slots__ = ('id', 'members', 'capacity', 'created_at', 'last_active', 'deadline')
+
+    def __init__(self, room_id: str, members: Iterable[Any], capacity: int, now: float):
+        self.id = room_id
+        self.members: List[Any] = list(members)
+        self.capacity = capacity
+        self.created_at = now
+        self.last_active = now
+        # deadline the room is currently filed under in the timer wheel
+        self.deadline = now
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'members': list(self.members),
+            'capacity': self.capacity,
+            'created_at': self.created_at,
+            'last_active': self.last_active,
+        }
+
+
+class TimerWheel:
+    """Hashed timing wheel of keys with deadlines.
+
+    Keys land in the slot of their deadline tick; `advance` walks only the slots
+    between the last call and `now`. Entries are not moved when a deadline is
+    pushed back: `advance` hands each due key to `check`, which returns the
+    key's current deadline (reschedule), or None to report it as expired.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512, now: float = 0.0):
+        self.tick = tick
+        self._slots: List[Dict[Any, float]] = [{} for _ in range(slots)]
+        self._current = int(now // tick)
+
+    def schedule(self, key: Any, deadline: float) -> None:
+        tick = max(int(deadline // self.tick), self._current)
+        self._slots[tick % len(self._slots)][key] = deadline
+
+    def cancel(self, key: Any, deadline: float) -> None:
+        tick = max(int(deadline // self.tick), self._current)
+        self._slots[tick % len(self._slots)].pop(key, None)
+
+    def advance(self, now: float, check: Callable[[Any], Optional[float]]) -> List[Any]:
+        expired = []
+        target = int(now // self.tick)
+        # never walk more than one full turn of the wheel
+        start = max(self._current, target - len(self._slots) + 1)
+        for tick in range(start, target + 1):
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            due = [(key, deadline) for key, deadline in slot.items() if deadline <= now]
+            for key, _ in due:
+                del slot[key]
+            for key, _ in due:
+                deadline = check(key)
+                if deadline is None:
+                    continue
+                if deadline <= now:
+                    expired.append(key)
+                else:
+                    self._slots[max(int(deadline // self.tick), target) % len(self._slots)][key] = deadline
+        self._current = target
+        return expired
+
+
+class _Shard:
+    __slots__ = ('lock', 'rooms', 'wheel', 'created', 'closed', 'expired')
+
+    def __init__(self, tick: float, now: float):
+        self.lock = threading.Lock()
+        self.rooms: Dict[str, Room] = {}
+        self.wheel = TimerWheel(tick, now=now)
+        # counters are per shard so they are guarded by the shard lock
+        self.created = 0
+        self.closed = 0
+        self.expired = 0
+
+
+class RoomRegistry:
+    """In-process room registry; see the module docstring.
+
+    Args:
+        num_shards: number of independently locked shards.
+        idle_timeout: seconds without activity after which a room expires.
+        capacity: default maximum members per room.
+        tick: timer wheel resolution in seconds.
+        clock: monotonic time source (overridable for tests and benchmarks).
+    """
+
+    def __init__(self, num_shards: int = 16, *, idle_timeout: float = 300.0, capacity: int = 2, tick: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.idle_timeout = idle_timeout
+        self.capacity = capacity
+        self.clock = clock
+        now = clock()
+        self._shards = [_Shard(tick, now) for _ in range(num_shards)]
+
+    def __len__(self) -> int:
+        return sum(len(shard.rooms) for shard in self._shards)
+
+    def _shard(self, room_id: str) -> _Shard:
+        return self._shards[shard_of(room_id, len(self._shards))]
+
+    def create(self, members: Sequence[Any] = (), *, room_id: Optional[str] = None, capacity: Optional[int] = None) -> str:
+        """Open a room with `members` and return its id."""
+        capacity = self.capacity if capacity is None else capacity
+        if len(members) > capacity:
+            raise RoomFull(f"{len(members)} members exceed capacity {capacity}")
+        room_id = room_id or uuid.uuid4().hex
+        shard = self._shard(room_id)
+        now = self.clock()
+        with shard.lock:
+            if room_id in shard.rooms:
+                raise RoomError(f"room {room_id} already exists")
+            room = shard.rooms[room_id] = Room(room_id, members, capacity, now)
+            room.deadline = now + self.idle_timeout
+            shard.wheel.schedule(room_id, room.deadline)
+            shard.created += 1
+        return room_id
+
+    def get(self, room_id: str) -> Dict[str, Any]:
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.rooms.get(room_id)
+            if room is None:
+                raise RoomNotFound(room_id)
+            return room.snapshot()
+
+    def join(self, room_id: str, member: Any) -> Dict[str, Any]:
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.rooms.get(room_id)
+            if room is None:
+                raise RoomNotFound(room_id)
+            if member not in room.members:
+                if len(room.members) >= room.capacity:
+                    raise RoomFull(room_id)
+                room.members.append(member)
+            room.last_active = self.clock()
+            return room.snapshot()
+
+    def leave(self, room_id: str, member: Any) -> Optional[Dict[str, Any]]:
+        """Remove `member`; the room closes (and None is returned) once it is empty."""
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.rooms.get(room_id)
+            if room is None:
+                raise RoomNotFound(room_id)
+            if member in room.members:
+                room.members.remove(member)
+            if not room.members:
+                self._close_locked(shard, room)
+                return None
+            room.last_active = self.clock()
+            return room.snapshot()
+
+    def touch(self, room_id: str) -> None:
+        """Record activity, pushing back the room's idle expiry."""
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.rooms.get(room_id)
+            if room is None:
+                raise RoomNotFound(room_id)
+            room.last_active = self.clock()
+
+    def close(self, room_id: str) -> bool:
+        """Close a room; False if it was already gone."""
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.rooms.get(room_id)
+            if room is None:
+                return False
+            self._close_locked(shard, room)
+            return True
+
+    def _close_locked(self, shard: _Shard, room: Room) -> None:
+        del shard.rooms[room.id]
+        shard.wheel.cancel(room.id, room.deadline)
+        shard.closed += 1
+
+    def expire(self, now: Optional[float] = None) -> List[str]:
+        """Close rooms idle for longer than `idle_timeout`; returns their ids."""
+        now = self.clock() if now is None else now
+        expired: List[str] = []
+        for shard in self._shards:
+            with shard.lock:
+                def deadline(room_id: str) -> Optional[float]:
+                    room = shard.rooms.get(room_id)
+                    if room is None:
+                        return None
+                    room.deadline = room.last_active + self.idle_timeout
+                    return room.deadline
+
+                for room_id in shard.wheel.advance(now, deadline):
+                    del shard.rooms[room_id]
+                    expired.append(room_id)
+                    shard.expired += 1
+        return expired
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'rooms': len(self),
+            'created': sum(shard.created for shard in self._shards),
+            'closed': sum(shard.closed for shard in self._shards),
+            'expired': sum(shard.expired for shard in self._shards),
+        }
+
+
+# multiprocess mode
+
+_METHODS = frozenset(('create', 'get', 'join', 'leave', 'touch', 'close', 'expire', 'stats'))
+# methods that act on every shard rather than on one room
+_BROADCAST = frozenset(('expire', 'stats'))
+
+
+def _combine(method: str, values: List[Any]) -> Any:
+    """Merge the per-worker results of a broadcast method."""
+    if method == 'expire':
+        return [room_id for ids in values for room_id in ids]
+    total: Dict[str, int] = {}
+    for stats in values:
+        for key, value in stats.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def _worker(conn, options: Dict[str, Any]) -> None:
+    registry = RoomRegistry(1, **options)
+    tick = options.get('tick', 1.0)
+    next_sweep = time.monotonic() + tick
+    while True:
+        # sweep on a fixed schedule, not only when idle, so busy shards expire rooms too
+        now = time.monotonic()
+        if now >= next_sweep:
+            registry.expire()
+            next_sweep = now + tick
+        if not conn.poll(max(0.0, next_sweep - now)):
+            continue
+        batch = conn.recv()
+        if batch is None:
+            break
+        replies = []
+        for method, args, kwargs in batch:
+            try:
+                replies.append((True, getattr(registry, method)(*args, **kwargs)))
+            except Exception as e:
+                replies.append((False, e))
+        conn.send(replies)
+    conn.close()
+
+
+class ShardedRoomService:
+    """`RoomRegistry` API with each shard owned by a separate worker process.
+
+    Room ids are generated here and routed by `shard_of`, so every call for a
+    room goes to the one process that owns it. `call_many` pipelines a batch of
+    calls across workers to amortize the IPC round trips.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, **options):
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self._conns = []
+        self._procs = []
+        for _ in range(self.num_workers):
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_worker, args=(child, options), daemon=True)
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+
+    def __enter__(self) -> 'ShardedRoomService':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        for conn in self._conns:
+            try:
+                conn.send(None)
+                conn.close()
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+        self._conns = []
+        self._procs = []
+
+    def call_many(self, calls: Iterable[Tuple[str, Tuple, Dict[str, Any]]]) -> List[Any]:
+        """Run (method, args, kwargs) calls; results come back in input order.
+
+        The first positional argument of every call except `expire`/`stats` must
+        be the room id (for `create`, pass `room_id=` or one is generated).
+        `expire` and `stats` go to every worker and their results are combined.
+        Exceptions raised by a worker are re-raised here after all replies arrive.
+        """
+        per_worker: List[List[Tuple[int, Tuple[str, Tuple, Dict[str, Any]]]]] = [[] for _ in self._conns]
+        broadcast: Dict[int, str] = {}
+        count = 0
+        for i, (method, args, kwargs) in enumerate(calls):
+            if method not in _METHODS:
+                raise AttributeError(method)
+            count += 1
+            if method in _BROADCAST:
+                broadcast[i] = method
+                for items in per_worker:
+                    items.append((i, (method, args, kwargs)))
+                continue
+            if method == 'create':
+                kwargs = dict(kwargs)
+                kwargs.setdefault('room_id', uuid.uuid4().hex)
+                room_id = kwargs['room_id']
+            elif args:
+                room_id = args[0]
+            else:
+                raise TypeError(f"{method} needs a room id as its first argument")
+            per_worker[shard_of(room_id, len(self._conns))].append((i, (method, args, kwargs)))
+        for conn, items in zip(self._conns, per_worker):
+            if items:
+                conn.send([call for _, call in items])
+        results: List[Any] = [None] * count
+        gathered: Dict[int, List[Any]] = {i: [] for i in broadcast}
+        error = None
+        for conn, items in zip(self._conns, per_worker):
+            if not items:
+                continue
+            for (i, _), (ok, value) in zip(items, conn.recv()):
+                if not ok:
+                    if error is None:
+                        error = value
+                elif i in gathered:
+                    gathered[i].append(value)
+                else:
+                    results[i] = value
+        if error is not None:
+            raise error
+        for i, method in broadcast.items():
+            results[i] = _combine(method, gathered[i])
+        return results
+
+    def _call(self, method: str, *args, **kwargs) -> Any:
+        return self.call_many([(method, args, kwargs)])[0]
+
+    def create(self, members: Sequence[Any] = (), *, room_id: Optional[str] = None, capacity: Optional[int] = None) -> str:
+        room_id = room_id or uuid.uuid4().hex
+        return self._call('create', members, room_id=room_id, capacity=capacity)
+
+    def get(self, room_id: str) -> Dict[str, Any]:
+        return self._call('get', room_id)
+
+    def join(self, room_id: str, member: Any) -> Dict[str, Any]:
+        return self._call('join', room_id, member)
+
+    def leave(self, room_id: str, member: Any) -> Optional[Dict[str, Any]]:
+        return self._call('leave', room_id, member)
+
+    def touch(self, room_id: str) -> None:
+        return self._call('touch', room_id)
+
+    def close(self, room_id: str) -> bool:
+        return self._call('close', room_id)
+
+    def expire(self) -> List[str]:
+        return self._call('expire')
+
+    def stats(self) -> Dict[str, int]:
+        return self._call('stats')
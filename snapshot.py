@@ -0,0 +1,166 @@
+"""
+Warm-start snapshots of the parsed user set.
+
+Parsing data/users.json is most of the start-up cost of main.py and the batch
+tools. `load_users` keeps a binary snapshot next to the source file
+(`<source>.snapshot`) holding the parsed users in `marshal` format, which loads
+two to three times faster than the JSON:
+
+    header   magic 'USNP', snapshot version, Python major/minor (marshal's
+             format is only stable within one version), source size,
+             source mtime (ns), BLAKE2b digest of the source
+    payload  marshal.dumps(users)
+
+A snapshot is used when the source's size and mtime match the header. When
+only the mtime changed (the file was touched or copied) the source is hashed,
+and a matching digest keeps the snapshot and refreshes the stored mtime;
+anything else rebuilds it from the JSON. Snapshots are local caches: marshal
+data is not meant to be shared between machines or trusted from elsewhere.
+
+Disable with the environment variable MATCHMAKING_SNAPSHOT=0.
+"""
+import gc
+import hashlib
+import json
+import marshal
+import os
+import struct
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from instrumentation import instrument
+from json_parser import iter_users, parse_json_file
+
+ENV_VAR = 'MATCHMAKING_SNAPSHOT'
+SUFFIX = '.snapshot'
+
+_MAGIC = b'USNP'
+_VERSION = 1
+# magic, version, python major, python minor, source size, source mtime_ns, digest
+_HEADER = struct.Struct('<4sHBBQq32s')
+# offset of the mtime field, refreshed in place
+_STAMP_AT = struct.calcsize('<4sHBBQ')
+_HASH_CHUNK = 1 << 20
+
+
+def snapshot_path(source: str | Path) -> Path:
+    p = Path(source)
+    return p.with_name(p.name + SUFFIX)
+
+
+def source_digest(source: str | Path) -> bytes:
+    h = hashlib.blake2b(digest_size=32)
+    with Path(source).open('rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+def _header(source: Path) -> bytes:
+    st = source.stat()
+    digest = source_digest(source)
+    return _HEADER.pack(_MAGIC, _VERSION, sys.version_info[0], sys.version_info[1], st.st_size, st.st_mtime_ns, digest)
+
+
+def write_snapshot(users: List[Dict[str, Any]], source: str | Path, path: Optional[str | Path] = None, *,
+                   header: Optional[bytes] = None) -> Path:
+    """Write a snapshot of `users` parsed from `source`, atomically; returns its path.
+
+    `header` is the stamp taken before `source` was parsed (default: now), so a
+    source edited mid-parse leaves a snapshot that is stale rather than wrong.
+    """
+    source = Path(source)
+    p = Path(path) if path is not None else snapshot_path(source)
+    if header is None:
+        header = _header(source)
+    payload = marshal.dumps(users)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', delete=False, dir=str(p.parent)) as tf:
+        tf.write(header)
+        tf.write(payload)
+        tmp = Path(tf.name)
+    tmp.replace(p)
+    return p
+
+
+def read_snapshot(source: str | Path, path: Optional[str | Path] = None) -> Optional[List[Dict[str, Any]]]:
+    """Users from the snapshot of `source`, or None when it is missing, stale or unreadable."""
+    source = Path(source)
+    p = Path(path) if path is not None else snapshot_path(source)
+    try:
+        st = source.stat()
+        with p.open('rb') as f:
+            raw = f.read(_HEADER.size)
+            if len(raw) != _HEADER.size:
+                return None
+            magic, version, major, minor, size, mtime_ns, digest = _HEADER.unpack(raw)
+            if magic != _MAGIC or version != _VERSION or (major, minor) != sys.version_info[:2] or size != st.st_size:
+                return None
+            if mtime_ns != st.st_mtime_ns:
+                if source_digest(source) != digest:
+                    return None
+                _refresh_stamp(p, st.st_mtime_ns)
+            data = f.read()
+        # the load allocates only acyclic containers; pausing the collector
+        # avoids repeated full scans of everything allocated so far
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            users = marshal.loads(data)
+        finally:
+            if enabled:
+                gc.enable()
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return users if isinstance(users, list) else None
+
+
+def _refresh_stamp(path: Path, mtime_ns: int) -> None:
+    try:
+        with path.open('r+b') as f:
+            f.seek(_STAMP_AT)
+            f.write(struct.pack('<q', mtime_ns))
+    except OSError:
+        pass
+
+
+def _enabled() -> bool:
+    return os.environ.get(ENV_VAR, '').strip().lower() not in ('0', 'off', 'false', 'no')
+
+
+@instrument(count=lambda result, *args, **kwargs: {'users_out': len(result)} if isinstance(result, list) else {})
+def load_users(source: str | Path, *, snapshot: Optional[str | Path] = None, use_snapshot: Optional[bool] = None) -> Optional[Any]:
+    """Parsed users of `source`, from its warm-start snapshot when it is fresh.
+
+    A cold load parses the JSON (NDJSON for .ndjson/.jsonl) and writes the
+    snapshot for next time; failures to write it are ignored. Like
+    `parse_json_file`, returns None when the source can't be read.
+    """
+    if use_snapshot is None:
+        use_snapshot = _enabled()
+    if use_snapshot:
+        users = read_snapshot(source, snapshot)
+        if users is not None:
+            return users
+    header = None
+    if use_snapshot:
+        try:
+            header = _header(Path(source))
+        except OSError:
+            pass
+    if Path(source).suffix in ('.ndjson', '.jsonl'):
+        try:
+            users = list(iter_users(str(source))) if Path(source).exists() else None
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON from file: {source}")
+            users = None
+    else:
+        users = parse_json_file(str(source))
+    if header is not None and isinstance(users, list):
+        try:
+            write_snapshot(users, source, snapshot, header=header)
+        except (OSError, ValueError):
+            pass
+    return users
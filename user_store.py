@@ -0,0 +1,333 @@
+"""
+Compact column-oriented storage for user profiles.
+
+`UserStore` keeps the fields produced by `generate_users.py` in typed columns
+instead of one dict per user:
+ - location, gender and locale strings are interned into small integer codes
+ - age, age preferences and credits live in `array` columns
+ - lat/lon are stored as doubles
+ - is_verified/is_banned are bit-packed into one byte per user
+
+`UserRecord` is a read-only mapping view over one row, so code written against
+plain user dicts (e.g. the filters in `filter/`) keeps working unchanged.
+"""
+import json
+import math
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from json_parser import iter_users
+
+_MISSING = object()
+
+STRING_COLUMNS = ('gender', 'preference_gender', 'city', 'state', 'region', 'country', 'county', 'language', 'timezone')
+INT_COLUMNS = {'age': 'h', 'minage_preference': 'h', 'maxage_preference': 'h', 'credits': 'q'}
+FLOAT_COLUMNS = ('lat', 'lon')
+FLAG_COLUMNS = ('is_verified', 'is_banned')
+
+# Per-row flag bits: value bit, then "field was present" bit, per flag column
+_FLAG_BITS = {name: (1 << (2 * i), 1 << (2 * i + 1)) for i, name in enumerate(FLAG_COLUMNS)}
+_INT_SENTINEL = {'h': -(1 << 15), 'q': -(1 << 63)}
+
+_MAGIC = b'USTR'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHxxQ')
+_LEN = struct.Struct('<Q')
+
+
+def _pack_array(arr: array) -> bytes:
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.typecode.encode('ascii') + arr.tobytes()
+
+
+def _unpack_array(data: bytes) -> array:
+    arr = array(chr(data[0]))
+    arr.frombytes(data[1:])
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+
+def _pack_strings(values: List[Optional[str]]) -> bytes:
+    """Length-prefixed UTF-8 strings; a length of -1 stands for None."""
+    encoded = [None if v is None else v.encode('utf-8') for v in values]
+    lengths = array('i', (-1 if b is None else len(b) for b in encoded))
+    packed = _pack_array(lengths)
+    return _LEN.pack(len(packed)) + packed + b''.join(b for b in encoded if b is not None)
+
+
+def _unpack_strings(data: bytes) -> List[Optional[str]]:
+    (n,) = _LEN.unpack_from(data, 0)
+    lengths = _unpack_array(data[_LEN.size:_LEN.size + n])
+    pos = _LEN.size + n
+    values: List[Optional[str]] = []
+    for length in lengths:
+        if length < 0:
+            values.append(None)
+        else:
+            values.append(data[pos:pos + length].decode('utf-8'))
+            pos += length
+    return values
+
+
+class _InternedColumn:
+    """Strings stored as indexes into a shared table; code 0 means missing."""
+
+    __slots__ = ('table', 'codes_of', 'codes')
+
+    def __init__(self):
+        self.table: List[Optional[str]] = [None]
+        self.codes_of: Dict[str, int] = {}
+        self.codes = array('H')
+
+    def append(self, val: Any) -> None:
+        if val is None:
+            code = 0
+        else:
+            val = sys.intern(str(val))
+            code = self.codes_of.get(val)
+            if code is None:
+                code = self.codes_of[val] = len(self.table)
+                self.table.append(val)
+                if code > 0xFFFF and self.codes.typecode == 'H':
+                    self.codes = array('I', self.codes)
+        self.codes.append(code)
+
+    def get(self, row: int) -> Any:
+        code = self.codes[row]
+        return _MISSING if code == 0 else self.table[code]
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.codes) + sys.getsizeof(self.table) + sys.getsizeof(self.codes_of)
+
+    @classmethod
+    def restore(cls, table: List[Optional[str]], codes: array) -> '_InternedColumn':
+        col = cls()
+        col.table = [None] + [sys.intern(v) for v in table[1:]]
+        col.codes_of = {v: i for i, v in enumerate(col.table) if i}
+        col.codes = codes
+        return col
+
+
+class UserRecord(Mapping):
+    """Read-only dict-like view of one `UserStore` row."""
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store: 'UserStore', row: int):
+        self._store = store
+        self._row = row
+
+    @property
+    def row(self) -> int:
+        return self._row
+
+    def __getitem__(self, key: str) -> Any:
+        val = self._store._value(self._row, key)
+        if val is _MISSING:
+            raise KeyError(key)
+        return val
+
+    def get(self, key: str, default: Any = None) -> Any:
+        val = self._store._value(self._row, key)
+        return default if val is _MISSING else val
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self._store._value(self._row, key) is not _MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        store = self._store
+        for key in store._field_order:
+            if store._value(self._row, key) is not _MISSING:
+                yield key
+        extra = store._extras[self._row] if store._extras is not None else None
+        if extra:
+            yield from extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"UserRecord({dict(self)!r})"
+
+
+class UserStore:
+    """Column store for users; see the module docstring for the layout.
+
+    Args:
+        users: optional iterable of user dicts to load.
+        keep_extra: also keep fields outside the compact schema (bio, answers, ...)
+            as one small dict per user. Off by default, which drops them.
+    """
+
+    def __init__(self, users: Optional[Iterable[Dict[str, Any]]] = None, *, keep_extra: bool = False):
+        self.uuids: List[Optional[str]] = []
+        self.usernames: List[Optional[str]] = []
+        self.strings = {name: _InternedColumn() for name in STRING_COLUMNS}
+        self.ints = {name: array(code) for name, code in INT_COLUMNS.items()}
+        self.floats = {name: array('d') for name in FLOAT_COLUMNS}
+        self.flags = bytearray()
+        self._row_of: Dict[str, int] = {}
+        self._extras: Optional[List[Optional[Dict[str, Any]]]] = [] if keep_extra else None
+        self._field_order = ('uuid', 'username') + FLAG_COLUMNS + tuple(INT_COLUMNS) + STRING_COLUMNS + FLOAT_COLUMNS
+        self._known = frozenset(self._field_order)
+        if users is not None:
+            self.extend(users)
+
+    @classmethod
+    def from_json(cls, file_path: str, *, keep_extra: bool = False) -> 'UserStore':
+        """Stream users from a JSON array or NDJSON file straight into a store."""
+        fields = None if keep_extra else tuple(('uuid', 'username') + FLAG_COLUMNS + tuple(INT_COLUMNS) + STRING_COLUMNS + FLOAT_COLUMNS)
+        return cls(iter_users(file_path, fields), keep_extra=keep_extra)
+
+    def __len__(self) -> int:
+        return len(self.uuids)
+
+    def __iter__(self) -> Iterator[UserRecord]:
+        for row in range(len(self.uuids)):
+            yield UserRecord(self, row)
+
+    def __getitem__(self, row: int) -> UserRecord:
+        if not -len(self.uuids) <= row < len(self.uuids):
+            raise IndexError(row)
+        return UserRecord(self, row % len(self.uuids))
+
+    def __contains__(self, uuid: object) -> bool:
+        return uuid in self._row_of
+
+    def append(self, user: Dict[str, Any]) -> int:
+        """Add one user dict and return its row number."""
+        row = len(self.uuids)
+        uid = user.get('uuid')
+        self.uuids.append(uid)
+        self.usernames.append(user.get('username'))
+        if uid is not None:
+            self._row_of[uid] = row
+        for name, col in self.strings.items():
+            col.append(user.get(name))
+        for name, col in self.ints.items():
+            val = user.get(name)
+            col.append(_INT_SENTINEL[col.typecode] if val is None else int(val))
+        for name, col in self.floats.items():
+            val = user.get(name)
+            col.append(math.nan if val is None else float(val))
+        bits = 0
+        for name, (value_bit, present_bit) in _FLAG_BITS.items():
+            if name in user:
+                bits |= present_bit
+                if user[name]:
+                    bits |= value_bit
+        self.flags.append(bits)
+        if self._extras is not None:
+            extra = {k: v for k, v in user.items() if k not in self._known}
+            self._extras.append(extra or None)
+        return row
+
+    def extend(self, users: Iterable[Dict[str, Any]]) -> None:
+        for user in users:
+            self.append(user)
+
+    def row_of(self, uuid: str) -> Optional[int]:
+        return self._row_of.get(uuid)
+
+    def get(self, uuid: str) -> Optional[UserRecord]:
+        """Return the view for `uuid`, or None if it isn't stored."""
+        row = self._row_of.get(uuid)
+        return None if row is None else UserRecord(self, row)
+
+    def _value(self, row: int, key: str) -> Any:
+        col = self.strings.get(key)
+        if col is not None:
+            return col.get(row)
+        col = self.ints.get(key)
+        if col is not None:
+            val = col[row]
+            return _MISSING if val == _INT_SENTINEL[col.typecode] else val
+        col = self.floats.get(key)
+        if col is not None:
+            val = col[row]
+            return _MISSING if math.isnan(val) else val
+        bits = _FLAG_BITS.get(key)
+        if bits is not None:
+            flags = self.flags[row]
+            return _MISSING if not flags & bits[1] else bool(flags & bits[0])
+        if key == 'uuid':
+            val = self.uuids[row]
+        elif key == 'username':
+            val = self.usernames[row]
+        elif self._extras is not None and self._extras[row]:
+            return self._extras[row].get(key, _MISSING)
+        else:
+            return _MISSING
+        return _MISSING if val is None else val
+
+    def to_bytes(self) -> bytes:
+        """Serialize the columns into one compact little-endian blob (see `from_bytes`).
+
+        Much smaller and faster to load than pickling the equivalent user dicts,
+        which makes it suitable for shipping shards to worker processes.
+        """
+        sections = [_pack_strings(self.uuids), _pack_strings(self.usernames)]
+        for name in STRING_COLUMNS:
+            col = self.strings[name]
+            sections.append(_pack_strings(col.table))
+            sections.append(_pack_array(col.codes))
+        for name in INT_COLUMNS:
+            sections.append(_pack_array(self.ints[name]))
+        for name in FLOAT_COLUMNS:
+            sections.append(_pack_array(self.floats[name]))
+        sections.append(bytes(self.flags))
+        sections.append(b'' if self._extras is None else json.dumps(self._extras, separators=(',', ':')).encode('utf-8'))
+        parts = [_HEADER.pack(_MAGIC, _VERSION, len(self.uuids))]
+        for section in sections:
+            parts.append(_LEN.pack(len(section)))
+            parts.append(section)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'UserStore':
+        """Rebuild a store written by `to_bytes`."""
+        magic, version, _ = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("not a serialized UserStore")
+        view = memoryview(data)
+        pos = _HEADER.size
+        sections = []
+        while pos < len(data):
+            (n,) = _LEN.unpack_from(data, pos)
+            pos += _LEN.size
+            sections.append(bytes(view[pos:pos + n]))
+            pos += n
+        it = iter(sections)
+        extras_present = bool(sections[-1])
+        store = cls(keep_extra=extras_present)
+        store.uuids = _unpack_strings(next(it))
+        store.usernames = _unpack_strings(next(it))
+        store._row_of = {uid: i for i, uid in enumerate(store.uuids) if uid is not None}
+        for name in STRING_COLUMNS:
+            table = _unpack_strings(next(it))
+            store.strings[name] = _InternedColumn.restore(table, _unpack_array(next(it)))
+        for name in INT_COLUMNS:
+            store.ints[name] = _unpack_array(next(it))
+        for name in FLOAT_COLUMNS:
+            store.floats[name] = _unpack_array(next(it))
+        store.flags = bytearray(next(it))
+        extras = next(it)
+        if extras_present:
+            store._extras = json.loads(extras)
+        return store
+
+    def memory_bytes(self) -> int:
+        """Approximate bytes held by the store (columns, uuid strings and the uuid index)."""
+        total = sys.getsizeof(self.uuids) + sys.getsizeof(self.usernames) + sys.getsizeof(self.flags) + sys.getsizeof(self._row_of)
+        total += sum(sys.getsizeof(u) for u in self.uuids if u is not None)
+        total += sum(sys.getsizeof(u) for u in self.usernames if u is not None)
+        total += sum(col.nbytes() for col in self.strings.values())
+        total += sum(sys.getsizeof(col) for col in self.ints.values())
+        total += sum(sys.getsizeof(col) for col in self.floats.values())
+        return total